@@ -0,0 +1,81 @@
+''' Iterations the ant systems need to reach the same route cost
+
+Runs the colony as an Ant System and as a MAX-MIN Ant System, each with
+its default parameters and again with local search on the best ant, on
+random destinations in San Francisco, with the offline haversine metric.
+The target is the best cost the Ant System without local search finds in
+all its iterations; for each system the iteration it first reaches that
+cost is printed.  From the top of the repository:
+
+    python -m ants.benchmarks.mmas.run [destinations] [iterations] [seeds]
+
+'''
+import sys
+
+import numpy as np
+
+import ants.metric
+import ants.parameters as params
+from ants.engine.colony import Colony
+from ants.engine.destination import Destination
+from ants.engine.routemap import RouteMap
+
+SYSTEMS = [
+    ('as', {'ant_system': 'as'}),
+    ('mmas', {'ant_system': 'mmas'}),
+    ('as, local search', {'ant_system': 'as', 'local_search': 'best'}),
+    ('mmas, local search', {'ant_system': 'mmas', 'local_search': 'best'}),
+]
+
+def random_routemap(count, seed):
+    ''' A RouteMap of count random destinations in San Francisco '''
+    random_state = np.random.RandomState(seed)
+    lat_lngs = random_state.uniform([37.70, -122.50], [37.80, -122.40],
+                                    (count, 2))
+    return RouteMap([Destination('%f,%f' % tuple(lat_lng))
+                     for lat_lng in lat_lngs])
+
+def best_costs(routemap, seed, iterations, num_ants, parameters):
+    ''' Best cost so far after each iteration, with some parameters set '''
+    previous = dict((name, params.get_parameter(name))
+                    for name in parameters)
+    for name, value in parameters.iteritems():
+        params.set_parameter(name, value)
+    try:
+        np.random.seed(seed)
+        colony = Colony(routemap, num_ants=num_ants)
+        costs = []
+        for iteration in xrange(iterations):
+            colony.run_ants()
+            colony.update_pheromones()
+            costs.append(colony.best_cost)
+    finally:
+        for name, value in previous.iteritems():
+            params.set_parameter(name, value)
+    return np.array(costs)
+
+def first_reaching(costs, target):
+    ''' Iteration (counting from 1) costs first reach target, or None '''
+    reached = np.flatnonzero(costs <= target + 1e-9)
+    return reached[0] + 1 if len(reached) else None
+
+def run(count=50, iterations=300, seeds=3, num_ants=20):
+    ''' Print the iterations each system needs to reach the AS cost '''
+    previous = ants.metric.select('haversine')
+    try:
+        for seed in xrange(1, seeds + 1):
+            routemap = random_routemap(count, seed)
+            results = [(name, best_costs(routemap, seed, iterations,
+                                         num_ants, parameters))
+                       for name, parameters in SYSTEMS]
+            target = results[0][1][-1]
+            print "Seed %i: AS cost after %i iterations %.1f" % (
+                seed, iterations, target)
+            for name, costs in results:
+                print "   %-22s reaches it in %5s, final cost %.1f" % (
+                    name, first_reaching(costs, target), costs[-1])
+    finally:
+        ants.metric.select(previous)
+
+if __name__ == "__main__":
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -2,7 +2,7 @@ from ants.graph.destination import Destination
 from ants.graph.routemap import RouteMap
 from ants.metric import metric
 
-metric.load()
+metric.open_store()
 
 if __name__ == "__main__":
     metric.loud()
@@ -140,6 +140,3 @@ try:
     rm = RouteMap(destinations)
 except Exception as ex:
     print ex.args
-
-if __name__ == "__main__":
-    metric.save()
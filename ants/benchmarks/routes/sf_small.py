@@ -4,7 +4,7 @@ from ants.metric import metric
 if __name__ == "__main__":
     metric.loud()
 
-metric.load()
+metric.open_store()
 
 destinations = [Destination(address) for address in 
       ['1400 WASHINGTON ST #1, SAN FRANCISCO, CA',
@@ -22,5 +22,3 @@ destinations = [Destination(address) for address in
        '1075 LOMBARD STREET, SAN FRANCISCO, CA',
        '1001 PINE STREET #605, SAN FRANCISCO, CA',
        '1701 JACKSON   STREET #609, SAN FRANCISCO, CA' ]]
-
-metric.save()
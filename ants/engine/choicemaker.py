@@ -5,19 +5,28 @@ Author: Evan K. Friis
 Functions to support making potential feasible delivery time choices for a
 destination, given a set of sample delivery times.
 
+Two engines are available: ChoiceMaker fits a spline to a histogram of the
+samples and finds its extrema by root finding, while KDEChoiceMaker works
+entirely on arrays over a fixed minute grid, and is much faster.
+batch_choices runs the latter on every column of a 2-D array of samples,
+e.g. the arrival times at all the destinations of a route.
+
 '''
 
 import numpy as np
 from scipy import interpolate
 
+import ants.parameters as params
+
 from utilities import operate_on_pairs, consecutive_pairs, less, more
-from rootfinder import find_roots
+from rootfinder import find_roots_array
 
 from itertools import izip
 
 import matplotlib.pyplot as plt
 
 import math
+import multiprocessing
 
 
 def merge_criteria(xx1, xx2, yy1, yy2):
@@ -95,6 +104,129 @@ def make_choices(maxima, minima, prob_func, stepsize=5, growth_min=5e-4):
                 break
         yield (low, high, total_area)
 
+def silverman_bandwidth(samples, axis=None):
+    ''' Rule of thumb bandwidth for a gaussian KDE of samples, or of each
+    slice of samples along axis '''
+    samples = np.asarray(samples, dtype=float)
+    spread = np.std(samples, axis=axis)
+    iqr = np.subtract(*np.percentile(samples, [75, 25], axis=axis))
+    spread = np.where(iqr > 0, np.minimum(spread, iqr/1.34), spread)
+    count = samples.size if axis is None else samples.shape[axis]
+    return 0.9*spread*count**-0.2
+
+def kde_from_counts(counts, width, bandwidths):
+    ''' Gaussian KDEs of rows of bin counts, with one bandwidth per row
+
+    The counts are convolved with the kernels through FFTs.  Bandwidths are
+    never narrower than a bin.  Each density is normalized over the bins.
+    '''
+    counts = np.atleast_2d(counts)
+    bins = counts.shape[1]
+    sigmas = np.maximum(bandwidths, width)/width
+    # Kernels out to 4 sigma, at most the whole grid
+    reach = min(int(math.ceil(4*np.max(sigmas))), bins)
+    offsets = np.arange(-reach, reach+1)
+    kernels = np.exp(-0.5*(offsets/np.reshape(sigmas, (-1, 1)))**2)
+    kernels /= kernels.sum(axis=1)[:, np.newaxis]
+    # Pad so the convolution doesn't wrap around
+    size = 2**int(math.ceil(math.log(bins + 2*reach, 2)))
+    density = np.fft.irfft(np.fft.rfft(counts, size, axis=1)
+                           *np.fft.rfft(kernels, size, axis=1),
+                           size, axis=1)[:, reach:reach+bins]
+    # Remove FFT round off, which would make spurious extrema
+    density[density < 1e-12*density.max(axis=1)[:, np.newaxis]] = 0.
+    totals = density.sum(axis=1)*width
+    density /= np.where(totals > 0, totals, 1.)[:, np.newaxis]
+    return density
+
+def binned_kde(samples, bandwidth=None, bins=1440, range=(0, 1440)):
+    ''' Gaussian kernel density estimate of samples on a grid
+
+    Returns the bin centers and the density there, normalized over the
+    range.  The bandwidth defaults to Silverman's rule.
+    '''
+    counts, edges = np.histogram(samples, bins=bins, range=range)
+    width = edges[1] - edges[0]
+    centers = 0.5*(edges[:-1] + edges[1:])
+    if bandwidth is None:
+        bandwidth = silverman_bandwidth(samples)
+    return centers, kde_from_counts(counts, width, [bandwidth])[0]
+
+def binned_kde_columns(samples, bandwidth=None, bins=1440, range=(0, 1440)):
+    ''' binned_kde of each column of a 2-D array of samples
+
+    All columns are binned in one pass.  Returns the bin centers, and a
+    (columns x bins) array of densities.
+    '''
+    samples = np.asarray(samples, dtype=float)
+    columns = samples.shape[1]
+    edges = np.linspace(range[0], range[1], bins+1)
+    width = edges[1] - edges[0]
+    bin_index = np.floor((samples - range[0])/width).astype(int)
+    # As in np.histogram, the last bin includes its upper edge
+    bin_index[samples == range[1]] = bins - 1
+    inside = (bin_index >= 0) & (bin_index < bins)
+    flat_index = (np.arange(columns)*bins + bin_index)[inside]
+    counts = np.bincount(flat_index, minlength=columns*bins).reshape(
+        columns, bins)
+    if bandwidth is None:
+        bandwidth = silverman_bandwidth(samples, axis=0)
+    bandwidths = np.resize(bandwidth, columns)
+    return (0.5*(edges[:-1] + edges[1:]),
+            kde_from_counts(counts, width, bandwidths))
+
+def extrema(values):
+    ''' Return the indices of the maxima and minima of sampled values
+
+    Found from sign changes of the discrete derivative.  Flat stretches keep
+    the slope before them, so a plateau counts once, at its end.
+    '''
+    slope = np.sign(np.diff(values))
+    # Carry the last non-zero slope over flat stretches
+    last_sloped = np.maximum.accumulate(
+        np.where(slope != 0, np.arange(len(slope)), 0))
+    slope = slope[last_sloped]
+    maxima = np.flatnonzero((slope[:-1] > 0) & (slope[1:] < 0)) + 1
+    minima = np.flatnonzero((slope[:-1] < 0) & (slope[1:] > 0)) + 1
+    return maxima, minima
+
+def merge_peaks(maxima, positions, values, merge_criteria=merge_criteria):
+    ''' Merge maxima (indices into positions and values) in a single pass
+
+    As in peak_merger, the lower maximum of a pair meeting the merge criteria
+    is dropped; a surviving right hand peak is then checked against its new
+    left neighbour.  Returns the kept maxima.
+    '''
+    kept = []
+    for index in maxima:
+        while kept and merge_criteria(positions[kept[-1]], positions[index],
+                                      values[kept[-1]], values[index]):
+            left = kept.pop()
+            if values[left] > values[index]:
+                index = left
+        kept.append(index)
+    return kept
+
+def window_growth(starts, lows, highs, cdf, stepsize=5, growth_min=5e-4):
+    ''' Grow windows about starts in steps, bounded by lows and highs
+
+    Vectorized make_choices: each window stops growing once the last step
+    added less than a growth_min fraction of its area, or when it reaches
+    its bounds.  cdf(times) gives the cumulative probability.  Yields
+    (low, high, area) for each window.
+    '''
+    for start, low, high in izip(starts, lows, highs):
+        steps = max(int(math.ceil(max(start - low, high - start)/stepsize)),
+                    1)
+        reach = stepsize*np.arange(1, steps+1)
+        win_lows = np.maximum(start - reach, low)
+        win_highs = np.minimum(start + reach, high)
+        areas = cdf(win_highs) - cdf(win_lows)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stopped = np.flatnonzero(areas[:-1]/areas[1:] > 1 - growth_min)
+        step = stopped[0] + 1 if len(stopped) else steps - 1
+        yield (win_lows[step], win_highs[step], areas[step])
+
 class ChoiceMaker(object):
     ''' Build set of time window choices 
 
@@ -124,8 +256,8 @@ class ChoiceMaker(object):
 
         # Find all roots (extremum - points where first derivative of pdf is
         # zero).  Also store the value of the second derivative
-        my_roots = [(root, self.pdf(root, der=2)) for root in 
-                    find_roots(lambda x:self.pdf(x, der=1), self.clean_bins)]
+        roots = find_roots_array(lambda x: self.pdf(x, der=1), self.clean_bins)
+        my_roots = zip(roots, self.pdf(roots, der=2))
 
         # Split into maxima and minima
         maxima = [ root for root, second_der in my_roots if second_der < 0 ]
@@ -166,6 +298,89 @@ class ChoiceMaker(object):
             plt.axvspan(min, max, color=str(color), alpha=0.25)
         plt.show()
 
+class KDEChoiceMaker(ChoiceMaker):
+    ''' Build set of time window choices, working on arrays
+
+    Same choices as ChoiceMaker, from a binned gaussian KDE of the samples
+    on a grid of one minute bins.  Extrema come from sign changes of its
+    discrete derivative, peaks are merged in one pass, and window areas are
+    taken from its cumulative sum.
+
+    '''
+    def __init__(self, samples, bandwidth=None, stepsize=5, growth_min=5e-4):
+        centers, density = binned_kde(samples, bandwidth)
+        self.set_density(centers, density, stepsize, growth_min)
+
+    @classmethod
+    def from_density(cls, centers, density, stepsize=5, growth_min=5e-4):
+        ''' Build the choices from an already computed density '''
+        maker = cls.__new__(cls)
+        maker.set_density(centers, density, stepsize, growth_min)
+        return maker
+
+    def set_density(self, centers, density, stepsize, growth_min):
+        ''' Make the choices for a density on a grid of bin centers '''
+        self.bin_centers, self.density = (centers, density)
+        width = self.bin_centers[1] - self.bin_centers[0]
+        # Cumulative probability at the bin edges
+        self.edges = np.append(self.bin_centers - 0.5*width,
+                               self.bin_centers[-1] + 0.5*width)
+        self.cdf = np.append(0., np.cumsum(self.density)*width)
+
+        maxima, minima = extrema(self.density)
+        # Only keep the peaks above the average, like ChoiceMaker
+        maxima = maxima[self.density[maxima] > np.average(self.density)]
+        maxima = merge_peaks(maxima, self.bin_centers, self.density)
+        # Windows are bounded by the lowest point between the peaks
+        bounds = [low + np.argmin(self.density[low:high])
+                  for low, high in consecutive_pairs(maxima)]
+        starts = self.bin_centers[maxima]
+        lows = np.append(self.edges[0], self.bin_centers[bounds])
+        highs = np.append(self.bin_centers[bounds], self.edges[-1])
+        self.choices = list(window_growth(
+            starts, lows, highs, self.cumulative, stepsize, growth_min))
+
+    def pdf(self, time, der=0):
+        ''' Density at time(s), or its derivatives '''
+        values = self.density
+        width = self.bin_centers[1] - self.bin_centers[0]
+        for order in range(der):
+            values = np.gradient(values, width)
+        return np.interp(time, self.bin_centers, values)
+
+    def cumulative(self, time):
+        ''' Probability before time(s) '''
+        return np.interp(time, self.edges, self.cdf)
+
+    def prob(self, time0, time1):
+        ''' Integral of pdf from time0 to time1 '''
+        return self.cumulative(time1) - self.cumulative(time0)
+
+def _column_choices(args):
+    ''' Choices for one density (pool worker) '''
+    return KDEChoiceMaker.from_density(*args).choices
+
+@params.use_parameters
+def batch_choices(samples, bandwidth=None, stepsize=5, growth_min=5e-4,
+                  choice_processes=None):
+    ''' Time window choices for each column of a 2-D array of samples
+
+    E.g. for the (simulations x destinations) arrival times from
+    RouteMap.hist_arrival_times.  The KDEs of all columns are computed
+    together, and their choices made in choice_processes processes.  Returns
+    a list of choices per column, as in KDEChoiceMaker.
+    '''
+    centers, densities = binned_kde_columns(samples, bandwidth)
+    work = [(centers, density, stepsize, growth_min) for density in densities]
+    if choice_processes <= 1:
+        return map(_column_choices, work)
+    pool = multiprocessing.Pool(choice_processes)
+    try:
+        return pool.map(_column_choices, work)
+    finally:
+        pool.close()
+        pool.join()
+
 
 if __name__ == "__main__":
     samples = np.concatenate((
@@ -3,88 +3,450 @@
 Holds an ensemble of ants, and the pheromone matrix
 
 '''
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
 import numpy as np
 import ants.parameters as params
 import ants.engine.operations as op
+import ants.engine.sampling as sampling
+import ants.engine.localsearch as localsearch
+
+def batched_routes(transition_matrix, num_ants, candidates=None):
+    ''' Build the routes of num_ants ants together
+
+    Returns a (num_ants x num_dest+1) array of routes.  Every step moves
+    each ant one hop, using a (num_ants x num_dest) visited matrix in place
+    of per-ant masked arrays.  If a (num_dest x k) array of candidates is
+    given, ants only choose among the unvisited candidates of their current
+    location, and consider every destination only when all are visited.
+
+    '''
+    num_dest = len(transition_matrix)
+    ants = np.arange(num_ants)
+    # Start at origin, and return to origin at end
+    routes = np.zeros((num_ants, num_dest+1), dtype=int)
+    visited = np.zeros((num_ants, num_dest), dtype=bool)
+    visited[:, 0] = True
+    current_locations = routes[:, 0]
+    for route_index in range(1, num_dest):
+        if candidates is None:
+            next_locations = _next_locations(
+                transition_matrix, visited, current_locations)
+        else:
+            next_locations = _next_candidates(
+                transition_matrix, visited, current_locations, candidates)
+        routes[:, route_index] = next_locations
+        visited[ants, next_locations] = True
+        current_locations = next_locations
+    return routes
+
+def single_route(transition_matrix, candidates=None):
+    ''' Build the route of a single ant, one hop at a time
+
+    The sequential counterpart of batched_routes, with the same candidates.
+    '''
+    num_dest = len(transition_matrix)
+    # Setup mask
+    mask = np.array([False]*num_dest, dtype=bool)
+    # Start at origin, all tbd points, and return to origin at end
+    route = np.zeros(num_dest+1, dtype=int)
+    current_location = 0
+    # Mark the origin as visited in the mask
+    mask[0] = True
+
+    # Index of route position
+    route_index = 1
+    while route_index < num_dest:
+        options = None
+        if candidates is not None:
+            options = candidates[current_location]
+            options = options[~mask[options]]
+        if options is not None and len(options):
+            # Only consider the unvisited candidates
+            next_location = options[op.select_edge_weighted(
+                transition_matrix[current_location, options])]
+        else:
+            # Get costs for traveling from current location to others
+            # note that only costs for edges to unvisted nodes are
+            # included.
+            next_location = op.select_edge_weighted(
+                np.ma.MaskedArray(
+                    transition_matrix[current_location, :], mask=mask))
+        # Update the route and mask
+        route[route_index] = next_location
+        mask[next_location] = True
+        # Move to the new location
+        current_location = next_location
+        route_index += 1
+    return route
+
+def _next_locations(transition_matrix, visited, current_locations):
+    ''' Choose the next hop of each ant among all unvisited destinations '''
+    # Only edges to unvisited nodes get any weight
+    weights = np.where(
+        visited, 0., transition_matrix[current_locations, :])
+    return op.select_edges_weighted(weights)
+
+def _next_candidates(transition_matrix, visited, current_locations,
+                     candidates):
+    ''' Choose the next hop of each ant among its unvisited candidates '''
+    ants = np.arange(len(current_locations))[:, np.newaxis]
+    options = candidates[current_locations]
+    weights = np.where(
+        visited[ants, options], 0.,
+        transition_matrix[current_locations[:, np.newaxis], options])
+    next_locations = np.empty(len(current_locations), dtype=int)
+    # Ants that have visited all their candidates consider every destination
+    stuck = ~np.any(weights, axis=1)
+    free_options = options[~stuck]
+    next_locations[~stuck] = free_options[
+        np.arange(len(free_options)),
+        op.select_edges_weighted(weights[~stuck])]
+    if np.any(stuck):
+        next_locations[stuck] = _next_locations(
+            transition_matrix, visited[stuck], current_locations[stuck])
+    return next_locations
+
+def route_costs(routemap, routes, include_timing=False):
+    ''' Total cost of each route, optionally including satisfaction costs '''
+    costs = routemap.total_tangible_costs_for_routes(routes)
+    if include_timing:
+        costs += [routemap.total_satisfaction_costs(route)
+                  for route in routes]
+    return costs
+
+def route_edges(routes, amounts):
+    ''' Start, end and amount of pheromone for every edge of every route
+
+    Returns three flat arrays, ready to be scatter-added into the pheromone
+    matrix.
+    '''
+    routes = np.asarray(routes)
+    hops = routes.shape[1] - 1
+    return (routes[:, :-1].ravel(), routes[:, 1:].ravel(),
+            np.repeat(amounts, hops))
+
+# State of a worker process in the colony's process pool
+_WORKER = {}
+
+def _init_worker(shared_transitions, routemap, candidates):
+    ''' Attach a pool worker to the shared transition matrix '''
+    num_dest = routemap.num_destinations()
+    _WORKER['transitions'] = np.frombuffer(
+        shared_transitions).reshape(num_dest, num_dest)
+    _WORKER['routemap'] = routemap
+    _WORKER['candidates'] = candidates
+
+def _run_ant_batch(task):
+    ''' Build and score a batch of ants inside a pool worker '''
+    num_ants, batch_ants, include_timing, seed = task
+    # Don't reuse the variates the parent drew ahead before the fork
+    sampling.seed(seed)
+    routemap = _WORKER['routemap']
+    if batch_ants:
+        routes = batched_routes(
+            _WORKER['transitions'], num_ants, _WORKER['candidates'])
+    else:
+        routes = np.array([single_route(_WORKER['transitions'],
+                                        _WORKER['candidates'])
+                           for ant in range(num_ants)])
+    return routes, route_costs(routemap, routes, include_timing)
 
 class Colony(object):
     ''' Colony - an ensemble of ants
     Colony manages the ants as the solve the routing problem.  Stores a
     copy of the route map, and each ant as it iterates.
 
+    With num_processes > 1 the ants are spread over a process pool.  The
+    transition matrix lives in shared memory, so the workers read it without
+    copies, and each worker hands back its routes and their costs.
+
+    The deposit_rule picks the ants that lay pheromone each iteration: every
+    ant, the iteration best, the best so far, or the rank_ants-1 best of the
+    iteration weighted by rank together with the best so far.
+
+    With ant_system 'mmas' the colony runs as a MAX-MIN Ant System: the
+    mmas_deposit ants lay pheromone (ranking mmas_rank_ants), the trails
+    evaporate at mmas_pheromone_decay and are kept between tau_min and
+    tau_max, and they are reset to tau_max when the best route has not
+    improved for mmas_stagnation iterations.  tau_max is the level the
+    trails of the best route so far settle at when it gets the most
+    pheromone one iteration can lay on an edge.
+
+    With a candidate_list_size of k, ants only look at the k cheapest
+    successors of their location until those have all been visited.
+
+    The local_search stage improves the best ant ('best') or every ant
+    ('all') of each iteration with 2-opt and Or-opt moves on the tangible
+    costs, before any pheromone is deposited.
+
     '''
     @params.use_parameters
-    def __init__(self, routemap=None, num_ants=None, initial_pheromone=None):
+    def __init__(self, routemap=None, num_ants=None, initial_pheromone=None,
+                 batch_ants=None, num_processes=None, deposit_rule=None,
+                 rank_ants=None, ant_system=None, mmas_deposit=None,
+                 mmas_rank_ants=None, mmas_p_best=None,
+                 mmas_stagnation=None, candidate_list_size=None,
+                 local_search=None, local_search_neighbours=None):
         self.routemap = routemap
         self.num_dest = routemap.num_destinations()
         self.num_ants = num_ants
+        self.batch_ants = batch_ants
+        self.num_processes = num_processes
+        self.deposit_rule = deposit_rule
+        self.rank_ants = rank_ants
+        if ant_system not in ('as', 'mmas'):
+            raise ValueError("Unknown ant system: %s" % ant_system)
+        self.ant_system = ant_system
+        if ant_system == 'mmas':
+            self.deposit_rule = mmas_deposit
+            self.rank_ants = mmas_rank_ants
+        self.mmas_p_best = mmas_p_best
+        self.mmas_stagnation = mmas_stagnation
+        # MMAS pheromone bounds, set once a route has been found
+        self.tau_min, self.tau_max = (None, None)
+        if local_search not in (None, 'best', 'all'):
+            raise ValueError("Unknown local search: %s" % local_search)
+        self.local_search = local_search
+        self.candidate_list_size = candidate_list_size
+        self.local_search_neighbours = local_search_neighbours
+        self.find_candidates()
         # Initialize pheromone array as ndest*ndest
+        self.initial_pheromone = initial_pheromone
         self.pheromones = np.array(
             [[initial_pheromone]*self.num_dest]*self.num_dest, dtype=float)
         self.routes_and_results = {}
+        # Best route found so far
+        self.best_cost = np.inf
+        self.best_route = None
+        # Iteration count, and the iteration the best route was found in
+        self.iteration = 0
+        self.last_improvement = 0
+        # Process pool and its shared transition matrix, built on first use
+        self.pool = None
+        self.shared_transitions = None
+        # Resolve the parameters of the per-iteration functions once
+        self.parameters = params.snapshot()
+        self.update_pheromones = self.parameters.bind(self.update_pheromones)
+        # Follow destinations added to or removed from the route map
+        routemap.attach(self)
 
-    def run_ants(self, include_timing=False):
-        ''' Run N ants and update the pheromone matrix '''
+    def find_candidates(self):
+        ''' Find the candidate and local search neighbour lists, if used '''
+        # Cheapest successors of each destination, if restricted
+        self.candidates = None
+        if 0 < self.candidate_list_size < self.num_dest - 1:
+            self.candidates = self.routemap.candidate_lists(
+                self.candidate_list_size)
+        self.neighbours = None
+        if (self.local_search and
+                self.local_search_neighbours < self.num_dest - 1):
+            self.neighbours = self.routemap.candidate_lists(
+                self.local_search_neighbours)
+
+    def destination_added(self, index):
+        ''' Grow the pheromones for a destination added to the route map '''
+        # New edges start out as they would in a new colony
+        level = self.initial_pheromone
+        if self.tau_max is not None:
+            level = self.tau_max
+        self.pheromones = np.insert(np.insert(
+            self.pheromones, index, level, axis=0), index, level, axis=1)
+        self.routemap_changed()
+
+    def destination_removed(self, index):
+        ''' Drop the pheromones of a destination removed from the route map '''
+        self.pheromones = np.delete(np.delete(
+            self.pheromones, index, axis=0), index, axis=1)
+        self.routemap_changed()
+
+    def routemap_changed(self):
+        ''' Carry on with the current pheromones on a changed route map
+
+        Routes found so far don't visit the same destinations any more, so
+        they are forgotten.  The process pool is restarted on next use.
+        '''
+        self.close()
+        self.num_dest = self.routemap.num_destinations()
+        self.find_candidates()
+        self.routes_and_results = {}
+        self.best_cost, self.best_route = (np.inf, None)
+        self.last_improvement = self.iteration
+
+    def transition_matrix(self, include_timing=False, out=None):
+        ''' Pheromone for each edge times inverse cost between each edge '''
         # Check if we are doing the initial run w/ no timing info.
-        cheapness = None
         if include_timing:
             cheapness = self.routemap.cheapness
         else:
             cheapness = self.routemap.tangible_cheapness
+        return np.multiply(cheapness, self.pheromones, out=out)
+
+    def build_route(self, transition_matrix):
+        ''' Build the route of a single ant, one hop at a time '''
+        return single_route(transition_matrix, self.candidates)
+
+    def build_routes_batched(self, transition_matrix):
+        ''' Build the routes of all ants together '''
+        return batched_routes(
+            transition_matrix, self.num_ants, self.candidates)
+
+    def build_routes(self, transition_matrix):
+        ''' Build one route for each ant '''
+        if self.batch_ants:
+            return self.build_routes_batched(transition_matrix)
+        return np.array([self.build_route(transition_matrix)
+                         for ant in range(self.num_ants)])
+
+    def start_pool(self):
+        ''' Start the worker pool, sharing the transition matrix with it '''
+        raw = RawArray('d', self.num_dest*self.num_dest)
+        self.shared_transitions = np.frombuffer(raw).reshape(
+            self.num_dest, self.num_dest)
+        self.pool = multiprocessing.Pool(
+            self.num_processes, initializer=_init_worker,
+            initargs=(raw, self.routemap, self.candidates))
+
+    def close(self):
+        ''' Shut down the worker pool, if any '''
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.shared_transitions = None
+
+    def run_ants_parallel(self, include_timing=False):
+        ''' Build and score the ants on the worker pool
 
-        # Transition matrix is pheromone for each edge times inverse cost
-        # between each edge 
-        transition_matrix = cheapness*self.pheromones
-
-        # Route initializer 
-        # Start at origin
-        route_init = [0]
-        # All tbd points excepting the origin
-        route_init.extend( [-1]*(self.num_dest-1) )
-        # Return to origin at end
-        route_init.append(0)
-
-        for ant in range(self.num_ants):
-            # Setup mask
-            mask = np.array([False]*self.num_dest, dtype=bool)
-            # Start at origin
-            current_location = 0
-            # Initialize route
-            route = np.array(route_init, dtype=int)
-            # Mark the origin as visited in the mask
-            mask[0] = True
-
-            # Index of route position
-            route_index = 1
-            while route_index < self.num_dest:
-                # Get costs for traveling from current location to others
-                # note that only costs for edges to unvisted nodes are included.
-                next_location = op.select_edge_weighted(
-                    np.ma.MaskedArray(
-                        transition_matrix[current_location, :], mask=mask))
-                # Update the route and mask
-                route[route_index] = next_location
-                mask[next_location] = True
-                # Move to the new location
-                current_location = next_location
-                route_index += 1
-            
-            # When done, update the pheromone matrix for this routes cost
-            cost = self.routemap.total_tangible_cost_for_route(route)
+        Returns the routes and their costs.
+        '''
+        if self.pool is None:
+            self.start_pool()
+        self.transition_matrix(include_timing, out=self.shared_transitions)
+        # Split the ants over the workers, each with its own random seed
+        batch_sizes = [len(batch) for batch in np.array_split(
+            np.arange(self.num_ants), self.num_processes) if len(batch)]
+        seeds = np.random.randint(2**31 - 1, size=len(batch_sizes))
+        results = self.pool.map(
+            _run_ant_batch,
+            [(size, self.batch_ants, include_timing, seed)
+             for size, seed in zip(batch_sizes, seeds)])
+        routes = np.vstack([batch_routes for batch_routes, _ in results])
+        costs = np.concatenate([batch_costs for _, batch_costs in results])
+        return routes, costs
 
+    def improve_routes(self, routes, costs, include_timing=False):
+        ''' Apply local search to the routes selected by local_search
+
+        Routes and costs are updated in place.  Moves are judged on the
+        tangible costs, so with timing included an improved route is only
+        kept if its full cost is lower.
+        '''
+        if self.local_search == 'best':
+            selected = [np.argmin(costs)]
+        else:
+            selected = range(len(routes))
+        for index in selected:
+            route, delta = localsearch.improve(
+                routes[index], self.routemap.tangible_costs, self.neighbours)
+            if delta >= 0:
+                continue
+            cost = costs[index] + delta
             if include_timing:
-                cost += self.routemap.total_satisfaction_costs
+                cost = route_costs(
+                    self.routemap, route[np.newaxis, :], include_timing)[0]
+            if cost < costs[index]:
+                routes[index], costs[index] = (route, cost)
+
+    def depositing_ants(self, routes, costs):
+        ''' Return the routes that deposit pheromone, and their amounts '''
+        costs = np.asarray(costs, dtype=float)
+        if self.deposit_rule == 'all':
+            return routes, 1.0/costs
+        if self.deposit_rule == 'iteration_best':
+            best = np.argmin(costs)
+            return routes[best:best+1], 1.0/costs[best:best+1]
+        if self.deposit_rule == 'global_best':
+            return [self.best_route], [1.0/self.best_cost]
+        if self.deposit_rule == 'rank':
+            ranked = np.argsort(costs)[:self.rank_ants-1]
+            weights = self.rank_ants - 1 - np.arange(len(ranked))
+            return (np.vstack((routes[ranked], [self.best_route])),
+                    np.append(weights/costs[ranked],
+                              self.rank_ants/self.best_cost))
+        raise ValueError("Unknown deposit rule: %s" % self.deposit_rule)
+
+    def deposit(self, routes, costs):
+        ''' Add the pheromone of the depositing ants in one scatter-add '''
+        starts, ends, amounts = route_edges(
+            *self.depositing_ants(routes, costs))
+        np.add.at(self.pheromones, (starts, ends), amounts)
+
+    def run_ants(self, include_timing=False):
+        ''' Run N ants and update the pheromone matrix '''
+        if self.num_processes > 1:
+            routes, costs = self.run_ants_parallel(include_timing)
+        else:
+            routes = self.build_routes(self.transition_matrix(include_timing))
+            costs = route_costs(self.routemap, routes, include_timing)
+
+        if self.local_search:
+            self.improve_routes(routes, costs, include_timing)
 
+        self.iteration += 1
+        for route, cost in zip(routes, costs):
             route_tuple = tuple(route)
-            if tuple(route) not in self.routes_and_results:
-                self.routes_and_results[route_tuple] = (cost, route) 
+            if route_tuple not in self.routes_and_results:
+                self.routes_and_results[route_tuple] = (cost, route)
+            if cost < self.best_cost:
+                self.best_cost, self.best_route = (cost, route)
+                self.last_improvement = self.iteration
 
-            # Update pheromone matrix
-            for start, end in op.consecutive_pairs(route):
-                self.pheromones[start, end] += 1.0/cost
+        # Update pheromone matrix
+        self.deposit(routes, costs)
 
     @params.use_parameters
-    def update_pheromones(self, pheromone_decay=None):
-        ''' Update pheromone matrix due to evaporation '''
-        self.pheromones = self.pheromones*(1-pheromone_decay)
+    def update_pheromones(self, pheromone_decay=None,
+                          mmas_pheromone_decay=None):
+        ''' Update pheromone matrix due to evaporation, at
+        mmas_pheromone_decay for a MAX-MIN Ant System '''
+        if self.ant_system == 'mmas':
+            pheromone_decay = mmas_pheromone_decay
+        self.pheromones *= (1-pheromone_decay)
+        if self.ant_system == 'mmas' and self.best_route is not None:
+            self.bound_pheromones(pheromone_decay)
 
+    def peak_deposit(self):
+        ''' Most pheromone the deposit rule lays on an edge in one
+        iteration, in multiples of the inverse cost of the routes '''
+        if self.deposit_rule == 'all':
+            return float(self.num_ants)
+        if self.deposit_rule == 'rank':
+            # rank_ants for the best so far, then rank_ants-1 down
+            ranks = min(self.rank_ants - 1, self.num_ants)
+            return self.rank_ants + ranks*(2*self.rank_ants - 1 - ranks)/2.
+        return 1.
+
+    def pheromone_bounds(self, pheromone_decay):
+        ''' Return MMAS (tau_min, tau_max) given the best route so far '''
+        tau_max = self.peak_deposit()/(pheromone_decay*self.best_cost)
+        p_dec = self.mmas_p_best**(1.0/self.num_dest)
+        # Average number of choices an ant has along a route
+        avg_choices = max(self.num_dest/2. - 1, 1.)
+        tau_min = tau_max*(1 - p_dec)/(avg_choices*p_dec)
+        return min(tau_min, tau_max), tau_max
+
+    def bound_pheromones(self, pheromone_decay):
+        ''' Clamp pheromones to the MMAS bounds, resetting on stagnation '''
+        first_bounds = self.tau_max is None
+        self.tau_min, self.tau_max = self.pheromone_bounds(pheromone_decay)
+        stagnated = (self.iteration - self.last_improvement >=
+                     self.mmas_stagnation)
+        if first_bounds or stagnated:
+            # (Re)initialize the trails at the upper bound
+            self.pheromones[:] = self.tau_max
+            self.last_improvement = self.iteration
+        else:
+            np.clip(self.pheromones, self.tau_min, self.tau_max,
+                    out=self.pheromones)
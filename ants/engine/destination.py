@@ -6,6 +6,7 @@ edges (distances between destinations)
 '''
 
 import ants.parameters as params
+import ants.engine.sampling as sampling
 from ants.metric import metric
 import numpy as np
 
@@ -15,7 +16,7 @@ class Destination(object):
     Stores an address, the latitude and longitude, and the time preferences for
     this destination.  Contains functions to determine times/distances to other
     destinations and a throw_delivery_time() function that can simulate variable
-    delivery durations at this address.
+    delivery durations at this address (throw_delivery_times(n) for arrays).
     
     '''
     def __init__(self, address=None, time_pref=None, 
@@ -28,25 +29,27 @@ class Destination(object):
         scale = float(delivery_time_variance)/delivery_time_avg
         shape = float(delivery_time_avg*delivery_time_avg) / \
                 delivery_time_variance
-
-        def gamma_func():
-            ''' Destination delivery time random throw 
-
-                 Compute our statistical distribution to use to throw expected
-                 delivery times.  Use a gamma function - for gamma, with shape
-                 parameter k and scale parameter theta, mean = k theta;
-                 variance = k theta^2 therefore, theta = variance/mean, k =
-                 mean^2/variance
-
-            '''
-            return np.random.gamma(shape, scale)
-
-        self.random_delivery_time = gamma_func
+        # Gamma distribution parameters, for array consumers
+        self.delivery_shape, self.delivery_scale = (shape, scale)
+
+        # Destination delivery time random throws
+        #
+        # Use a gamma function - for gamma, with shape parameter k and scale
+        # parameter theta, mean = k theta; variance = k theta^2 therefore,
+        # theta = variance/mean, k = mean^2/variance.  The throws come from
+        # a pool of pre-drawn values, shared by destinations with the same
+        # delivery time distribution.
+        self.delivery_times = sampling.gamma_pool(shape, scale)
+        self.random_delivery_time = self.delivery_times.throw
 
     def throw_delivery_time(self):
         ''' Return a random value representing delivery duration '''
         return self.random_delivery_time()
 
+    def throw_delivery_times(self, n):
+        ''' Return an array of n random delivery durations '''
+        return self.delivery_times.throw_many(n)
+
     def distance_to(self, other):
         ''' Return distance (in meters) to another Destination '''
         return metric.distance_between(self.address, other.address)
@@ -62,7 +65,23 @@ class Destination(object):
         return self.time_pref.satisfaction_probability(arrival_time)
 
     @params.use_parameters
-    def compatability_to(self, other, iterations=None):
+    def departure_times(self, iterations=None, mc_sampling=None):
+        ''' Throw times of leaving here, having arrived according to the time
+        preferences and stayed for the delivery time
+
+        With an mc_sampling other than 'random', the arrival and delivery
+        times come from antithetic, Latin hypercube or Sobol throws.
+        '''
+        if mc_sampling == 'random':
+            return (self.time_pref.random(iterations) +
+                    self.throw_delivery_times(iterations))
+        throws = sampling.uniforms(iterations, 2, mc_sampling)
+        return (self.time_pref.from_uniform(throws[:, 0]) +
+                self.delivery_times.from_uniform(throws[:, 1]))
+
+    @params.use_parameters
+    def compatability_to(self, other, iterations=None, mc_sampling=None,
+                         mc_tolerance=None, mc_batch=None):
         ''' Determine schedule compatability to another destination 
 
             Compatability is defined as the average satisfaction probability of
@@ -72,30 +91,37 @@ class Destination(object):
             *this* destination's time preferences.  If either this node, or its 
             partner have no preference, return 1, for full compatability.
 
+        '''
+        return self.compatability_estimate(
+            other, iterations=iterations, mc_sampling=mc_sampling,
+            mc_tolerance=mc_tolerance, mc_batch=mc_batch).value
+
+    @params.use_parameters
+    def compatability_estimate(self, other, iterations=None, mc_sampling=None,
+                               mc_tolerance=None, mc_batch=None):
+        ''' Estimate compatability_to, returning a sampling.Estimate
+
+        With an mc_tolerance, throws are drawn mc_batch at a time until the
+        standard error is below it (or iterations are used up), and the
+        Estimate tells how many were needed.
         '''
         if self.time_pref is None or other.time_pref is None:
-            return 1.
+            return sampling.Estimate(1., 0., 0)
         # Get time to other destination - eventually this should be Monte
         # Carlo'd
         transit_time = self.time_to(other)
-        satisfaction_prob = 0.
-
-        count = 0
-        while count < iterations:
-            count += 1
-            # Throw a bunch of random arrival times, assuming a priori that the
-            # time this location recieves it's package is distributed according
-            # to its time preference distribution.
-            arrival_time_here = self.time_pref.random()
-            delivery_time_here = self.throw_delivery_time()
-
+        def satisfaction(count):
+            ''' Satisfaction probability there, for count throws here '''
+            # Throw a bunch of random arrival times, assuming a priori that
+            # the time this location recieves it's package is distributed
+            # according to its time preference distribution, plus the
+            # delivery times.
+            departure_times_here = self.departure_times(
+                iterations=count, mc_sampling=mc_sampling)
             # Arrival time there is deterministic
-            arrival_time_there = arrival_time_here + \
-                    delivery_time_here + transit_time
-            # Get the probability of satisfaction for the other Destination for
-            # this arrial time
-            satisfaction_prob += \
-                    other.satisfaction_probability(arrival_time_there)
-
-        return satisfaction_prob/iterations
-
+            arrival_times_there = departure_times_here + transit_time
+            # Get the probability of satisfaction for the other Destination
+            # for these arrival times
+            return other.satisfaction_probability(arrival_times_there)
+        return sampling.adaptive_mean(satisfaction, iterations, mc_tolerance,
+                                      mc_batch)
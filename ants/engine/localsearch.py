@@ -0,0 +1,237 @@
+''' Local Search
+
+Improvement moves (2-opt and Or-opt) applied to the routes built by the ants.
+
+Routes are arrays of destination indices that start and end at the origin,
+which stays in place.  Costs are asymmetric: costs[i, j] is the cost of
+moving *from* i *to* j, so reversing a segment of a route changes the cost
+of every edge inside it.  Each move is evaluated in constant time from
+cumulative costs along the route, and applied by rewriting only the span
+it changes.  If neighbour lists are given (row i listing the cheapest
+successors of destination i, see RouteMap.candidate_lists) only moves
+creating an edge to a neighbour are tried.
+
+'''
+import collections
+
+import numpy as np
+
+# Smallest cost decrease counted as an improvement
+EPSILON = 1e-9
+
+def route_positions(route):
+    ''' Return the position of each destination in the route '''
+    positions = np.empty(len(route)-1, dtype=int)
+    positions[route[:-1]] = np.arange(len(route)-1)
+    return positions
+
+def prefix_costs(route, costs):
+    ''' Cumulative forward and backward edge costs along a route
+
+    forward[p] is the cost of travelling the route up to position p, and
+    backward[p] is the cost of travelling those same edges in reverse.
+    '''
+    starts, ends = (route[:-1], route[1:])
+    forward = np.concatenate(([0.], np.cumsum(costs[starts, ends])))
+    backward = np.concatenate(([0.], np.cumsum(costs[ends, starts])))
+    return forward, backward
+
+def reversal_delta(route, costs, forward, backward, first, last):
+    ''' Change in cost from reversing route[first:last+1]
+
+    last can also be an array of the last positions of several segments.
+    '''
+    before, after = (route[first-1], route[last+1])
+    return (costs[before, route[last]] + costs[route[first], after]
+            - costs[before, route[first]] - costs[route[last], after]
+            + (backward[last] - backward[first])
+            - (forward[last] - forward[first]))
+
+def move_delta(route, costs, first, length, position):
+    ''' Change in cost from moving route[first:first+length] in between
+    route[position] and route[position+1], keeping its direction
+
+    length and position can also be arrays, for several moves of segments
+    starting at first.
+    '''
+    last = first + length - 1
+    before, after = (route[first-1], route[last+1])
+    removal = (costs[before, after] - costs[before, route[first]]
+               - costs[route[last], after])
+    insertion = (costs[route[position], route[first]]
+                 + costs[route[last], route[position+1]]
+                 - costs[route[position], route[position+1]])
+    return removal + insertion
+
+def moved_segment(route, first, length, position):
+    ''' Return route with route[first:first+length] moved after position '''
+    route = np.array(route)
+    move_segment(route, route_positions(route), first, length, position)
+    return route
+
+def move_segment(route, positions, first, length, position):
+    ''' Move route[first:first+length] after position, in place
+
+    Only the span between the segment and position is rewritten, and the
+    positions of the destinations in it.
+    '''
+    last = first + length - 1
+    segment = route[first:last+1].copy()
+    if position > last:
+        start, end = (first, position)
+        route[first:position-length+1] = route[last+1:position+1].copy()
+        route[position-length+1:position+1] = segment
+    else:
+        start, end = (position+1, last)
+        route[position+length+1:last+1] = route[position+1:first].copy()
+        route[position+1:position+length+1] = segment
+    positions[route[start:end+1]] = np.arange(start, end+1)
+
+def reverse_segment(route, costs, forward, backward, positions, first, last):
+    ''' Reverse route[first:last+1] in place
+
+    The positions are updated over the segment, and the prefix costs over
+    the segment and its two end edges, shifting the ones after it.
+    '''
+    route[first:last+1] = route[first:last+1][::-1].copy()
+    positions[route[first:last+1]] = np.arange(first, last+1)
+    starts, ends = (route[first-1:last+1], route[first:last+2])
+    for prefix, edges in ((forward, costs[starts, ends]),
+                          (backward, costs[ends, starts])):
+        old_end = prefix[last+1]
+        prefix[first:last+2] = prefix[first-1] + np.cumsum(edges)
+        prefix[last+2:] += prefix[last+1] - old_end
+
+def _reversal_ends(route, positions, first, neighbours):
+    ''' Return the last positions of segments starting at first to try '''
+    last_index = len(route) - 2
+    if neighbours is None:
+        return np.arange(first+1, last_index+1)
+    # Reversing route[first:last+1] creates the edge
+    # route[first-1]->route[last]
+    lasts = positions[neighbours[route[first-1]]]
+    return lasts[(lasts > first) & (lasts <= last_index)]
+
+def _segment_moves(route, positions, first, max_length, neighbours):
+    ''' Return the lengths and insertion positions of the moves to try of
+    segments starting at first, as two arrays '''
+    lengths = np.arange(1, min(max_length, len(route)-1-first) + 1)
+    lasts = first + lengths - 1
+    if neighbours is None:
+        candidates = np.tile(np.arange(len(route)-1), (len(lengths), 1))
+    else:
+        # Inserting the segment before a destination creates the edge from
+        # the end of the segment to that destination.  The slot before the
+        # return to the origin is always tried, the origin's position
+        # being the start of the route.
+        candidates = np.empty((len(lengths), neighbours.shape[1]+1),
+                              dtype=int)
+        candidates[:, :-1] = positions[neighbours[route[lasts]]] - 1
+        candidates[:, -1] = len(route) - 2
+    keep = ((candidates >= 0) &
+            ((candidates < first-1) | (candidates > lasts[:, np.newaxis])))
+    return (np.repeat(lengths, keep.sum(axis=1)), candidates[keep])
+
+def _work_queue(route):
+    ''' Queue of all the destinations of route, and whether each is in it '''
+    queued = np.zeros(len(route)-1, dtype=bool)
+    queued[route[1:-1]] = True
+    return collections.deque(route[1:-1]), queued
+
+def _requeue(queue, queued, destinations):
+    ''' Put destinations back in the queue, unless already there '''
+    for destination in destinations:
+        if destination and not queued[destination]:
+            queued[destination] = True
+            queue.append(destination)
+
+def two_opt(route, costs, neighbours=None):
+    ''' Apply improving segment reversals until none is left
+
+    The segments starting at each destination taken from a queue are all
+    evaluated at once, and the best improving one reversed.  The
+    destinations at the ends of every reversal go back into the queue.
+    Once it runs dry, the whole route is checked again if anything moved,
+    since a reversal also changes the cost of reversing segments
+    overlapping it.  Returns the improved route and the change in its cost.
+    '''
+    route = np.array(route)
+    total_delta = 0.
+    forward, backward = prefix_costs(route, costs)
+    positions = route_positions(route)
+    moved = True
+    while moved:
+        moved = False
+        queue, queued = _work_queue(route)
+        while queue:
+            destination = queue.popleft()
+            queued[destination] = False
+            first = positions[destination]
+            if first >= len(route) - 2:
+                continue
+            lasts = _reversal_ends(route, positions, first, neighbours)
+            if not len(lasts):
+                continue
+            deltas = reversal_delta(
+                route, costs, forward, backward, first, lasts)
+            best = np.argmin(deltas)
+            if deltas[best] < -EPSILON:
+                last = lasts[best]
+                reverse_segment(route, costs, forward, backward, positions,
+                                first, last)
+                total_delta += deltas[best]
+                moved = True
+                _requeue(queue, queued, route[[first-1, first, last,
+                                               last+1]])
+    return route, total_delta
+
+def or_opt(route, costs, neighbours=None, max_length=3):
+    ''' Apply improving moves of segments of up to max_length destinations
+    until none is left
+
+    As in two_opt, the moves of the segments starting at each destination
+    of a queue are evaluated together and the best improving one made.
+    The destinations around both ends of every move go back into the queue,
+    until a check of the whole route finds nothing.  Returns the improved
+    route and the change in its cost.
+    '''
+    route = np.array(route)
+    total_delta = 0.
+    positions = route_positions(route)
+    moved = True
+    while moved:
+        moved = False
+        queue, queued = _work_queue(route)
+        while queue:
+            destination = queue.popleft()
+            queued[destination] = False
+            first = positions[destination]
+            lengths, candidates = _segment_moves(
+                route, positions, first, max_length, neighbours)
+            if not len(candidates):
+                continue
+            deltas = move_delta(route, costs, first, lengths, candidates)
+            best = np.argmin(deltas)
+            if deltas[best] < -EPSILON:
+                length, position = (lengths[best], candidates[best])
+                last = first + length - 1
+                touched = route[[first-1, first, last, last+1, position,
+                                 position+1]]
+                move_segment(route, positions, first, length, position)
+                total_delta += deltas[best]
+                moved = True
+                _requeue(queue, queued, touched)
+    return route, total_delta
+
+def improve(route, costs, neighbours=None):
+    ''' Alternate 2-opt and Or-opt until neither improves the route
+
+    Returns the improved route and the change in its cost.
+    '''
+    total_delta = 0.
+    while True:
+        route, two_opt_delta = two_opt(route, costs, neighbours)
+        route, or_opt_delta = or_opt(route, costs, neighbours)
+        total_delta += two_opt_delta + or_opt_delta
+        if two_opt_delta == 0. and or_opt_delta == 0.:
+            return route, total_delta
@@ -5,7 +5,9 @@ the route.
 
 '''
 import ants.parameters as params
+import ants.engine.sampling as sampling
 import numpy as np
+from ants.metric import metric
 from ants.engine.utilities import consecutive_pairs, operate_on_pairs
 
 def destination_cost_array(destinations, cost_func=lambda start, end: None):
@@ -26,35 +28,194 @@ def destination_cost_array(destinations, cost_func=lambda start, end: None):
             output[index_a, index_b] = cost_func(start, end)
     return output
 
+def travel_matrices(destinations):
+    ''' Return driving distances (in meters) and times (in minutes)
+
+    Both are N*N arrays, looked up in bulk from the metric in one pass.
+    '''
+    seconds, meters = metric.travel_matrices(
+        [dest.address for dest in destinations])
+    return meters, seconds/60.
+
+def travel_matrix(origins, destinations):
+    ''' Return driving distances (in meters) and times (in minutes) from
+    each of origins (rows) to each of destinations (columns)
+
+    Looked up in bulk from the metric in one pass.
+    '''
+    seconds, meters = metric.travel_matrix(
+        [dest.address for dest in origins],
+        [dest.address for dest in destinations])
+    return meters, seconds/60.
+
+@params.use_parameters
+def distance_costs(distances, dollar_per_km=None):
+    ''' Return cost matrix due to driving distance, given distances in m '''
+    return np.asarray(distances)*(dollar_per_km/1000.)
+
+@params.use_parameters
+def time_costs(times, dollar_per_hour=None):
+    ''' Return cost matrix due to driving time, given times in minutes '''
+    return np.asarray(times)*(dollar_per_hour/60.)
+
 @params.use_parameters
 def distance_cost_array(destinations, dollar_per_km=None):
     ''' Return cost matrix due to driving distance for a list of destinations'''
-    distance_cost = lambda start, end: \
-            start.distance_to(end)*dollar_per_km/1000.
-    return destination_cost_array(destinations, cost_func=distance_cost)
+    distances = metric.distance_matrix([dest.address for dest in destinations])
+    return distance_costs(distances, dollar_per_km=dollar_per_km)
 
 @params.use_parameters
 def time_cost_array(destinations, dollar_per_hour=None):
     ''' Return cost matrix due to driving time for a list of destinations '''
-    time_cost = lambda start, end: start.time_to(end)*dollar_per_hour/60.
-    return destination_cost_array(destinations, cost_func=time_cost)
+    return time_costs(times_array(destinations),
+                      dollar_per_hour=dollar_per_hour)
 
 def times_array(destinations):
-    time = lambda start, end: start.time_to(end)
-    return destination_cost_array(destinations, time)
+    ''' Return N*N array of driving times (in minutes) '''
+    return metric.time_matrix([dest.address for dest in destinations])
+
+def time_window_arrays(destinations):
+    ''' Flatten the time windows of a list of destinations into arrays
+
+    Returns (owners, starts, ends, prefs), with one entry per time window:
+    the index of the destination it belongs to, its start and end (in
+    reference minutes) and its normalized preference.  Windows are ordered
+    by owner.  Destinations without time preferences have no windows.
+    '''
+    time_prefs = [(index, dest.time_pref)
+                  for index, dest in enumerate(destinations)
+                  if dest.time_pref is not None]
+    if not time_prefs:
+        return (np.array([], dtype=int), np.array([]), np.array([]),
+                np.array([]))
+    return (np.concatenate([[index]*len(time_pref.windows)
+                            for index, time_pref in time_prefs]).astype(int),
+            np.concatenate([time_pref.window_starts
+                            for index, time_pref in time_prefs]),
+            np.concatenate([time_pref.window_ends
+                            for index, time_pref in time_prefs]),
+            np.concatenate([time_pref.window_prefs
+                            for index, time_pref in time_prefs]))
+
+@params.use_parameters
+def compatability_array(destinations, times=None, iterations=None,
+                        mc_sampling=None, mc_tolerance=None, mc_batch=None):
+    ''' Estimate Destination.compatability_to for every pair at once
+
+    For each destination, iterations arrival times (from its time
+    preferences) and delivery times are drawn as arrays (see
+    Destination.departure_times), and shared by all of its partners, which
+    are thus compared with common random numbers.  The arrival times at
+    every partner are then checked against all time windows together.
+    times is the N*N matrix of travel times, looked up from the destinations
+    if not given.
+    '''
+    return compatability_estimates(
+        destinations, times=times, iterations=iterations,
+        mc_sampling=mc_sampling, mc_tolerance=mc_tolerance,
+        mc_batch=mc_batch)[0]
+
+@params.use_parameters
+def compatability_estimates(destinations, times=None, iterations=None,
+                            mc_sampling=None, mc_tolerance=None,
+                            mc_batch=None):
+    ''' Return compatability_array, and the throws used for each row
+
+    With an mc_tolerance, each row is drawn mc_batch throws at a time, until
+    the standard errors of all its entries are below it (see
+    sampling.adaptive_mean).
+    '''
+    num_dest = len(destinations)
+    if times is None:
+        times = times_array(destinations)
+    owners, starts, ends, prefs = time_window_arrays(destinations)
+    has_pref = np.array([dest.time_pref is not None for dest in destinations])
+    windows = (starts, ends, prefs, first_windows(owners))
+    compatabilities = np.ones((num_dest, num_dest))
+    samples = np.zeros(num_dest, dtype=int)
+    for index, dest in enumerate(destinations):
+        if dest.time_pref is None:
+            continue
+        estimate = satisfaction_estimate(
+            dest, times[index, owners], windows, iterations=iterations,
+            mc_sampling=mc_sampling, mc_tolerance=mc_tolerance,
+            mc_batch=mc_batch)
+        compatabilities[index, has_pref] = estimate.value
+        samples[index] = estimate.samples
+    return compatabilities, samples
+
+def first_windows(owners):
+    ''' Index of the first window of each owner, in time_window_arrays '''
+    return np.flatnonzero(np.diff(owners, prepend=-1))
+
+@params.use_parameters
+def satisfaction_estimate(dest, transit_times, windows, iterations=None,
+                          mc_sampling=None, mc_tolerance=None, mc_batch=None):
+    ''' Estimate the satisfaction of the owners of some time windows, when
+    leaving dest for them (see Destination.compatability_to)
+
+    windows holds (starts, ends, prefs, first windows) of the windows,
+    ordered by owner, and transit_times the travel time to the owner of
+    each.  Returns a sampling.Estimate of the satisfaction of each owner.
+    '''
+    starts, ends, prefs, first = windows
+    def satisfaction(count):
+        ''' Satisfaction of each owner for count throws, count x owners '''
+        # Arrival time at the owner of each window, for each sample
+        arrivals = (dest.departure_times(iterations=count,
+                                         mc_sampling=mc_sampling) +
+                    transit_times[:, np.newaxis])
+        on_time = ((arrivals >= starts[:, np.newaxis]) &
+                   (arrivals <= ends[:, np.newaxis]))
+        return np.add.reduceat(prefs[:, np.newaxis]*on_time, first).T
+    return sampling.adaptive_mean(satisfaction, iterations, mc_tolerance,
+                                  mc_batch)
+
+@params.use_parameters
+def compatability_row_column(destinations, index, times, iterations=None,
+                             mc_sampling=None, mc_tolerance=None,
+                             mc_batch=None):
+    ''' Estimate the compatabilities from and to destinations[index] only
+
+    Returns the row and the column of compatability_array for index, with
+    O(N) work.  times is the N*N matrix of travel times (only its row and
+    column for index are used).
+    '''
+    num_dest = len(destinations)
+    row, column = (np.ones(num_dest), np.ones(num_dest))
+    dest = destinations[index]
+    if dest.time_pref is None:
+        return row, column
+    options = dict(iterations=iterations, mc_sampling=mc_sampling,
+                   mc_tolerance=mc_tolerance, mc_batch=mc_batch)
+    owners, starts, ends, prefs = time_window_arrays(destinations)
+    has_pref = np.array([other.time_pref is not None
+                         for other in destinations])
+    # Moving from index to all others, as in compatability_array
+    row[has_pref] = satisfaction_estimate(
+        dest, times[index, owners],
+        (starts, ends, prefs, first_windows(owners)), **options).value
+    # Moving from all others to index, checked against its windows only
+    time_pref = dest.time_pref
+    windows = (time_pref.window_starts, time_pref.window_ends,
+               time_pref.window_prefs, np.array([0]))
+    for partner in np.flatnonzero(has_pref):
+        column[partner] = satisfaction_estimate(
+            destinations[partner],
+            np.repeat(times[partner, index], len(time_pref.windows)),
+            windows, **options).value[0]
+    return row, column
 
 @params.use_parameters
 def compatability_cost_array(destinations, cost_per_sad_customer=None, 
-                             iterations=None):
+                             iterations=None, times=None):
     ''' Return cost matrix due to incompatability between destinations '''
-    def sadness_cost(start, end):
-        ''' Definte cost of sadness due to incompatibile destinations'''
-        if start == end:
-            return 0.
-        return (1 - start.compatability_to(end, iterations=iterations))*\
-                cost_per_sad_customer
-
-    return destination_cost_array(destinations, cost_func=sadness_cost)
+    costs = (1 - compatability_array(
+        destinations, times=times, iterations=iterations))*\
+            cost_per_sad_customer
+    # No cost of sadness for staying put
+    np.fill_diagonal(costs, 0.)
+    return costs
 
 def quantify_route(route, cost_func):
     ''' Yield cost_func(hop) for each hop in the route 
@@ -75,3 +236,14 @@ def select_edge_weighted(weights):
     # Find max value of array
     throw = np.random.rand()*max_sorted_masked_array(cumsum)
     return np.searchsorted(cumsum, throw)
+
+def select_edges_weighted(weights):
+    ''' Return one index per row of a 2d array, weighted by row contents
+
+    Zero weight entries are never selected, so visited nodes can be excluded
+    by zeroing their weights.  Uses a single random throw per row.
+    '''
+    cumsum = np.cumsum(weights, axis=1)
+    throws = np.random.rand(len(weights))*cumsum[:, -1]
+    # First index whose cumulative weight exceeds the throw
+    return np.sum(cumsum <= throws[:, np.newaxis], axis=1)
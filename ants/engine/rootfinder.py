@@ -3,20 +3,32 @@
 Author: Evan K. Friis
 
 Tools for finding roots of functions
+
+Functions which accept arrays can use the vectorized versions: the function
+is evaluated once over the whole grid, and all brackets are refined together
+with vectorized secant steps.  Roots of spline derivatives can also be
+solved for exactly.
 '''
-from scipy import optimize
+import math
+
+import numpy as np
+from scipy import interpolate, optimize
 from ants.engine.utilities import consecutive_pairs
 
-__all__ = ['find_roots', 'xfrange']
+__all__ = ['find_roots', 'find_roots_array', 'spline_roots', 'xfrange',
+           'frange']
 
 def root_domains(x_vals, func):
     ''' Yields x pairs that contain a zero crossing '''
-    for x1, x2 in consecutive_pairs(x_vals):
-        value1 = func(x1)
+    x_vals = iter(x_vals)
+    x1 = next(x_vals)
+    value1 = func(x1)
+    for x2 in x_vals:
         value2 = func(x2)
         # Check if opposite sign
         if value1*value2 <= 0:
             yield (x1, x2)
+        x1, value1 = (x2, value2)
 
 def find_roots_in(domains, func):
     ''' Yield roots of function, given a list of domains '''
@@ -34,7 +46,76 @@ def xfrange(min, max, step):
             val = max
         yield val
 
-def find_roots(func, between_points):
-    " Find all roots of a function between given points "
-    for root in find_roots_in(root_domains(between_points, func), func):
-        yield root
+def frange(min, max, step):
+    ''' Array of [min,max] by step, like xfrange.  Values are computed
+    directly, so they don't pick up the round off of adding up steps '''
+    if min > max:
+        raise ValueError, "min parameter must be less than max!"
+    count = int(math.ceil((max - min)/float(step))) + 1
+    return np.minimum(min + step*np.arange(count), max)
+
+def find_roots(func, between_points, vectorized=False):
+    ''' Find all roots of a function between given points
+
+    With vectorized, func must accept arrays (see find_roots_array).
+    '''
+    if vectorized:
+        return iter(find_roots_array(func, between_points))
+    return find_roots_in(root_domains(between_points, func), func)
+
+def find_roots_array(func, between_points, xtol=2e-12, max_iterations=100):
+    ''' Return an array of the roots of func between the given points
+
+    func is called on whole arrays of points.  Each pair of consecutive
+    points where it changes sign (or is zero) brackets a root, as in
+    root_domains, and all brackets are refined together with the Illinois
+    (modified regula falsi) method, bisecting whenever the secant step
+    would leave the bracket.
+    '''
+    x_vals = np.asarray(between_points, dtype=float)
+    if len(x_vals) < 2:
+        return np.empty(0)
+    values = func(x_vals)
+    brackets = np.flatnonzero(values[:-1]*values[1:] <= 0)
+    # The bracket ends: b is the latest estimate, and a keeps the sign change
+    a_vals, b_vals = (x_vals[brackets], x_vals[brackets+1])
+    fa_vals, fb_vals = (values[brackets], values[brackets+1])
+    # Roots right on the lower end are already found
+    lower = fa_vals == 0
+    b_vals[lower], fb_vals[lower] = (a_vals[lower], 0.)
+    active = np.flatnonzero(fb_vals != 0)
+    for iteration in xrange(max_iterations):
+        if len(active) == 0:
+            break
+        a, b = (a_vals[active], b_vals[active])
+        fa, fb = (fa_vals[active], fb_vals[active])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c = b - fb*(b - a)/(fb - fa)
+        outside = ~((c > np.minimum(a, b)) & (c < np.maximum(a, b)))
+        c[outside] = 0.5*(a + b)[outside]
+        fc = func(c)
+        # Keep a on the other side of the root from the new estimate, and
+        # halve its value if it is kept twice (the Illinois step)
+        flip = fb*fc < 0
+        a_vals[active] = np.where(flip, b, a)
+        fa_vals[active] = np.where(flip, fb, 0.5*fa)
+        b_vals[active], fb_vals[active] = (c, fc)
+        converged = (np.abs(c - b) <= xtol) | (fc == 0)
+        active = active[~converged]
+    return b_vals
+
+def spline_roots(tck, der=0, between=None):
+    ''' Return the roots of a spline (from splrep), or of its derivative
+
+    Solved exactly on each polynomial piece.  If given, only roots within
+    the (min, max) between are returned.
+    '''
+    poly = interpolate.PPoly.from_spline(tck)
+    if der:
+        poly = poly.derivative(der)
+    roots = poly.roots(extrapolate=False)
+    # Pieces which are zero throughout give nan
+    roots = np.unique(roots[np.isfinite(roots)])
+    if between is not None:
+        roots = roots[(roots >= between[0]) & (roots <= between[1])]
+    return roots
@@ -2,12 +2,68 @@
 
 Store a collection of nodes and information about their interrelations 
 
+Destinations can be added and removed later, computing or dropping only
+their rows and columns of the matrices.
+
+The cost matrices can be kept in a cache directory, as one .npy file each
+in a subdirectory named by a hash of everything they depend on (see
+routemap_key).  Building a RouteMap for the same destinations and
+parameters again then memory maps them instead of recomputing them.
+
+Route simulations can use variance reduction (the 'mc_sampling' and
+'common_random_numbers' parameters).  With common random numbers, every
+route is simulated with the same start times and the same delivery times
+at each destination, so differences between routes are not drowned in
+sampling noise.  The common throws are drawn from a seed kept by the
+RouteMap, so worker processes holding a copy of it throw the same ones.
+
 '''
+import hashlib
+import os
+import shutil
+import tempfile
+import weakref
 
 import ants.engine.operations as op
+import ants.engine.sampling as sampling
 import ants.parameters as params
+import ants.metric
 import numpy as np
 
+# Matrices kept in the cache
+CACHED_ARRAYS = ['travel_distances', 'times', 'distances', 'time_costs',
+                 'compatabilities', 'tangible_costs', 'costs', 'cheapness',
+                 'tangible_cheapness']
+# Parameters the cached matrices depend on
+CACHED_PARAMETERS = ['dollar_per_km', 'dollar_per_hour',
+                     'cost_per_sad_customer', 'iterations', 'mc_sampling',
+                     'mc_tolerance', 'mc_batch', 'detour_factor',
+                     'average_speed']
+
+def routemap_key(destinations, parameters=None):
+    ''' Return a hash of all the cost matrices of a RouteMap depend on
+
+    The ordered addresses, coordinates, time preferences and delivery time
+    distributions of the destinations, the metric used (with the data it
+    works from, see ants.metric.fingerprint) and the cost parameters.
+    '''
+    if parameters is None:
+        parameters = params.snapshot()
+    digest = hashlib.sha1()
+    digest.update(repr(ants.metric.fingerprint()))
+    digest.update(repr([parameters[name] for name in CACHED_PARAMETERS]))
+    for dest in destinations:
+        digest.update(repr((dest.address, dest.lat_lng, dest.delivery_shape,
+                            dest.delivery_scale)))
+        if dest.time_pref is None:
+            digest.update('no time preference')
+            continue
+        for values in (dest.time_pref.window_starts,
+                       dest.time_pref.window_ends,
+                       dest.time_pref.window_prefs):
+            digest.update(np.asarray(values, dtype=float).tostring())
+    return digest.hexdigest()
+
 class RouteMap(object):
     ''' Central point for informationg aboug graph edges
 
@@ -15,18 +71,148 @@ class RouteMap(object):
     between different points on the graph (i.e. delivery destinations)
 
     '''
-    def __init__(self, destinations=None):
+    def __init__(self, destinations=None, cache_dir=None):
+        self.destinations = destinations
+        # Resolve the parameters of the functions called for every route once
+        self.parameters = params.snapshot()
+        self.total_satisfaction_costs = self.parameters.bind(
+            self.total_satisfaction_costs)
+
+        # Cost matrices, from the cache if they are there
+        self.key = None
+        if cache_dir is None:
+            self.build_matrices()
+        else:
+            self.key = routemap_key(destinations, self.parameters)
+            directory = os.path.join(cache_dir, self.key)
+            if os.path.isdir(directory):
+                self.load(directory)
+            else:
+                self.build_matrices()
+                self.save(directory)
+
+        self.encode_destinations()
+        # Colonies to resize when destinations are added or removed
+        self.colonies = weakref.WeakSet()
+        self.resample()
+
+    def resample(self, seed=None):
+        ''' Draw new common random numbers for the route simulations
+
+        Colonies running on a process pool keep using the old ones until
+        their pool is restarted.
+        '''
+        if seed is None:
+            seed = np.random.randint(2**31)
+        self.common_seed = seed
+        # Throws and delivery times of every destination, drawn on first use
+        self.common_samples = None
+
+    def encode_destinations(self):
+        ''' Collect the delivery times and time windows into arrays '''
+        # Delivery time distribution of each destination
+        self.delivery_shapes = np.array(
+            [dest.delivery_shape for dest in self.destinations])
+        self.delivery_scales = np.array(
+            [dest.delivery_scale for dest in self.destinations])
+        self.encode_time_windows()
+
+    def attach(self, colony):
+        ''' Tell colony about destinations added or removed from now on '''
+        self.colonies.add(colony)
+
+    def edge_costs(self, distances, times, compatabilities):
+        ''' Return all the cost matrix entries of some edges, by name
+
+        Computed from their driving distances, times and compatabilities as
+        in build_matrices.
+        '''
+        costs = {'travel_distances': distances, 'times': times,
+                 'distances': op.distance_costs(distances),
+                 'time_costs': op.time_costs(times),
+                 'compatabilities': (1 - compatabilities)*
+                     self.parameters['cost_per_sad_customer']}
+        costs['tangible_costs'] = costs['distances'] + costs['time_costs']
+        costs['costs'] = costs['tangible_costs'] + costs['compatabilities']
+        # Staying put costs nothing, so its cheapness is infinite
+        with np.errstate(divide='ignore'):
+            costs['cheapness'] = 1.0/costs['costs']
+            costs['tangible_cheapness'] = 1.0/costs['tangible_costs']
+        return costs
+
+    def add_destination(self, destination):
+        ''' Add a destination at the end, returning its index
+
+        Only its row and column of each matrix are computed, with one bulk
+        metric lookup each and the compatabilities from and to it.
+        Attached colonies are resized.
+        '''
+        destinations = list(self.destinations) + [destination]
+        index = len(destinations) - 1
+        row_distances, row_times = [
+            matrix[0] for matrix in op.travel_matrix([destination],
+                                                     destinations)]
+        column_distances, column_times = [
+            matrix[:, 0] for matrix in op.travel_matrix(destinations,
+                                                        [destination])]
+        times = np.zeros((index+1, index+1))
+        times[index, :], times[:, index] = (row_times, column_times)
+        compat_row, compat_column = op.compatability_row_column(
+            destinations, index, times)
+        # No sadness for staying put
+        compat_row[index] = compat_column[index] = 1.
+        row_costs = self.edge_costs(row_distances, row_times, compat_row)
+        column_costs = self.edge_costs(column_distances, column_times,
+                                       compat_column)
+        for name in CACHED_ARRAYS:
+            matrix = np.empty((index+1, index+1))
+            matrix[:index, :index] = getattr(self, name)
+            matrix[index, :] = row_costs[name]
+            matrix[:, index] = column_costs[name]
+            setattr(self, name, matrix)
+        self.destinations_changed(destinations)
+        for colony in list(self.colonies):
+            colony.destination_added(index)
+        return index
+
+    def remove_destination(self, index):
+        ''' Remove the destination at index (not the origin)
+
+        The destinations after it move down one place.  Attached colonies
+        are resized.
+        '''
+        if index == 0:
+            raise ValueError("The origin can't be removed")
+        destinations = list(self.destinations)
+        del destinations[index]
+        for name in CACHED_ARRAYS:
+            setattr(self, name, np.delete(np.delete(
+                getattr(self, name), index, axis=0), index, axis=1))
+        self.destinations_changed(destinations)
+        for colony in list(self.colonies):
+            colony.destination_removed(index)
+
+    def destinations_changed(self, destinations):
+        ''' Use a new list of destinations, whose matrices are already set '''
         self.destinations = destinations
+        # The matrices no longer match a cache entry
+        self.key = None
+        self.encode_destinations()
+        self.common_samples = None
 
+    def build_matrices(self):
+        ''' Compute the cost matrices '''
+        destinations = self.destinations
         # Cache all the cost matrices
+        # Driving distance (meters) and travel time (minutes) between nodes,
+        # looked up once
+        self.travel_distances, self.times = op.travel_matrices(destinations)
+
         # Dollar cost due to distance between nodes
-        self.distances = op.distance_cost_array(destinations)
+        self.distances = op.distance_costs(self.travel_distances)
 
         # Dollar cost due to travel time between nodes
-        self.time_costs = op.time_cost_array(destinations)
-
-        # Travel time between nodes
-        self.times = op.times_array(destinations)
+        self.time_costs = op.time_costs(self.times)
 
         # Meta dollar cost due to schedule incompatability between nodes.  Note
         # that this cost is only used to estimate the 'cost of unsatisfaction,'
@@ -34,7 +220,7 @@ class RouteMap(object):
         # priori estimate of how compatabile the nodeA->nodeB transition is,
         # assuming that nodeA's arrival time is a satisfactory one.
         self.compatabilities = \
-                op.compatability_cost_array(destinations)
+                op.compatability_cost_array(destinations, times=self.times)
 
         # Tangible (distance & time) cost matrix
         self.tangible_costs = self.distances + self.time_costs
@@ -46,6 +232,46 @@ class RouteMap(object):
         self.cheapness = 1.0/self.costs
         self.tangible_cheapness = 1.0/self.tangible_costs
 
+    def save(self, directory):
+        ''' Save the cost matrices into directory, as .npy files
+
+        The files are written to a temporary directory which is then renamed,
+        so that concurrent runs never see a partial set.
+        '''
+        parent = os.path.dirname(os.path.abspath(directory))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        scratch = tempfile.mkdtemp(dir=parent)
+        for name in CACHED_ARRAYS:
+            np.save(os.path.join(scratch, name + '.npy'), getattr(self, name))
+        try:
+            os.rename(scratch, directory)
+        except OSError:
+            # Saved by someone else in the meantime
+            shutil.rmtree(scratch)
+
+    def load(self, directory):
+        ''' Memory map the cost matrices saved in directory (read only) '''
+        for name in CACHED_ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'),
+                                        mmap_mode='r'))
+
+    def encode_time_windows(self):
+        ''' Flatten the time windows of all destinations into arrays
+
+        The windows of destination i are found at window_offsets[i] onwards,
+        window_counts[i] of them.  Destinations without time preferences
+        have no windows.
+        '''
+        owners, self.window_starts, self.window_ends, self.window_prefs = \
+                op.time_window_arrays(self.destinations)
+        self.window_counts = np.bincount(
+            owners, minlength=self.num_destinations())
+        self.window_offsets = (np.cumsum(self.window_counts)
+                               - self.window_counts)
+        self.has_time_pref = np.array(
+            [dest.time_pref is not None for dest in self.destinations])
+
     def random_start_time(self):
         ''' Throw a departure time from the origin '''
         return self.destinations[0].time_pref.random()
@@ -58,6 +284,19 @@ class RouteMap(object):
         ''' Return inverse cost for all possible destinations from start '''
         return self.cheapness[start_index, :]
 
+    def candidate_lists(self, size):
+        ''' Return the size cheapest successors of every destination
+
+        Returns a (num_destinations x size) array, where row i lists the
+        destinations cheapest to reach from i, cheapest first.
+        '''
+        costs = self.tangible_costs.copy()
+        # Never list a destination as its own successor
+        np.fill_diagonal(costs, np.inf)
+        rows = np.arange(len(costs))[:, np.newaxis]
+        nearest = np.argpartition(costs, size-1, axis=1)[:, :size]
+        return nearest[rows, np.argsort(costs[rows, nearest], axis=1)]
+
     def tangible_cost_for_edge(self, start_index, end_index):
         ''' Return the tangible cost to travel from start to end '''
         return self.tangible_costs[start_index, end_index]
@@ -71,44 +310,178 @@ class RouteMap(object):
         return sum(op.quantify_route(
             route, cost_func=self.tangible_cost_for_edge))
 
+    def total_tangible_costs_for_routes(self, routes):
+        ''' Return total tangible cost for each row of a 2d array of routes '''
+        routes = np.asarray(routes)
+        return self.tangible_costs[routes[:, :-1], routes[:, 1:]].sum(axis=1)
+
+    def route_samples(self, route, iterations, mc_sampling='random',
+                      common_random_numbers=False):
+        ''' Throw start times and delivery times for simulating a route
+
+        Returns the start times and an (iterations x len(route)-1) array of
+        the delivery times at each departure, from throws drawn with
+        mc_sampling.  With common_random_numbers, the throws of each
+        destination are the same for every route.
+        '''
+        route = np.asarray(route)
+        departures = route[:-1]
+        if common_random_numbers:
+            num_dest = self.num_destinations()
+            if (self.common_samples is None or
+                    self.common_samples[0].shape != (iterations, num_dest+1)
+                    or self.common_samples[2] != mc_sampling):
+                throws = sampling.uniforms(
+                    iterations, num_dest+1, mc_sampling,
+                    np.random.RandomState(self.common_seed))
+                self.common_samples = (throws, sampling.gamma_from_uniform(
+                    self.delivery_shapes, self.delivery_scales, throws[:, 1:]),
+                    mc_sampling)
+            throws, delivery_times = self.common_samples[:2]
+            start_throws = throws[:, 0]
+            delivery_times = delivery_times[:, departures]
+        else:
+            throws = sampling.uniforms(iterations, len(route), mc_sampling)
+            start_throws = throws[:, 0]
+            delivery_times = sampling.gamma_from_uniform(
+                self.delivery_shapes[departures],
+                self.delivery_scales[departures], throws[:, 1:])
+        start_times = 0.
+        base_pref = self.destinations[route[0]].time_pref
+        if base_pref is not None:
+            start_times = base_pref.from_uniform(start_throws)
+        return start_times, delivery_times
+
+    def simulate_arrival_times(self, route, iterations, start_times=0.,
+                               delivery_times=None):
+        ''' Simulate arrival times at each position of a route
+
+        Returns an (iterations x len(route)) array.  Every stop after the
+        first takes a gamma distributed delivery time before the van moves
+        on to the next.  All delivery times are drawn in one call (unless
+        given as an (iterations x len(route)-1) array, see route_samples)
+        and accumulated along the route.
+        '''
+        route = np.asarray(route)
+        departures = route[:-1]
+        if delivery_times is None:
+            delivery_times = np.random.gamma(
+                self.delivery_shapes[departures],
+                self.delivery_scales[departures],
+                size=(iterations, len(departures)))
+        else:
+            delivery_times = np.array(delivery_times, dtype=float)
+        # Nothing to deliver where the route starts
+        delivery_times[:, 0] = 0.
+        arrival_times = np.empty((iterations, len(route)))
+        arrival_times[:, 0] = start_times
+        np.cumsum(delivery_times + self.times[departures, route[1:]], axis=1,
+                  out=arrival_times[:, 1:])
+        arrival_times[:, 1:] += arrival_times[:, :1]
+        return arrival_times
+
+    def satisfaction_counts(self, route, arrival_times):
+        ''' Number of satisfied customers in each simulation of a route
+
+        Every stop after the first is scored with the satisfaction
+        probability of its destination, given the arrival_times array from
+        simulate_arrival_times.
+        '''
+        route = np.asarray(route)
+        stops = route[1:]
+        # Customers without preferences are always satisfied
+        count = np.count_nonzero(~self.has_time_pref[stops])
+        # Route position and window index of every window along the route
+        counts = self.window_counts[stops]
+        positions = np.repeat(np.arange(1, len(route)), counts)
+        windows = (np.arange(counts.sum())
+                   - np.repeat(np.cumsum(counts) - counts, counts)
+                   + np.repeat(self.window_offsets[stops], counts))
+        times = arrival_times[:, positions]
+        on_time = ((times >= self.window_starts[windows]) &
+                   (times <= self.window_ends[windows]))
+        return count + np.dot(on_time, self.window_prefs[windows])
+
     def sim_arrival_times(self, route, start_time=0):
-        output = [0]*len(route)
-        current_time = start_time
-        # Departure from origin
-        output[0] = current_time
-        for start, end in op.consecutive_pairs(route):
-            # Sim delivery time @ starjt
-            current_time += self.destinations[end].throw_delivery_time()
-            # Travel from start to end
-            current_time += self.time_for_edge(start, end)
-            output[end] = current_time
-        return output
+        ''' Simulate arrival time at each destination of a route '''
+        return self.hist_arrival_times(route, 1, start_time)[0]
+
+    def hist_arrival_times(self, route, iterations=500, start_time=0):
+        ''' Simulate arrival times, indexed by destination
 
-    def hist_arrival_times(self, route, iterations=500):
+        Returns an (iterations x num_destinations) array.  If the route
+        returns to its start, that column holds the return time.
+        '''
+        route = np.asarray(route)
+        arrival_times = self.simulate_arrival_times(
+            route, iterations, start_time)
         # First axis is sim#, second is destination index
-        return np.array(
-            [self.sim_arrival_times(route) for i in range(iterations)])
+        output = np.zeros((iterations, self.num_destinations()))
+        output[:, route[:-1]] = arrival_times[:, :-1]
+        output[:, route[-1]] = arrival_times[:, -1]
+        return output
 
     @params.use_parameters
     def total_satisfaction_costs(self, route, iterations=None, 
-                                 cost_per_sad_customer=None):
-        ''' Simulate the route and determine average satisfaction '''
-        total_satisfaction = 0.
-        for iteration in range(iterations):
-            # Pull a random start time from the base
-            current_time = self.destinations[route[0]].time_pref.random()
-            for start, end in op.consecutive_pairs(route):
-                # Time to move from start to end
-                current_time = self.time_for_edge(start, end)
-                # Get our current customer
-                customer = self.destinations[end]
-                # Find if customer at end was satisfied
-                total_satisfaction += \
-                        customer.satisfaction_probability(current_time)
-                # Throw a random delivery time for this customer
-                current_time += customer.throw_delivery_time()
-        # Normalize satisfaction
-        normalization = iterations*1.0
-        return (1-(total_satisfaction / normalization))*cost_per_sad_customer
+                                 cost_per_sad_customer=None, mc_sampling=None,
+                                 common_random_numbers=None,
+                                 mc_tolerance=None, mc_batch=None):
+        ''' Simulate the route and determine average satisfaction cost
 
+        Returns the expected number of unsatisfied customers along the
+        route, times the cost per sad customer.  See route_samples for the
+        variance reduction options, and satisfaction_cost_estimate for the
+        adaptive ones.
+        '''
+        return self.satisfaction_cost_estimate(
+            route, iterations=iterations,
+            cost_per_sad_customer=cost_per_sad_customer,
+            mc_sampling=mc_sampling,
+            common_random_numbers=common_random_numbers,
+            mc_tolerance=mc_tolerance, mc_batch=mc_batch).value
+
+    @params.use_parameters
+    def satisfaction_cost_estimate(self, route, iterations=None,
+                                   cost_per_sad_customer=None,
+                                   mc_sampling=None,
+                                   common_random_numbers=None,
+                                   mc_tolerance=None, mc_batch=None):
+        ''' Estimate total_satisfaction_costs, returning a sampling.Estimate
 
+        With an mc_tolerance, the route is simulated mc_batch times at a
+        time until the standard error of the cost is below it (or iterations
+        simulations are used up), and the Estimate tells how many were
+        needed.  With common random numbers, the batches go through the
+        common throws in order.
+        '''
+        route = np.asarray(route)
+        stops = len(route) - 1
+        base_pref = self.destinations[route[0]].time_pref
+        if common_random_numbers:
+            common_starts, common_deliveries = self.route_samples(
+                route, iterations, mc_sampling, common_random_numbers)
+        # Simulations used so far
+        used = [0]
+        def sadness_costs(count):
+            ''' Satisfaction cost of each of count simulations '''
+            if common_random_numbers:
+                rows = slice(used[0], used[0] + count)
+                used[0] += count
+                start_times, delivery_times = (
+                    common_starts, common_deliveries[rows])
+                if base_pref is not None:
+                    start_times = common_starts[rows]
+            elif mc_sampling == 'random':
+                # Pull random start times from the base
+                start_times, delivery_times = (0., None)
+                if base_pref is not None:
+                    start_times = base_pref.random(count)
+            else:
+                start_times, delivery_times = self.route_samples(
+                    route, count, mc_sampling)
+            arrival_times = self.simulate_arrival_times(
+                route, count, start_times, delivery_times)
+            satisfied = self.satisfaction_counts(route, arrival_times)
+            return (stops - satisfied)*cost_per_sad_customer
+        return sampling.adaptive_mean(sadness_costs, iterations, mc_tolerance,
+                                      mc_batch, stops*cost_per_sad_customer)
@@ -0,0 +1,232 @@
+''' Sampling
+
+Pools of pre-drawn random variates.  Drawing one gamma variate at a time
+costs a whole NumPy call each, so pools draw large blocks at once and hand
+them out one by one (or as arrays), refilling when they run dry.
+
+Destinations with the same delivery time distribution share one pool (see
+gamma_pool).  Since the blocks are drawn ahead, seeding np.random alone
+doesn't repeat the variates already in the pools: use seed, which also
+empties them.
+
+For variance reduction, the Monte Carlo estimators can also work from
+matrices of uniform throws (see uniforms), turned into delivery times with
+gamma_from_uniform and into arrival times with
+TimePreferences.from_uniform.  The sampling methods are
+
+    'random'      independent uniforms
+    'antithetic'  the second half of the rows mirrors the first (1 - u)
+    'lhs'         Latin hypercube, one throw in each 1/count stratum of
+                  every column
+    'sobol'       randomly shifted Sobol points in the first SOBOL_DIMENSIONS
+                  columns, padded with Latin hypercube columns
+
+Estimates can also be adaptive (see adaptive_mean): throws are drawn in
+batches until the standard error of the mean is small enough, so clear cut
+cases stop after a batch or two.
+
+'''
+import collections
+
+import numpy as np
+from scipy import special
+
+# Variates drawn at once when a pool runs dry
+BLOCK_SIZE = 4096
+
+# Shared pools, by (shape, scale)
+_GAMMA_POOLS = {}
+
+SAMPLING_METHODS = ('random', 'antithetic', 'lhs', 'sobol')
+
+# Sobol direction numbers (Joe and Kuo) past the first dimension: the degree
+# and inner coefficients of a primitive polynomial, and the initial m values
+_SOBOL_POLYNOMIALS = [
+    (1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]), (4, 4, [1, 3, 5, 13]), (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]), (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]), (5, 13, [1, 1, 1, 3, 11]),
+    (5, 14, [1, 3, 5, 5, 31]), (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]), (6, 16, [1, 3, 1, 13, 27, 49])]
+SOBOL_DIMENSIONS = len(_SOBOL_POLYNOMIALS) + 1
+SOBOL_BITS = 32
+
+# Result of a Monte Carlo estimate, with the number of throws it used
+Estimate = collections.namedtuple('Estimate',
+                                  ['value', 'standard_error', 'samples'])
+
+class GammaPool(object):
+    ''' Gamma variates with the given shape and scale, drawn in blocks '''
+    def __init__(self, shape, scale, block_size=None):
+        self.shape, self.scale = (shape, scale)
+        self.block_size = block_size or BLOCK_SIZE
+        self.block = np.empty(0)
+        self.position = 0
+
+    def draw_block(self, size):
+        ''' Draw a new block of size variates '''
+        return np.random.gamma(self.shape, self.scale, size)
+
+    def throw(self):
+        ''' Return the next variate '''
+        if self.position >= len(self.block):
+            self.block, self.position = (self.draw_block(self.block_size), 0)
+        value = self.block[self.position]
+        self.position += 1
+        return float(value)
+
+    def throw_many(self, count):
+        ''' Return an array of the next count variates '''
+        start = self.position
+        self.position += count
+        if self.position <= len(self.block):
+            return self.block[start:self.position]
+        # Use up the block, and carry on in a new one
+        needed = self.position - len(self.block)
+        rest = self.block[start:]
+        self.block = self.draw_block(max(self.block_size, needed))
+        self.position = needed
+        return np.concatenate((rest, self.block[:needed]))
+
+    def from_uniform(self, throws):
+        ''' Turn uniform throws into variates of this distribution '''
+        return gamma_from_uniform(self.shape, self.scale, throws)
+
+def gamma_pool(shape, scale):
+    ''' Return the pool shared by all users of a gamma distribution '''
+    key = (float(shape), float(scale))
+    if key not in _GAMMA_POOLS:
+        _GAMMA_POOLS[key] = GammaPool(*key)
+    return _GAMMA_POOLS[key]
+
+def clear():
+    ''' Throw away the variates drawn ahead in all shared pools '''
+    for pool in _GAMMA_POOLS.itervalues():
+        pool.block, pool.position = (np.empty(0), 0)
+
+def seed(seed=None):
+    ''' Seed np.random, and empty the pools so they draw from the new seed '''
+    np.random.seed(seed)
+    clear()
+
+def gamma_from_uniform(shape, scale, throws):
+    ''' Gamma variates (by inverting the cdf) from uniform throws
+
+    shape and scale broadcast against throws.
+    '''
+    return special.gammaincinv(shape, throws)*scale
+
+def uniforms(count, dimensions, method='random', random_state=np.random):
+    ''' Return a (count x dimensions) array of uniform throws in [0, 1)
+
+    Drawn with one of the SAMPLING_METHODS, from random_state (np.random,
+    or a RandomState for reproducible throws).
+    '''
+    if method == 'random':
+        return random_state.random_sample((count, dimensions))
+    if method == 'antithetic':
+        half = random_state.random_sample(((count + 1)//2, dimensions))
+        return np.concatenate((half, 1. - half))[:count]
+    if method == 'lhs':
+        return latin_hypercube(count, dimensions, random_state)
+    if method == 'sobol':
+        sobol_dimensions = min(dimensions, SOBOL_DIMENSIONS)
+        points = sobol(count, sobol_dimensions, random_state)
+        if dimensions == sobol_dimensions:
+            return points
+        return np.hstack((points, latin_hypercube(
+            count, dimensions - sobol_dimensions, random_state)))
+    raise ValueError("Unknown sampling method: %s" % method)
+
+def latin_hypercube(count, dimensions, random_state=np.random):
+    ''' Latin hypercube throws: each column has one throw in every
+    [i/count, (i+1)/count) stratum, in random order '''
+    strata = np.argsort(random_state.random_sample((count, dimensions)),
+                        axis=0)
+    return (strata + random_state.random_sample((count, dimensions)))/count
+
+def sobol_directions(dimensions):
+    ''' Return the (SOBOL_BITS x dimensions) Sobol direction numbers '''
+    directions = np.zeros((SOBOL_BITS, dimensions), dtype=np.uint64)
+    bits = np.arange(1, SOBOL_BITS + 1, dtype=np.uint64)
+    # The first dimension is the van der Corput sequence
+    directions[:, 0] = np.uint64(1) << (np.uint64(SOBOL_BITS) - bits)
+    for dimension in xrange(1, dimensions):
+        degree, inner, initial = _SOBOL_POLYNOMIALS[dimension - 1]
+        values = [m << (SOBOL_BITS - bit)
+                  for bit, m in enumerate(initial[:SOBOL_BITS], 1)]
+        for bit in xrange(degree, SOBOL_BITS):
+            value = values[bit - degree]
+            value ^= value >> degree
+            for term in xrange(1, degree):
+                if (inner >> (degree - 1 - term)) & 1:
+                    value ^= values[bit - term]
+            values.append(value)
+        directions[:, dimension] = values
+    return directions
+
+def sobol(count, dimensions, random_state=np.random):
+    ''' The first count Sobol points, in up to SOBOL_DIMENSIONS dimensions
+
+    The points are randomized with a digital shift (xor with a random
+    number per dimension), which keeps their stratification.
+    '''
+    if dimensions > SOBOL_DIMENSIONS:
+        raise ValueError("Sobol points only go up to %i dimensions"
+                         % SOBOL_DIMENSIONS)
+    directions = sobol_directions(dimensions)
+    indices = np.arange(count, dtype=np.uint64)
+    # Point i is the xor of the directions of the set bits of its Gray code
+    gray = indices ^ (indices >> np.uint64(1))
+    points = np.zeros((count, dimensions), dtype=np.uint64)
+    for bit in xrange(SOBOL_BITS):
+        selected = ((gray >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+        points[selected] ^= directions[bit]
+    shift = random_state.randint(0, 2**16, (2, dimensions)).astype(np.uint64)
+    points ^= (shift[0] << np.uint64(16)) | shift[1]
+    return points/float(2**SOBOL_BITS)
+
+def adaptive_mean(draw, max_samples, tolerance=None, batch_size=None,
+                  value_range=1.):
+    ''' Estimate the mean of the values returned by draw(count)
+
+    draw returns count values, or a (count x k) array to estimate k means
+    together.  Batches of batch_size are drawn until the standard errors
+    are all at most tolerance, or max_samples are used.  Without a
+    tolerance, all max_samples are drawn at once.  Returns an Estimate.
+
+    While all the values drawn are the same, their sample standard error is
+    zero, although a rare other value may well not have turned up yet.  The
+    standard error is then at least that of a binomial with the rule of
+    three bound (3/samples) on the probability of the other value, times
+    value_range (the width of the interval the values lie in).
+
+    The standard error assumes independent throws, so it is conservative
+    for the antithetic and stratified sampling methods.
+    '''
+    if tolerance is None or batch_size is None:
+        batch_size = max_samples
+    total, total_squares, samples = (0., 0., 0)
+    lowest, highest = (np.inf, -np.inf)
+    while samples < max_samples:
+        count = min(batch_size, max_samples - samples)
+        values = np.asarray(draw(count), dtype=float)
+        total = total + values.sum(axis=0)
+        total_squares = total_squares + (values*values).sum(axis=0)
+        lowest = np.minimum(lowest, values.min(axis=0))
+        highest = np.maximum(highest, values.max(axis=0))
+        samples += count
+        mean = total/samples
+        variance = (np.maximum(total_squares/samples - mean*mean, 0.)*
+                    samples/max(samples - 1, 1))
+        standard_error = np.sqrt(variance/samples)
+        # Nothing but one value seen so far
+        unseen = min(3./samples, 1.)
+        standard_error = np.where(
+            lowest == highest,
+            np.maximum(standard_error,
+                       value_range*np.sqrt(unseen*(1 - unseen)/samples)),
+            standard_error)[()]
+        if tolerance is not None and np.all(standard_error <= tolerance):
+            break
+    return Estimate(mean, standard_error, samples)
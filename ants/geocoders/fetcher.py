@@ -0,0 +1,160 @@
+''' ants.geocoders.fetcher
+
+Concurrent lookups against a geocoder backend (see gmaps.GoogleBackend).
+
+A Fetcher keeps a pool of worker threads calling backend methods, with at
+most `concurrency` requests in flight at once and their rate capped by a
+shared TokenBucket.  Requests failing with one of the retry_on errors are
+retried with exponential backoff, and asking for a lookup which is already
+in flight waits for that request instead of sending another one.
+
+'''
+import Queue
+import threading
+import time
+
+class TokenBucket(object):
+    ''' Thread safe rate limiter
+
+    Holds up to capacity tokens, refilled at rate tokens per second.  Each
+    request takes one, waiting for it if the bucket is empty.  A rate of
+    None never waits.
+    '''
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        ''' Wait for a token and use it '''
+        if self.rate is None:
+            return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                if self.tokens >= 1.:
+                    self.tokens -= 1.
+                    return
+                wait = (1. - self.tokens)/self.rate
+            time.sleep(wait)
+
+class _Request(object):
+    ''' A backend call, and its outcome once done is set '''
+    def __init__(self, method, args):
+        self.method = method
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class Fetcher(object):
+    ''' Run backend lookups from a pool of threads '''
+    def __init__(self, backend, concurrency=8, limiter=None, retries=3,
+                 backoff=0.5, retry_on=()):
+        self.backend = backend
+        self.limiter = TokenBucket(None) if limiter is None else limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = tuple(retry_on)
+        # Requests in flight, by (method, args)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.workers = [threading.Thread(target=self._work)
+                        for index in range(concurrency)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def close(self):
+        ''' Stop the workers once the queued requests are done '''
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def submit(self, method, args):
+        ''' Queue backend.method(*args), unless it is already in flight
+
+        Returns the request, whose done event is set when it finishes.
+        '''
+        key = (method, args)
+        with self.lock:
+            if key not in self.pending:
+                self.pending[key] = _Request(method, args)
+                self.queue.put(self.pending[key])
+            return self.pending[key]
+
+    def fetch(self, method, calls):
+        ''' Call backend.method(*args) for each args tuple in calls
+
+        Returns ({args: result}, {args: error}) once all are done.
+        '''
+        requests = [(args, self.submit(method, args)) for args in set(calls)]
+        results, errors = ({}, {})
+        for args, request in requests:
+            request.done.wait()
+            if request.error is None:
+                results[args] = request.result
+            else:
+                errors[args] = request.error
+        return results, errors
+
+    def lat_lngs(self, addresses):
+        ''' Return ({address: (lat, lng)}, {address: error}) '''
+        results, errors = self.fetch('lat_lng',
+                                     [(address,) for address in addresses])
+        return (dict((args[0], result)
+                     for args, result in results.iteritems()),
+                dict((args[0], error) for args, error in errors.iteritems()))
+
+    def travels(self, pairs):
+        ''' Return ({(origin, destination): (seconds, meters)},
+        {(origin, destination): error}) '''
+        return self.fetch('travel', [tuple(pair) for pair in pairs])
+
+    def travel_matrices(self, blocks):
+        ''' Return the travel between each (origins, destinations) block
+        of addresses, as ({(origin, destination): (seconds, meters)},
+        {(origins, destinations): error}) '''
+        results, errors = self.fetch(
+            'travel_matrix', [(tuple(origins), tuple(destinations))
+                              for origins, destinations in blocks])
+        travels = {}
+        for block_travels in results.itervalues():
+            travels.update(block_travels)
+        return travels, errors
+
+    def _call(self, request):
+        ''' Make a request, retrying it as needed '''
+        function = getattr(self.backend, request.method)
+        for attempt in range(self.retries + 1):
+            self.limiter.take()
+            try:
+                request.result = function(*request.args)
+                request.error = None
+                return
+            except self.retry_on as error:
+                request.error = error
+                if attempt < self.retries:
+                    time.sleep(self.backoff*2**attempt)
+
+    def _work(self):
+        ''' Worker thread loop '''
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            try:
+                self._call(request)
+            except Exception as error:
+                # Not worth retrying; hand it to whoever is waiting
+                request.error = error
+            with self.lock:
+                del self.pending[(request.method, request.args)]
+            request.done.set()
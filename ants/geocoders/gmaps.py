@@ -1,22 +1,46 @@
 ''' ants.geocoders.gmaps
 
 Infromterface to the google maps api.  Provides latitude/longitude lookups from
-address, and driving time/distance for address pairs.
+address, and driving time/distance for address pairs, or for all pairs of a
+list of addresses at once (time_matrix, distance_matrix).
+
+Lookups go through a backend object (see GoogleBackend), which can be
+swapped with set_backend, e.g. for a fake one in offline tests.  Requests
+made one at a time are limited to ten per second; prefetch looks up a
+list of addresses concurrently (see ants.geocoders.fetcher).
+
+Results are cached in memory, and optionally in a persistent TravelStore
+(see open_store), which is looked up lazily and appended to as new results
+come in.  Only the duration and distance of each set of directions are kept.
+To move an old pickled cache into a store:
+
+    load('gmaps.gis.gz'); open_store('gmaps.sqlite'); store_cache()
 
 '''
 
 from googlemaps import GoogleMaps, GoogleMapsError
 from ants.geocoders.gmaps_api_key import api_key
+from ants.geocoders.store import TravelStore
+from ants.geocoders.fetcher import Fetcher, TokenBucket
 
-import time
 import cPickle as pickle
 import gzip
+import json
 import os
+import urllib
+import urllib2
+
+import numpy as np
 
 _LAT_LNG_CACHE = {}
+# (seconds, meters) for each address pair
 _DIRECTIONS_CACHE = {}
+# Persistent store, if open
+_STORE = None
 
 _GMAPS = GoogleMaps(api_key)
+# Limits requests made one at a time
+_LIMITER = TokenBucket(10.)
 
 # Verbosity
 class Verbosity(object):
@@ -46,6 +70,90 @@ def clear():
     _LAT_LNG_CACHE.clear()
     _DIRECTIONS_CACHE.clear()
 
+class GoogleBackend(object):
+    ''' Look up addresses and travel from the google maps api
+
+    Backends provide lat_lng(address), travel(origin, destination), giving
+    (seconds, meters), and travel_matrix(origins, destinations), giving a
+    dict of (origin, destination): (seconds, meters) from a single request
+    of at most max_addresses origins or destinations and max_elements pairs.
+    '''
+    max_addresses = 25
+    max_elements = 100
+    matrix_url = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+
+    def __init__(self, key=api_key, gmaps=None):
+        self.key = key
+        self.gmaps = _GMAPS if gmaps is None else gmaps
+
+    def lat_lng(self, address):
+        ''' Get latitude/long from an address (raises GoogleMapsError) '''
+        return self.gmaps.address_to_latlng(address)
+
+    def travel(self, address_1, address_2):
+        ''' Return (seconds, meters) from address_1 to address_2 (raises
+        GoogleMapsError) '''
+        return _duration_and_distance(
+            self.gmaps.directions(address_1, address_2))
+
+    def travel_matrix(self, origins, destinations):
+        ''' Return travel between each origin and destination '''
+        query = urllib.urlencode({'origins': '|'.join(origins),
+                                  'destinations': '|'.join(destinations),
+                                  'sensor': 'false', 'key': self.key})
+        try:
+            response = json.load(
+                urllib2.urlopen('%s?%s' % (self.matrix_url, query)))
+        except (urllib2.URLError, ValueError) as error:
+            raise MetricError(error.args,
+                              " google maps distance matrix failed")
+        if response.get('status') != 'OK':
+            raise MetricError(" google maps distance matrix failed: %s"
+                              % response.get('status'))
+        result = {}
+        for origin, row in zip(origins, response['rows']):
+            for destination, element in zip(destinations, row['elements']):
+                if element['status'] != 'OK':
+                    raise MetricError(
+                        " google maps can't get directions for %s-%s"
+                        % (origin, destination))
+                result[(origin, destination)] = (
+                    element['duration']['value'], element['distance']['value'])
+        return result
+
+_BACKEND = GoogleBackend()
+
+def set_backend(backend):
+    ''' Use another backend for lookups, returning the previous one '''
+    global _BACKEND
+    previous, _BACKEND = (_BACKEND, backend)
+    return previous
+
+def open_store(filename='gmaps.sqlite'):
+    ''' Use a persistent store for lookups, creating it if needed '''
+    global _STORE
+    close_store()
+    _STORE = TravelStore(filename)
+
+def close_store():
+    ''' Stop using the persistent store '''
+    global _STORE
+    if _STORE is not None:
+        _STORE.close()
+        _STORE = None
+
+def store_cache():
+    ''' Write everything in the memory caches to the persistent store '''
+    if _STORE is None:
+        raise MetricError("No persistent store open")
+    _STORE.add_lat_lngs(_LAT_LNG_CACHE)
+    _STORE.add_travels(_DIRECTIONS_CACHE)
+
+def _duration_and_distance(directions_result):
+    ''' Extract (seconds, meters) from a google directions result '''
+    summary = directions_result['Directions']
+    return (summary['Duration']['seconds'], summary['Distance']['meters'])
+
 def save(filename='gmaps.gis.gz'):
     ''' Save cached address info to file '''
     output = gzip.GzipFile(filename, 'wb')
@@ -61,7 +169,11 @@ def load(filename='gmaps.gis.gz'):
         input_file = gzip.GzipFile(filename, 'rb')
         clear()
         _LAT_LNG_CACHE.update(pickle.load(input_file))
-        _DIRECTIONS_CACHE.update(pickle.load(input_file))
+        for address_pair, result in pickle.load(input_file).iteritems():
+            # Older files hold the complete directions
+            if isinstance(result, dict):
+                result = _duration_and_distance(result)
+            _DIRECTIONS_CACHE[address_pair] = result
     else:
         print "Error: could not load metric file: %s" % filename
     print " ... done"
@@ -70,12 +182,15 @@ def lat_lng(address):
     ''' Get latitude/long from an address'''
     if _VERBOSITY.is_loud():
         print "Lat/Lng:", address
-    if address not in _LAT_LNG_CACHE:
+    if not _known_lat_lng(address):
+        _LIMITER.take()
         try:
-            result = _GMAPS.address_to_latlng(address)
-            _LAT_LNG_CACHE[address] = result
+            result = _BACKEND.lat_lng(address)
         except GoogleMapsError:
             raise MetricError, " google maps can't find address:", address
+        _LAT_LNG_CACHE[address] = result
+        if _STORE is not None:
+            _STORE.add_lat_lng(address, result)
     return _LAT_LNG_CACHE[address]
 
 def time_between(address_1, address_2):
@@ -83,34 +198,198 @@ def time_between(address_1, address_2):
     # Time between the same place is always zero
     if address_1 == address_2:
         return 0
-    return directions(address_1, address_2)['Directions']\
-        ['Duration']['seconds']/60.
+    return travel(address_1, address_2)[0]/60.
 
 def distance_between(address_1, address_2):
     ''' Return the distance between two addresses in meters '''
     # Dist between the same place is always zero
     if address_1 == address_2:
         return 0
-    return directions(address_1, address_2)['Directions']\
-        ['Distance']['meters']
+    return travel(address_1, address_2)[1]
 
-def directions(address_1, address_2):
-    ''' Get directions from Google '''
-    if _VERBOSITY.is_loud():
-        print "Dir: %s ==> %s" % (address_1, address_2)
-    # Look it up on google if we haven't already
+def travel(address_1, address_2):
+    ''' Return (seconds, meters) to drive from address_1 to address_2
+
+    Looks in the memory cache, then the persistent store, and finally asks
+    the backend, storing the result.
+    '''
     address_pair = (address_1, address_2)
     if address_pair not in _DIRECTIONS_CACHE:
-        time.sleep(0.100)
+        stored = _STORE and _STORE.travel(address_1, address_2)
+        if stored:
+            _DIRECTIONS_CACHE[address_pair] = stored
+            return stored
         # Validate addresses and put lat/lng in cache
         lat_lng(address_1)
         lat_lng(address_2)
+        _LIMITER.take()
         try:
-            result = _GMAPS.directions(address_1, address_2)
-            _DIRECTIONS_CACHE[address_pair] = result
+            result = _BACKEND.travel(address_1, address_2)
         except GoogleMapsError as gmaps_error:
-            raise MetricError(gmaps_error.args, 
+            raise MetricError(gmaps_error.args,
                               " google maps can't get directions for %s-%s" \
                               % (address_1, address_2))
+        _DIRECTIONS_CACHE[address_pair] = result
+        if _STORE is not None:
+            _STORE.add_travel(address_1, address_2, *result)
     return _DIRECTIONS_CACHE[address_pair]
 
+def time_matrix(addresses):
+    ''' Return N*N array of traveling times (minutes) between addresses '''
+    return travel_matrices(addresses)[0]/60.
+
+def distance_matrix(addresses):
+    ''' Return N*N array of distances (meters) between addresses '''
+    return travel_matrices(addresses)[1]
+
+def travel_matrices(addresses):
+    ''' Return N*N arrays of (seconds, meters) between all addresses '''
+    return travel_matrix(addresses, addresses)
+
+def travel_matrix(origins, destinations):
+    ''' Return arrays of (seconds, meters) from each origin to each
+    destination, with a row per origin
+
+    Only the pairs missing from the memory cache and the persistent store
+    are fetched, in blocks of origins x destinations as large as the
+    backend allows.
+    '''
+    _fetch_pairs(_missing_pairs(origins, destinations))
+    seconds = np.zeros((len(origins), len(destinations)))
+    meters = np.zeros((len(origins), len(destinations)))
+    for index_a, address_a in enumerate(origins):
+        for index_b, address_b in enumerate(destinations):
+            # Travel between the same place is always zero
+            if address_a != address_b:
+                seconds[index_a, index_b], meters[index_a, index_b] = \
+                        _DIRECTIONS_CACHE[(address_a, address_b)]
+    return seconds, meters
+
+def _missing_pairs(origins, destinations=None):
+    ''' Return {origin: [destinations]} of pairs not in the caches
+
+    Without destinations, the pairs between all the origins.
+    '''
+    if destinations is None:
+        destinations = origins
+    missing = {}
+    for origin in set(origins):
+        wanted = [destination for destination in set(destinations)
+                  if destination != origin and
+                  (origin, destination) not in _DIRECTIONS_CACHE]
+        if wanted and _STORE is not None:
+            stored = _STORE.travels_from(origin, wanted)
+            for destination, result in stored.iteritems():
+                _DIRECTIONS_CACHE[(origin, destination)] = result
+            wanted = [destination for destination in wanted
+                      if destination not in stored]
+        if wanted:
+            missing[origin] = sorted(wanted)
+    return missing
+
+def _chunks(items, size):
+    ''' Split a list into pieces of at most size items '''
+    return [items[index:index+size] for index in range(0, len(items), size)]
+
+def _blocks(missing):
+    ''' Group the origins of {origin: [destinations]} into blocks
+
+    Origins missing the same destinations are put next to each other, and
+    added to a block while all its destinations still fit in one request
+    per max_addresses of them.  Yields (origins, destinations).
+    '''
+    width = min(_BACKEND.max_addresses, _BACKEND.max_elements)
+    origins, destinations = ([], set())
+    for origin in sorted(missing,
+                         key=lambda origin: (missing[origin], origin)):
+        wanted = destinations.union(missing[origin])
+        if origins and (len(origins) == _BACKEND.max_addresses or
+                (len(origins)+1)*min(len(wanted), width) >
+                _BACKEND.max_elements):
+            yield origins, sorted(destinations)
+            origins, wanted = ([], set(missing[origin]))
+        origins.append(origin)
+        destinations = wanted
+    if origins:
+        yield origins, sorted(destinations)
+
+def _matrix_requests(missing):
+    ''' Split {origin: [destinations]} into the (origins, destinations) of
+    backend travel_matrix requests '''
+    for origins, wanted in _blocks(missing):
+        width = min(_BACKEND.max_addresses,
+                    _BACKEND.max_elements//len(origins))
+        for destinations in _chunks(wanted, width):
+            yield origins, destinations
+
+def _fetch_pairs(missing):
+    ''' Fetch {origin: [destinations]} from the backend, in blocks '''
+    for origins, destinations in _matrix_requests(missing):
+        if _VERBOSITY.is_loud():
+            print "Matrix: %i x %i" % (len(origins), len(destinations))
+        _LIMITER.take()
+        results = _BACKEND.travel_matrix(origins, destinations)
+        _DIRECTIONS_CACHE.update(results)
+        if _STORE is not None:
+            _STORE.add_travels(results)
+
+def prefetch(addresses, concurrency=8, rate=10., retries=3, backoff=0.5):
+    ''' Look up addresses and the travel between all their pairs
+
+    Everything missing from the memory cache and the persistent store is
+    requested from the backend with up to concurrency requests at once, at
+    most rate per second, retrying failed ones.  The travel is requested in
+    the same distance matrix blocks as travel_matrices.  Results are kept
+    as they come in, so a prefetch interrupted by errors can simply be run
+    again.
+    '''
+    # Failed distance matrix requests raise MetricError
+    fetcher = Fetcher(_BACKEND, concurrency=concurrency,
+                      limiter=TokenBucket(rate, capacity=concurrency),
+                      retries=retries, backoff=backoff,
+                      retry_on=(GoogleMapsError, urllib2.URLError,
+                                MetricError))
+    try:
+        lat_lngs, errors = fetcher.lat_lngs(
+            [address for address in set(addresses)
+             if not _known_lat_lng(address)])
+        _LAT_LNG_CACHE.update(lat_lngs)
+        if _STORE is not None:
+            _STORE.add_lat_lngs(lat_lngs)
+        # Only ask for directions between addresses which were found
+        missing = _missing_pairs([address for address in addresses
+                                  if address not in errors])
+        travels, travel_errors = fetcher.travel_matrices(
+            _matrix_requests(missing))
+        _DIRECTIONS_CACHE.update(travels)
+        if _STORE is not None:
+            _STORE.add_travels(travels)
+    finally:
+        fetcher.close()
+    errors.update(travel_errors)
+    if errors:
+        raise MetricError(" google maps failed on %i lookups, e.g. %s: %s"
+                          % ((len(errors),) + errors.popitem()))
+
+def _known_lat_lng(address):
+    ''' Return the cached or stored lat/lng of an address, or None '''
+    if address not in _LAT_LNG_CACHE:
+        stored = _STORE and _STORE.lat_lng(address)
+        if stored:
+            _LAT_LNG_CACHE[address] = stored
+    return _LAT_LNG_CACHE.get(address)
+
+def directions(address_1, address_2):
+    ''' Get directions from Google (uncached) '''
+    if _VERBOSITY.is_loud():
+        print "Dir: %s ==> %s" % (address_1, address_2)
+    _LIMITER.take()
+    # Validate addresses and put lat/lng in cache
+    lat_lng(address_1)
+    lat_lng(address_2)
+    try:
+        return _GMAPS.directions(address_1, address_2)
+    except GoogleMapsError as gmaps_error:
+        raise MetricError(gmaps_error.args, 
+                          " google maps can't get directions for %s-%s" \
+                          % (address_1, address_2))
@@ -0,0 +1,110 @@
+''' ants.geocoders.haversine
+
+Offline metric.  Distances are great circle distances between latitudes and
+longitudes, stretched by a detour factor to account for the roads, and
+times assume a constant average speed (see the 'detour_factor' and
+'average_speed' parameters).  Whole N*N matrices are computed with a few
+array operations, so no network access is needed and thousands of stops
+take seconds.
+
+Addresses are either "lat,lng" strings, or registered beforehand with
+register (e.g. with coordinates from a geocoder).
+
+'''
+import numpy as np
+
+import ants.parameters as params
+
+# Mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+# Rows computed at once, bounding the memory used by large matrices
+BLOCK_ROWS = 1024
+
+_LAT_LNGS = {}
+
+class MetricError(Exception):
+    ''' Raised for addresses without coordinates '''
+    pass
+
+def register(address, lat_lng):
+    ''' Set the (lat, lng) of an address '''
+    _LAT_LNGS[address] = (float(lat_lng[0]), float(lat_lng[1]))
+
+def register_all(lat_lngs):
+    ''' Set the coordinates from a dict of address: (lat, lng) '''
+    for address, lat_lng in lat_lngs.iteritems():
+        register(address, lat_lng)
+
+def clear():
+    ''' Forget all registered addresses '''
+    _LAT_LNGS.clear()
+
+def lat_lng(address):
+    ''' Get latitude/long from an address '''
+    if address in _LAT_LNGS:
+        return _LAT_LNGS[address]
+    try:
+        lat, lng = [float(part) for part in address.split(',')]
+    except ValueError:
+        raise MetricError("No coordinates for address: %s" % address)
+    return (lat, lng)
+
+def great_circle_matrix(lat_lngs_1, lat_lngs_2):
+    ''' Return [i, j] the great circle distance (in meters) between
+    lat_lngs_1[i] and lat_lngs_2[j] '''
+    points_1 = np.radians(np.asarray(lat_lngs_1, dtype=float).reshape(-1, 2))
+    points_2 = np.radians(np.asarray(lat_lngs_2, dtype=float).reshape(-1, 2))
+    lat_2, lng_2 = (points_2[:, 0], points_2[:, 1])
+    cos_lat_2 = np.cos(lat_2)
+    output = np.empty((len(points_1), len(points_2)))
+    for start in xrange(0, len(points_1), BLOCK_ROWS):
+        lat_1 = points_1[start:start+BLOCK_ROWS, 0, np.newaxis]
+        lng_1 = points_1[start:start+BLOCK_ROWS, 1, np.newaxis]
+        haversine = (np.sin((lat_2 - lat_1)/2.)**2
+                     + np.cos(lat_1)*cos_lat_2*np.sin((lng_2 - lng_1)/2.)**2)
+        output[start:start+BLOCK_ROWS] = np.arcsin(
+            np.sqrt(np.minimum(haversine, 1.)))
+    output *= 2.*EARTH_RADIUS
+    return output
+
+@params.use_parameters
+def distance_matrix(addresses, detour_factor=None):
+    ''' Return N*N array of distances (meters) between addresses '''
+    lat_lngs = [lat_lng(address) for address in addresses]
+    output = great_circle_matrix(lat_lngs, lat_lngs)
+    output *= detour_factor
+    return output
+
+@params.use_parameters
+def time_matrix(addresses, detour_factor=None, average_speed=None):
+    ''' Return N*N array of traveling times (minutes) between addresses '''
+    output = distance_matrix(addresses, detour_factor=detour_factor)
+    # km/h to meters per minute
+    output /= average_speed*1000./60.
+    return output
+
+@params.use_parameters
+def travel_matrices(addresses, detour_factor=None, average_speed=None):
+    ''' Return N*N arrays of (seconds, meters) between addresses '''
+    return travel_matrix(addresses, addresses, detour_factor=detour_factor,
+                         average_speed=average_speed)
+
+@params.use_parameters
+def travel_matrix(origins, destinations, detour_factor=None,
+                  average_speed=None):
+    ''' Return arrays of (seconds, meters) from each origin to each
+    destination, with a row per origin '''
+    meters = great_circle_matrix(
+        [lat_lng(address) for address in origins],
+        [lat_lng(address) for address in destinations])
+    meters *= detour_factor
+    # km/h to meters per second
+    return meters/(average_speed*1000./3600.), meters
+
+def distance_between(address_1, address_2):
+    ''' Return the distance between two addresses in meters '''
+    return distance_matrix([address_1, address_2])[0, 1]
+
+def time_between(address_1, address_2):
+    ''' Return the traveling time between two addresses in minutes '''
+    return time_matrix([address_1, address_2])[0, 1]
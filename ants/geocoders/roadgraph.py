@@ -0,0 +1,186 @@
+''' ants.geocoders.roadgraph
+
+Offline metric on a local road network.  Addresses are placed with the
+haversine coordinates (registered, or "lat,lng" strings, see
+ants.geocoders.haversine) and snapped to the nearest node of the network
+with a k-d tree.  Travel between them follows the fastest path along the
+directed edges, found with a Dijkstra search from each origin which stops
+as soon as all the destinations asked for are reached.  The distance is
+that of the fastest path.
+
+The network is loaded from a CSV edge list (e.g. exported from
+OpenStreetMap) with a header row and the columns
+
+    source, target, source_lat, source_lng, target_lat, target_lng, meters
+
+and optionally seconds (else computed at the 'average_speed' parameter),
+and oneway (0 for edges which can be driven both ways, default 1).
+
+'''
+import csv
+import hashlib
+import heapq
+
+import numpy as np
+from scipy import spatial
+
+import ants.parameters as params
+from ants.geocoders.haversine import EARTH_RADIUS, MetricError, lat_lng, \
+        register, register_all
+
+# (seconds, meters) between each pair of nodes found so far
+_TRAVEL_CACHE = {}
+_GRAPH = None
+
+class RoadGraph(object):
+    ''' Directed road network with travel time and distance on its edges '''
+    def __init__(self, lat_lngs, sources, targets, seconds, meters):
+        self.lat_lngs = np.asarray(lat_lngs, dtype=float).reshape(-1, 2)
+        # Outgoing (target, seconds, meters) of each node
+        self.adjacency = [[] for index in xrange(len(self.lat_lngs))]
+        for source, target, edge_seconds, edge_meters in zip(
+                sources, targets, seconds, meters):
+            self.adjacency[source].append(
+                (target, float(edge_seconds), float(edge_meters)))
+        # Identifies the network, for caches of matrices built on it
+        digest = hashlib.sha1(self.lat_lngs.tostring())
+        for values in (sources, targets, seconds, meters):
+            digest.update(np.asarray(values, dtype=float).tostring())
+        self.fingerprint = digest.hexdigest()
+        # Index nodes on a locally flat projection
+        self.cos_lat = np.cos(np.radians(np.mean(self.lat_lngs[:, 0])))
+        self.tree = spatial.cKDTree(self.project(self.lat_lngs))
+
+    @classmethod
+    @params.use_parameters
+    def from_csv(cls, filename, average_speed=None):
+        ''' Load a network from a CSV edge list '''
+        nodes = {}
+        lat_lngs = []
+        edges = []
+        def node(name, lat, lng):
+            ''' Index of a node, adding it if needed '''
+            if name not in nodes:
+                nodes[name] = len(lat_lngs)
+                lat_lngs.append((float(lat), float(lng)))
+            return nodes[name]
+        with open(filename, 'rb') as input_file:
+            for row in csv.DictReader(input_file):
+                source = node(row['source'], row['source_lat'],
+                              row['source_lng'])
+                target = node(row['target'], row['target_lat'],
+                              row['target_lng'])
+                meters = float(row['meters'])
+                if row.get('seconds'):
+                    seconds = float(row['seconds'])
+                else:
+                    seconds = meters/(average_speed*1000./3600.)
+                edges.append((source, target, seconds, meters))
+                if row.get('oneway', '1').strip() == '0':
+                    edges.append((target, source, seconds, meters))
+        sources, targets, seconds, meters = zip(*edges)
+        return cls(lat_lngs, sources, targets, seconds, meters)
+
+    def project(self, lat_lngs):
+        ''' Project lat/lngs to meters on a plane around the network '''
+        points = np.radians(np.asarray(lat_lngs, dtype=float).reshape(-1, 2))
+        return EARTH_RADIUS*np.column_stack(
+            (points[:, 0], points[:, 1]*self.cos_lat))
+
+    def snap(self, lat_lngs):
+        ''' Return the index of the node nearest to each lat/lng '''
+        return self.tree.query(self.project(lat_lngs))[1]
+
+    def fastest_paths(self, source, targets):
+        ''' Search the fastest paths from source until all targets are
+        reached.  Returns {target: (seconds, meters)} '''
+        remaining = set(targets)
+        found = {}
+        settled = set()
+        best = {source: 0.}
+        heap = [(0., 0., source)]
+        while heap and remaining:
+            seconds, meters, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = (seconds, meters)
+            for target, edge_seconds, edge_meters in self.adjacency[node]:
+                arrival = seconds + edge_seconds
+                if arrival < best.get(target, np.inf):
+                    best[target] = arrival
+                    heapq.heappush(heap, (arrival, meters + edge_meters,
+                                          target))
+        if remaining:
+            raise MetricError("No route from node %i to nodes %s"
+                              % (source, sorted(remaining)))
+        return found
+
+def load(filename):
+    ''' Use the road network in a CSV edge list '''
+    use_graph(RoadGraph.from_csv(filename))
+
+def use_graph(graph):
+    ''' Use a RoadGraph, forgetting travel found on the previous one '''
+    global _GRAPH
+    _GRAPH = graph
+    _TRAVEL_CACHE.clear()
+
+def _graph():
+    ''' The road network in use '''
+    if _GRAPH is None:
+        raise MetricError("No road network loaded")
+    return _GRAPH
+
+def fingerprint():
+    ''' Identify the road network in use '''
+    return _graph().fingerprint
+
+def nodes(addresses):
+    ''' Return the network node of each address '''
+    return _graph().snap([lat_lng(address) for address in addresses])
+
+def travel_matrices(addresses):
+    ''' Return N*N arrays of (seconds, meters) between all addresses '''
+    return travel_matrix(addresses, addresses)
+
+def travel_matrix(origins, destinations):
+    ''' Return arrays of (seconds, meters) from each origin to each
+    destination, with a row per origin
+
+    Runs one search from each origin node, for the pairs not found before.
+    '''
+    origin_nodes, destination_nodes = (nodes(origins), nodes(destinations))
+    targets = set(destination_nodes)
+    for source in set(origin_nodes):
+        missing = [target for target in targets
+                   if (source, target) not in _TRAVEL_CACHE]
+        if missing:
+            for target, result in _graph().fastest_paths(
+                    source, missing).iteritems():
+                _TRAVEL_CACHE[(source, target)] = result
+    seconds = np.zeros((len(origins), len(destinations)))
+    meters = np.zeros((len(origins), len(destinations)))
+    for index_a, node_a in enumerate(origin_nodes):
+        for index_b, node_b in enumerate(destination_nodes):
+            seconds[index_a, index_b], meters[index_a, index_b] = \
+                    _TRAVEL_CACHE[(node_a, node_b)]
+    return seconds, meters
+
+def time_matrix(addresses):
+    ''' Return N*N array of traveling times (minutes) between addresses '''
+    return travel_matrices(addresses)[0]/60.
+
+def distance_matrix(addresses):
+    ''' Return N*N array of distances (meters) between addresses '''
+    return travel_matrices(addresses)[1]
+
+def time_between(address_1, address_2):
+    ''' Return the traveling time between two addresses in minutes '''
+    return time_matrix([address_1, address_2])[0, 1]
+
+def distance_between(address_1, address_2):
+    ''' Return the distance between two addresses in meters '''
+    return distance_matrix([address_1, address_2])[0, 1]
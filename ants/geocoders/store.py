@@ -0,0 +1,93 @@
+''' ants.geocoders.store
+
+Persistent store for geocoder results, backed by SQLite.
+
+Keeps the latitude/longitude of each address, and the driving duration (in
+seconds) and distance (in meters) for each ordered address pair, indexed by
+address.  Lookups only touch the rows asked for, results are appended as
+they come in, and the database runs in write-ahead-log mode so that many
+processes can read it while another one writes.
+
+'''
+
+import sqlite3
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS lat_lng (
+           address TEXT PRIMARY KEY,
+           lat REAL NOT NULL,
+           lng REAL NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS travel (
+           origin TEXT NOT NULL,
+           destination TEXT NOT NULL,
+           seconds REAL NOT NULL,
+           meters REAL NOT NULL,
+           PRIMARY KEY (origin, destination))''',
+]
+
+class TravelStore(object):
+    ''' Indexed, on-disk cache of lat/lng and travel duration/distance '''
+    def __init__(self, filename='gmaps.sqlite', timeout=30.0):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        for statement in _SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def close(self):
+        ''' Close the database '''
+        self.connection.close()
+
+    def lat_lng(self, address):
+        ''' Return (lat, lng) for an address, or None if not stored '''
+        return self.connection.execute(
+            'SELECT lat, lng FROM lat_lng WHERE address = ?',
+            (address,)).fetchone()
+
+    def travel(self, origin, destination):
+        ''' Return (seconds, meters) from origin to destination, or None if
+        not stored '''
+        return self.connection.execute(
+            'SELECT seconds, meters FROM travel '
+            'WHERE origin = ? AND destination = ?',
+            (origin, destination)).fetchone()
+
+    def travels_from(self, origin, destinations=None):
+        ''' Return {destination: (seconds, meters)} of all stored travel
+        from origin, optionally only to the given destinations '''
+        rows = self.connection.execute(
+            'SELECT destination, seconds, meters FROM travel '
+            'WHERE origin = ?', (origin,))
+        result = dict((destination, (seconds, meters))
+                      for destination, seconds, meters in rows)
+        if destinations is not None:
+            result = dict((destination, result[destination])
+                          for destination in destinations
+                          if destination in result)
+        return result
+
+    def add_lat_lngs(self, lat_lngs):
+        ''' Store a dict of address: (lat, lng) '''
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO lat_lng VALUES (?, ?, ?)',
+            [(address, lat, lng)
+             for address, (lat, lng) in lat_lngs.iteritems()])
+        self.connection.commit()
+
+    def add_travels(self, travels):
+        ''' Store a dict of (origin, destination): (seconds, meters) '''
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO travel VALUES (?, ?, ?, ?)',
+            [(origin, destination, seconds, meters)
+             for (origin, destination), (seconds, meters)
+             in travels.iteritems()])
+        self.connection.commit()
+
+    def add_lat_lng(self, address, lat_lng):
+        ''' Store the (lat, lng) of an address '''
+        self.add_lat_lngs({address: lat_lng})
+
+    def add_travel(self, origin, destination, seconds, meters):
+        ''' Store the duration and distance from origin to destination '''
+        self.add_travels({(origin, destination): (seconds, meters)})
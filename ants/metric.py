@@ -2,17 +2,85 @@
 
 Select the metric to use to determine the time and distance between nodes.
 
-Should provide the following functions:
+The metric is a module, chosen by name from METRICS (or given as a module
+path) with the ANTS_METRIC environment variable, or at run time with
+select().  It is only imported when first used, so e.g. the haversine
+metric works without the google maps client installed.  Use it through
+
+    from ants.metric import metric
+
+The metric module should provide the following functions:
 
     lat_lng(address):
         Return a tuple continaing latitude and longitude from an address
 
-    distance_to(address1, address2):
+    distance_between(address1, address2):
         Return distance (in meters) to travel *from* address1 *to* address2
 
-    time_to(address1, address2):
+    time_between(address1, address2):
         Return time (in minutes) to travel *from* address1 *to* address2
 
+    distance_matrix(addresses):
+        Return an N*N array of distances (in meters), such that [i, j] is
+        the distance *from* addresses[i] *to* addresses[j]
+
+    time_matrix(addresses):
+        Return an N*N array of times (in minutes), laid out as above
+
+    travel_matrices(addresses):
+        Return the N*N arrays of (seconds, meters) together, laid out as
+        above, in a single pass
+
+    travel_matrix(origins, destinations):
+        Return the arrays of (seconds, meters) with [i, j] *from*
+        origins[i] *to* destinations[j], in a single pass
+
+The matrix functions should fetch all the pairs they are missing in as few
+requests as possible, rather than one pair at a time.
+
+Metrics working from local data (e.g. a road network) should also provide
+
+    fingerprint():
+        Return a string identifying that data, so that matrices cached
+        with other data are not reused (see fingerprint below)
+
 '''
 
-from ants.geocoders import gmaps as metric
+import os
+
+METRICS = {
+    # Google maps lookups, cached (see ants.geocoders.gmaps)
+    'gmaps': 'ants.geocoders.gmaps',
+    # Offline great circle distances (see ants.geocoders.haversine)
+    'haversine': 'ants.geocoders.haversine',
+    # Fastest paths on a local road network (see ants.geocoders.roadgraph)
+    'roadgraph': 'ants.geocoders.roadgraph',
+}
+
+class _Metric(object):
+    ''' Forwards attribute lookups to the selected metric module '''
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            path = METRICS.get(self.name, self.name)
+            self.module = __import__(path, fromlist=[path.split('.')[-1]])
+        return getattr(self.module, attr)
+
+metric = _Metric(os.environ.get('ANTS_METRIC', 'gmaps'))
+
+def fingerprint():
+    ''' Identify the selected metric and the data it works from '''
+    try:
+        data = metric.fingerprint
+    except AttributeError:
+        return metric.name
+    return '%s:%s' % (metric.name, data())
+
+def select(name):
+    ''' Use another metric, returning the name of the previous one '''
+    previous = metric.name
+    metric.name, metric.module = (name, None)
+    return previous
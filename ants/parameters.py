@@ -4,7 +4,14 @@ Defines all parameters in the algorithm.  Intended for easy
 serialization for use during parameter optimization.  Also single point of
 defintion for 'standard' parameters.
 
+Functions decorated with use_parameters look up the parameters they are
+missing on every call.  Hot functions can instead be bound to a
+ParameterSnapshot (see snapshot), which resolves them once, until the
+parameters change: set_parameter and load_parameters call invalidate, which
+should also be called after changing _ALGO directly.
+
 '''
+import functools
 import pickle
 
 _ALGO = {
@@ -14,13 +21,62 @@ _ALGO = {
     'cost_per_sad_customer': 4.0,
     # Std. number of MC iterations
     'iterations': 500,
+    # How MC throws are drawn: 'random', 'antithetic', 'lhs' (Latin
+    # hypercube) or 'sobol' (see ants.engine.sampling)
+    'mc_sampling': 'random',
+    # Simulate all routes with the same throws for each destination
+    'common_random_numbers': False,
+    # Adaptive MC: draw mc_batch throws at a time, until the standard error
+    # is below mc_tolerance or 'iterations' are used (None to always use
+    # all of them)
+    'mc_tolerance': None,
+    'mc_batch': 50,
     #Pheromone paramters
     'initial_pheromone': 0.01,
     'pheromone_decay': 0.1,
+    # Which ants deposit pheromone: 'all', 'iteration_best', 'global_best'
+    # or 'rank'
+    'deposit_rule': 'all',
+    # Number of ranks used by the 'rank' deposit rule
+    'rank_ants': 6,
+    # Pheromone update scheme: 'as' (Ant System) or 'mmas' (MAX-MIN)
+    'ant_system': 'as',
+    # MMAS: deposit rule, as deposit_rule
+    'mmas_deposit': 'rank',
+    # MMAS: number of ranks used by the 'rank' deposit rule
+    'mmas_rank_ants': 12,
+    # MMAS: pheromone decay, slower than the Ant System's
+    'mmas_pheromone_decay': 0.06,
+    # MMAS: probability of an ant rebuilding the best route once converged,
+    # which sets the ratio of the pheromone bounds
+    'mmas_p_best': 0.9,
+    # MMAS: iterations without improvement before pheromones are reset
+    'mmas_stagnation': 50,
     # Number of ants in each colony
-    'num_ants' : 50
+    'num_ants' : 50,
+    # Advance all ants together, one hop per step
+    'batch_ants': True,
+    # Number of cheapest successors ants choose from at each step, falling
+    # back to all destinations once these are visited.  Zero to disable.
+    'candidate_list_size': 0,
+    # Routes improved by 2-opt/Or-opt local search: None, 'best' or 'all'
+    'local_search': None,
+    # Number of cheapest successors local search tries to connect to
+    'local_search_neighbours': 10,
+    # Number of processes to spread the ants over
+    'num_processes': 1,
+    # Number of processes batch_choices spreads the destinations over
+    'choice_processes': 1,
+    # Haversine metric: ratio of road to great circle distance
+    'detour_factor': 1.3,
+    # Haversine metric: average driving speed in km/h
+    'average_speed': 30.
 }
 
+# Bumped by invalidate whenever the parameters change
+_VERSION = [0]
+_SNAPSHOT = []
+
 def dump_parameters(filename='algo_parameters.pkl'):
     ''' Save current parameter set to a file '''
     output = file(filename, 'wb')
@@ -33,6 +89,7 @@ def load_parameters(filename='algo_parameters.pkl'):
     _ALGO.clear()
     _ALGO.update(pickle.load(input_file))
     input_file.close()
+    invalidate()
 
 def get_parameter(param):
     ''' Get value for a parameter '''
@@ -41,6 +98,58 @@ def get_parameter(param):
 def set_parameter(param, value):
     ''' Set parameter value '''
     _ALGO[param] = value
+    invalidate()
+
+def invalidate():
+    ''' Mark snapshots out of date, so they are resolved again on use '''
+    _VERSION[0] += 1
+
+class ParameterSnapshot(object):
+    ''' Parameter values resolved once, until the parameters change '''
+    def __init__(self):
+        self.refresh()
+
+    def refresh(self):
+        ''' Take the current parameter values '''
+        self.values = dict(_ALGO)
+        self.version = _VERSION[0]
+
+    def __getitem__(self, param):
+        if self.version != _VERSION[0]:
+            self.refresh()
+        return self.values[param]
+
+    def bind(self, func):
+        ''' Return func (decorated with use_parameters) with its parameters
+        filled in from this snapshot
+
+        Parameters passed explicitly still take precedence, and passing None
+        selects the default, as with use_parameters.
+        '''
+        instance = getattr(func, 'im_self', None)
+        function = getattr(func, 'im_func', func)
+        names = getattr(function, 'parameter_names', ())
+        function = getattr(function, 'unwrapped', function)
+        args = () if instance is None else (instance,)
+        # Version and partial function currently bound
+        bound = [None, None]
+        def bound_func(*call_args, **kwargs):
+            ''' Call func with the snapshot parameters '''
+            if bound[0] != _VERSION[0]:
+                values = dict((name, self[name]) for name in names)
+                bound[:] = [_VERSION[0],
+                            functools.partial(function, *args, **values)]
+            for name in names:
+                if name in kwargs and kwargs[name] is None:
+                    del kwargs[name]
+            return bound[1](*call_args, **kwargs)
+        return functools.wraps(function)(bound_func)
+
+def snapshot():
+    ''' Return the parameter snapshot shared by all users '''
+    if not _SNAPSHOT:
+        _SNAPSHOT.append(ParameterSnapshot())
+    return _SNAPSHOT[0]
 
 def use_parameters(func):
     ''' Decorator adds parameters into functions if not supplied '''
@@ -51,10 +160,14 @@ def use_parameters(func):
     if len(param_names) == 0:
         return func
     # Else monitor the parameter arguments for None values
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         ''' Replace missing parameter kwargs '''
         for param in param_names:
-            if param not in kwargs or kwargs[param] is None:
+            if kwargs.get(param) is None:
                 kwargs[param] = _ALGO[param]
         return func(*args, **kwargs)
+    # For ParameterSnapshot.bind
+    wrapper.unwrapped = func
+    wrapper.parameter_names = param_names
     return wrapper
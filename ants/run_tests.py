@@ -3,12 +3,20 @@ import unittest
 from ants.tests.timing import *
 from ants.tests.time_window import *
 from ants.tests.gmaps import *
+from ants.tests.store import *
+from ants.tests.fetcher import *
+from ants.tests.haversine import *
+from ants.tests.roadgraph import *
 from ants.tests.engine import *
 from ants.tests.engine_timing import *
 from ants.tests.operations import *
 from ants.tests.parameters import *
 from ants.tests.routemap import *
 from ants.tests.rootfinder import *
+from ants.tests.sampling import *
+from ants.tests.choicemaker import *
+from ants.tests.colony import *
+from ants.tests.localsearch import *
 
 if __name__ == "__main__":
    unittest.main()
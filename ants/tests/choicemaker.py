@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+
+from ants.engine.choicemaker import binned_kde, binned_kde_columns, \
+      batch_choices, extrema, merge_peaks, KDEChoiceMaker
+
+class TestKDEChoiceMaker(unittest.TestCase):
+   def setUp(self):
+      np.random.seed(7)
+      self.samples = np.concatenate((np.random.normal(400., 20., 6000),
+                                     np.random.normal(900., 40., 3000)))
+
+   def test_kde(self):
+      centers, density = binned_kde(self.samples, bandwidth=10.)
+      self.assertEqual(len(centers), 1440)
+      self.assertAlmostEqual(density.sum(), 1.)
+      # Peak of the narrow normal, 2/3 of the samples
+      expected = 2./3/np.sqrt(2*np.pi*(20.**2 + 10.**2))
+      self.assertTrue(abs(density[400] - expected) < 0.1*expected)
+      self.assertTrue(np.all(density >= 0))
+
+   def test_extrema(self):
+      values = np.array([0., 1., 2., 1., 1., 3., 3., 0., 0.])
+      maxima, minima = extrema(values)
+      self.assertEqual(list(maxima), [2, 6])
+      self.assertEqual(list(minima), [4])
+
+   def test_merge_peaks(self):
+      positions = np.arange(0., 1000., 10.)
+      values = np.zeros(100)
+      values[[10, 15, 60, 62]] = [1., 2., 1., 0.5]
+      # 10 & 15 are close, and so are 60 & 62
+      self.assertEqual(merge_peaks([10, 15, 60, 62], positions, values),
+                       [15, 60])
+
+   def test_choices(self):
+      choices = KDEChoiceMaker(self.samples).choices
+      self.assertEqual(len(choices), 2)
+      (low_1, high_1, area_1), (low_2, high_2, area_2) = choices
+      self.assertTrue(low_1 < 400 < high_1 <= low_2 < 900 < high_2)
+      self.assertAlmostEqual(area_1, 2./3, 2)
+      self.assertAlmostEqual(area_2, 1./3, 2)
+
+class TestBatchChoices(unittest.TestCase):
+   def setUp(self):
+      np.random.seed(11)
+      self.samples = np.column_stack((
+         np.random.normal(400., 20., 3000),
+         np.where(np.random.uniform(size=3000) < 0.5,
+                  np.random.normal(300., 30., 3000),
+                  np.random.normal(800., 30., 3000)),
+         np.random.normal(1000., 60., 3000)))
+
+   def test_binning(self):
+      samples = self.samples.copy()
+      # Out of range, and on the upper edge
+      samples[:5, 0] = [-3., 1440., 1500., 0., 1439.9]
+      centers, densities = binned_kde_columns(samples, bandwidth=1.)
+      for column in range(3):
+         centers_1d, density = binned_kde(samples[:, column], bandwidth=1.)
+         self.assertTrue(np.allclose(density, densities[column]))
+      self.assertTrue(np.all(centers == centers_1d))
+
+   def test_columns(self):
+      choices = batch_choices(self.samples)
+      self.assertEqual([len(choice) for choice in choices], [1, 2, 1])
+      for column in range(3):
+         single = KDEChoiceMaker(self.samples[:, column]).choices
+         self.assertTrue(np.allclose(choices[column], single))
+
+   def test_pool(self):
+      self.assertEqual(batch_choices(self.samples, choice_processes=2),
+                       batch_choices(self.samples, choice_processes=1))
+
+if __name__ == "__main__":
+   unittest.main()
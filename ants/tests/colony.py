@@ -0,0 +1,168 @@
+import unittest
+
+import numpy as np
+
+import ants.parameters as params
+import ants.engine.colony as colony_module
+import ants.engine.sampling as sampling
+from ants.engine.colony import Colony
+from ants.engine.routemap import RouteMap
+from ants.tests.std_routes import grid_destinations
+
+class TestColony(unittest.TestCase):
+    def setUp(self):
+        self.routemap = RouteMap(grid_destinations(9))
+
+    def check_routes(self, routes):
+        for route in routes:
+            # Start and end at the origin, visiting everybody once
+            self.assertEqual(route[0], 0)
+            self.assertEqual(route[-1], 0)
+            self.assertEqual(sorted(route[:-1]), range(9))
+
+    def test_batched_routes(self):
+        colony = Colony(self.routemap, num_ants=20, batch_ants=True)
+        routes = colony.build_routes(colony.transition_matrix())
+        self.assertEqual(routes.shape, (20, 10))
+        self.check_routes(routes)
+
+    def test_sequential_routes(self):
+        colony = Colony(self.routemap, num_ants=20, batch_ants=False)
+        self.check_routes(colony.build_routes(colony.transition_matrix()))
+
+    def test_same_distribution(self):
+        ''' Batched and sequential ants pick first hops alike '''
+        first_hops = []
+        for batch_ants in (True, False):
+            colony = Colony(self.routemap, num_ants=5000,
+                            batch_ants=batch_ants)
+            routes = colony.build_routes(colony.transition_matrix())
+            first_hops.append(
+                np.bincount(routes[:, 1], minlength=9)/5000.)
+        for batched, sequential in zip(*first_hops):
+            self.assertAlmostEqual(batched, sequential, 1)
+
+    def test_run_ants(self):
+        colony = Colony(self.routemap, num_ants=10)
+        before = colony.pheromones.sum()
+        colony.run_ants()
+        self.assertTrue(colony.pheromones.sum() > before)
+        self.assertTrue(len(colony.routes_and_results) > 0)
+        colony.update_pheromones()
+        # None selects the default, as with use_parameters
+        colony.update_pheromones(pheromone_decay=None)
+
+    def check_deposit(self, deposit_rule, expected):
+        colony = Colony(self.routemap, num_ants=10,
+                        deposit_rule=deposit_rule, rank_ants=3)
+        routes = colony.build_routes(colony.transition_matrix())
+        colony.pheromones[:] = 0.
+        costs = np.arange(10, 20, dtype=float)
+        colony.best_route, colony.best_cost = (routes[-1], 5.)
+        colony.deposit(routes, costs)
+        # Every depositing ant leaves the origin once
+        self.assertAlmostEqual(colony.pheromones[0, :].sum(), expected)
+        self.assertAlmostEqual(colony.pheromones.sum(), 9*expected)
+
+    def test_deposit_rules(self):
+        self.check_deposit('all', sum(1./cost for cost in range(10, 20)))
+        self.check_deposit('iteration_best', 1./10)
+        self.check_deposit('global_best', 1./5)
+        self.check_deposit('rank', 2./10 + 1./11 + 3./5)
+        self.assertRaises(ValueError, self.check_deposit, 'nobody', 0.)
+
+    def test_peak_deposit(self):
+        for deposit_rule, peak in [('all', 10), ('iteration_best', 1),
+                                   ('global_best', 1), ('rank', 3 + 2 + 1)]:
+            colony = Colony(self.routemap, num_ants=10,
+                            deposit_rule=deposit_rule, rank_ants=3)
+            self.assertEqual(colony.peak_deposit(), peak)
+        # Fewer ants than ranks
+        colony = Colony(self.routemap, num_ants=2, deposit_rule='rank',
+                        rank_ants=6)
+        self.assertEqual(colony.peak_deposit(), 6 + 5 + 4)
+
+    def test_candidate_lists(self):
+        candidates = self.routemap.candidate_lists(3)
+        self.assertEqual(candidates.shape, (9, 3))
+        costs = self.routemap.tangible_costs
+        for start, row in enumerate(candidates):
+            self.assertFalse(start in row)
+            others = [cost for end, cost in enumerate(costs[start])
+                      if end != start]
+            self.assertEqual(list(costs[start, row]), sorted(others)[:3])
+
+    def test_candidate_routes(self):
+        for batch_ants in (True, False):
+            colony = Colony(self.routemap, num_ants=200,
+                            candidate_list_size=2, batch_ants=batch_ants)
+            routes = colony.build_routes(colony.transition_matrix())
+            self.check_routes(routes)
+            # The first hop is always one of the origin's candidates
+            self.assertTrue(set(routes[:, 1]) <= set(colony.candidates[0]))
+
+    def test_local_search(self):
+        self.assertRaises(ValueError, Colony, self.routemap,
+                          local_search='some')
+        for local_search in ('best', 'all'):
+            colony = Colony(self.routemap, num_ants=5,
+                            local_search=local_search,
+                            local_search_neighbours=4)
+            colony.run_ants()
+            self.check_routes([colony.best_route])
+            self.assertAlmostEqual(
+                colony.best_cost,
+                self.routemap.total_tangible_cost_for_route(colony.best_route))
+
+    def test_mmas(self):
+        colony = Colony(self.routemap, num_ants=10, ant_system='mmas',
+                        mmas_stagnation=3)
+        self.assertEqual(colony.deposit_rule, 'rank')
+        self.assertEqual(colony.rank_ants,
+                         params.get_parameter('mmas_rank_ants'))
+        colony.run_ants()
+        colony.update_pheromones()
+        # Trails start out at the upper bound
+        self.assertTrue(np.all(colony.pheromones == colony.tau_max))
+        for iteration in range(10):
+            colony.run_ants()
+            colony.update_pheromones()
+            self.assertTrue(np.all(colony.pheromones >= colony.tau_min))
+            self.assertTrue(np.all(colony.pheromones <= colony.tau_max))
+        self.assertAlmostEqual(colony.tau_max, colony.peak_deposit()/(
+            params.get_parameter('mmas_pheromone_decay')*colony.best_cost))
+        # Reset once stagnated
+        colony.last_improvement = colony.iteration - 3
+        colony.update_pheromones()
+        self.assertTrue(np.all(colony.pheromones == colony.tau_max))
+        self.assertRaises(ValueError, Colony, self.routemap, ant_system='x')
+
+    def test_parallel(self):
+        colony = Colony(self.routemap, num_ants=10, num_processes=2)
+        try:
+            routes, costs = colony.run_ants_parallel()
+            self.assertEqual(routes.shape, (10, 10))
+            self.check_routes(routes)
+            self.assertEqual(len(costs), 10)
+            before = colony.pheromones.sum()
+            colony.run_ants()
+            self.assertTrue(colony.pheromones.sum() > before)
+        finally:
+            colony.close()
+
+    def test_worker_batch_ants(self):
+        ''' Pool workers build sequential ants when batch_ants is off '''
+        colony = Colony(self.routemap, num_ants=3, candidate_list_size=3)
+        transitions = colony.transition_matrix()
+        colony_module._init_worker(transitions.ravel(), self.routemap,
+                                   colony.candidates)
+        for batch_ants in (True, False):
+            routes, costs = colony_module._run_ant_batch(
+                (3, batch_ants, False, 5))
+            sampling.seed(5)
+            colony.batch_ants = batch_ants
+            self.assertTrue(np.all(
+                routes == colony.build_routes(transitions)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+import unittest
+import urlparse
+
+from googlemaps import GoogleMaps
+from ants.geocoders.fetcher import Fetcher, TokenBucket
+import ants.geocoders.gmaps as gmaps
+from ants.tests.std_routes import grid_addresses, grid_position, grid_travel
+
+COUNT = 6
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+   ''' Answers geocoding, directions and distance matrix queries for the
+   grid addresses '''
+   def do_GET(self):
+      path, query = self.path.split('?', 1)
+      fields = urlparse.parse_qs(query)
+      if path == '/maps/matrix':
+         query = '%s to %s' % (fields['origins'][0], fields['destinations'][0])
+      else:
+         query = fields['q'][0]
+      server = self.server
+      with server.lock:
+         server.requests.append(query)
+         attempts = server.requests.count(query)
+      time.sleep(server.delay)
+      index = server.index
+      if (query in server.flaky or path in server.flaky) and attempts == 1:
+         # Too many queries
+         response = {'Status': {'code': 620}}
+      elif path == '/maps/geo':
+         if query not in index:
+            response = {'Status': {'code': 602}}
+         else:
+            x_pos, y_pos = grid_position(index[query], COUNT)
+            response = {'Status': {'code': 200},
+                        'Placemark': [{'Point': {'coordinates':
+                                                 [x_pos, y_pos, 0]}}]}
+      elif path == '/maps/matrix':
+         rows = []
+         for origin in fields['origins'][0].split('|'):
+            elements = []
+            for destination in fields['destinations'][0].split('|'):
+               seconds, meters = grid_travel(index[origin],
+                                             index[destination], COUNT)
+               elements.append({'status': 'OK',
+                                'duration': {'value': seconds},
+                                'distance': {'value': meters}})
+            rows.append({'elements': elements})
+         response = {'status': 'OK', 'rows': rows}
+      else:
+         start, end = query[len('from:'):].split(' to:')
+         seconds, meters = grid_travel(index[start], index[end], COUNT)
+         response = {'Status': {'code': 200},
+                     'Directions': {'Duration': {'seconds': seconds},
+                                    'Distance': {'meters': meters}}}
+      self.send_response(200)
+      self.end_headers()
+      self.wfile.write(json.dumps(response))
+
+   def log_message(self, *args):
+      pass
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+   daemon_threads = True
+   request_queue_size = 64
+
+class TestFetcher(unittest.TestCase):
+   def setUp(self):
+      self.server = StubServer(('127.0.0.1', 0), StubHandler)
+      self.server.lock = threading.Lock()
+      self.server.requests = []
+      self.server.flaky = set()
+      self.server.delay = 0.
+      self.addresses = grid_addresses(COUNT)
+      self.server.index = dict((address, index) for index, address
+                               in enumerate(self.addresses))
+      thread = threading.Thread(target=self.server.serve_forever)
+      thread.daemon = True
+      thread.start()
+      self.stub = stub = GoogleMaps()
+      url = 'http://127.0.0.1:%i/maps/' % self.server.server_address[1]
+      stub._GEOCODE_QUERY_URL = url + 'geo?'
+      stub._DIRECTIONS_QUERY_URL = url + 'nav?'
+      gmaps.clear()
+      self.backend = gmaps.GoogleBackend(gmaps=stub)
+      self.backend.matrix_url = url + 'matrix'
+      self.previous = gmaps.set_backend(self.backend)
+
+   def tearDown(self):
+      gmaps.set_backend(self.previous)
+      gmaps.clear()
+      self.server.shutdown()
+      self.server.server_close()
+
+   def test_token_bucket(self):
+      bucket = TokenBucket(50.)
+      start = time.time()
+      for index in range(11):
+         bucket.take()
+      self.assertTrue(time.time() - start >= 0.19)
+
+   def test_prefetch(self):
+      gmaps.prefetch(self.addresses, rate=None)
+      # The geocodes, and all the travel in one distance matrix request
+      self.assertEqual(len(self.server.requests), COUNT + 1)
+      self.assertEqual(gmaps.lat_lng(self.addresses[4]),
+                       grid_position(4, COUNT)[::-1])
+      self.assertEqual(gmaps.time_between(self.addresses[1],
+                                          self.addresses[5]),
+                       grid_travel(1, 5, COUNT)[0]/60.)
+      # Nothing left to fetch
+      gmaps.prefetch(self.addresses, rate=None)
+      self.assertEqual(len(self.server.requests), COUNT + 1)
+
+   def test_prefetch_blocks(self):
+      self.backend.max_elements = 10
+      gmaps.prefetch(self.addresses, rate=None)
+      # Two origins missing 6 destinations between them don't fit in 10
+      # pairs, so one request per origin
+      self.assertEqual(len(self.server.requests), COUNT + COUNT)
+      self.assertEqual(gmaps.distance_between(self.addresses[5],
+                                              self.addresses[0]),
+                       grid_travel(5, 0, COUNT)[1])
+
+   def test_concurrent(self):
+      self.server.delay = 0.05
+      start = time.time()
+      gmaps.prefetch(self.addresses, concurrency=10, rate=None)
+      # 6 geocodes in one round of 10, then one distance matrix request
+      self.assertTrue(time.time() - start < 0.05*4)
+
+   def test_retry(self):
+      self.server.flaky.add(self.addresses[2])
+      self.server.flaky.add('/maps/matrix')
+      gmaps.prefetch(self.addresses, rate=None, backoff=0.01)
+      self.assertEqual(self.server.requests.count(self.addresses[2]), 2)
+      self.assertEqual(len([query for query in self.server.requests
+                            if ' to ' in query]), 2)
+      self.assertEqual(gmaps.lat_lng(self.addresses[2]),
+                       grid_position(2, COUNT)[::-1])
+
+   def test_failure(self):
+      missing = '1 Nowhere Rd, Testville, CA'
+      self.assertRaises(gmaps.MetricError, gmaps.prefetch,
+                        self.addresses + [missing], rate=None, retries=0)
+      # Everything else was kept
+      requests = len(self.server.requests)
+      gmaps.prefetch(self.addresses, rate=None)
+      self.assertEqual(len(self.server.requests), requests)
+
+   def test_in_flight(self):
+      self.server.delay = 0.05
+      fetcher = Fetcher(gmaps.GoogleBackend(gmaps=self.stub), concurrency=4)
+      pair = (self.addresses[0], self.addresses[3])
+      first = fetcher.submit('travel', pair)
+      second = fetcher.submit('travel', pair)
+      self.assertTrue(first is second)
+      results, errors = fetcher.travels([pair, pair])
+      fetcher.close()
+      self.assertEqual(results, {pair: grid_travel(0, 3, COUNT)})
+      self.assertEqual(len(self.server.requests), 1)
+
+if __name__ == "__main__":
+   unittest.main()
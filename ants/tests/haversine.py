@@ -0,0 +1,98 @@
+import unittest
+import numpy as np
+
+import ants.metric
+import ants.geocoders.haversine as haversine
+from ants.engine.destination import Destination
+from ants.engine.routemap import RouteMap
+
+class TestHaversine(unittest.TestCase):
+   def setUp(self):
+      self.home = '120 Hays St, Woodland, CA 95696'
+      self.davis = '313 K St, Davis, CA 95616'
+      haversine.register(self.home, (38.667304, -121.780917))
+      haversine.register(self.davis, (38.543846, -121.740215))
+
+   def tearDown(self):
+      haversine.clear()
+
+   def test_lat_lng(self):
+      self.assertEqual(haversine.lat_lng(self.home), (38.667304, -121.780917))
+      self.assertEqual(haversine.lat_lng('37.77, -122.42'), (37.77, -122.42))
+      self.assertRaises(haversine.MetricError, haversine.lat_lng,
+                        '1 Nowhere Rd, Testville, CA')
+
+   def test_great_circle(self):
+      # San Francisco to Los Angeles is about 559 km
+      distance = haversine.great_circle_matrix([(37.7749, -122.4194)],
+                                               [(34.0522, -118.2437)])
+      self.assertTrue(555000 < distance[0, 0] < 563000)
+
+   def test_between(self):
+      # About 14 km as the crow flies
+      distance = haversine.distance_between(self.home, self.davis)
+      self.assertTrue(14000*1.3 < distance < 15000*1.3)
+      self.assertAlmostEqual(haversine.time_between(self.home, self.davis),
+                             distance/500.)
+      self.assertEqual(haversine.distance_between(self.home, self.home), 0)
+      self.assertAlmostEqual(
+         haversine.distance_between(self.home, self.davis),
+         haversine.distance_between(self.davis, self.home))
+
+   def test_matrices(self):
+      addresses = ['%f,%f' % (38. + 0.01*index, -121. - 0.02*index)
+                   for index in range(7)]
+      distances = haversine.distance_matrix(addresses, detour_factor=1.)
+      self.assertEqual(distances.shape, (7, 7))
+      self.assertAlmostEqual(distances[2, 5],
+                             haversine.distance_between(addresses[2],
+                                                        addresses[5])/1.3)
+      self.assertTrue(np.allclose(distances, distances.T))
+      self.assertTrue(np.all(np.diag(distances) == 0))
+      times = haversine.time_matrix(addresses, detour_factor=1.,
+                                    average_speed=60.)
+      self.assertTrue(np.allclose(times, distances/1000.))
+      seconds, meters = haversine.travel_matrices(
+         addresses, detour_factor=1., average_speed=60.)
+      self.assertTrue(np.allclose(meters, distances))
+      self.assertTrue(np.allclose(seconds/60., times))
+      seconds, meters = haversine.travel_matrix(
+         addresses[2:4], addresses, detour_factor=1., average_speed=60.)
+      self.assertEqual(meters.shape, (2, 7))
+      self.assertTrue(np.allclose(meters, distances[2:4]))
+
+   def test_blocks(self):
+      lat_lngs = np.random.uniform(37., 38., (50, 2))
+      blocked = haversine.BLOCK_ROWS
+      haversine.BLOCK_ROWS = 7
+      try:
+         distances = haversine.great_circle_matrix(lat_lngs, lat_lngs)
+      finally:
+         haversine.BLOCK_ROWS = blocked
+      self.assertTrue(np.allclose(
+         distances, haversine.great_circle_matrix(lat_lngs, lat_lngs)))
+
+class TestSelectMetric(unittest.TestCase):
+   def setUp(self):
+      self.previous = ants.metric.select('haversine')
+
+   def tearDown(self):
+      ants.metric.select(self.previous)
+
+   def test_select(self):
+      self.assertEqual(ants.metric.metric.time_matrix,
+                       haversine.time_matrix)
+      self.assertEqual(ants.metric.select('ants.geocoders.haversine'),
+                       'haversine')
+      self.assertEqual(ants.metric.metric.lat_lng, haversine.lat_lng)
+
+   def test_routemap(self):
+      destinations = [Destination('%f,%f' % (38. + 0.01*(index % 3),
+                                             -121. - 0.01*(index // 3)))
+                      for index in range(9)]
+      routemap = RouteMap(destinations)
+      self.assertEqual(routemap.times.shape, (9, 9))
+      self.assertTrue(routemap.times[0, 1] > 0)
+
+if __name__ == "__main__":
+   unittest.main()
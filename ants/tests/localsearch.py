@@ -0,0 +1,131 @@
+import unittest
+
+import numpy as np
+
+import ants.engine.localsearch as ls
+
+def route_cost(route, costs):
+    return sum(costs[start, end] for start, end in zip(route[:-1], route[1:]))
+
+class TestLocalSearch(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(5)
+        self.costs = random.uniform(1, 10, (12, 12))
+        np.fill_diagonal(self.costs, 0)
+        self.route = np.concatenate(([0], random.permutation(11) + 1, [0]))
+        self.neighbours = np.argsort(self.costs, axis=1)[:, 1:6]
+
+    def test_reversal_delta(self):
+        forward, backward = ls.prefix_costs(self.route, self.costs)
+        for first, last in [(1, 2), (1, 11), (3, 7), (10, 11)]:
+            reversed_route = self.route.copy()
+            reversed_route[first:last+1] = self.route[first:last+1][::-1]
+            self.assertAlmostEqual(
+                ls.reversal_delta(self.route, self.costs, forward, backward,
+                                  first, last),
+                route_cost(reversed_route, self.costs) -
+                route_cost(self.route, self.costs))
+
+    def test_move_delta(self):
+        for first, length, position in [(1, 1, 5), (4, 3, 0), (2, 2, 11),
+                                        (9, 3, 3)]:
+            moved = ls.moved_segment(self.route, first, length, position)
+            self.assertEqual(sorted(moved), sorted(self.route))
+            start = position < first and position+1 or position+1-length
+            self.assertEqual(list(moved[start:start+length]),
+                             list(self.route[first:first+length]))
+            self.assertAlmostEqual(
+                ls.move_delta(self.route, self.costs, first, length, position),
+                route_cost(moved, self.costs) -
+                route_cost(self.route, self.costs))
+
+    def check_improvement(self, improver, neighbours):
+        route, delta = improver(self.route, self.costs, neighbours)
+        self.assertTrue(delta < 0)
+        self.assertEqual(route[0], 0)
+        self.assertEqual(route[-1], 0)
+        self.assertEqual(sorted(route), sorted(self.route))
+        self.assertAlmostEqual(route_cost(route, self.costs),
+                               route_cost(self.route, self.costs) + delta)
+        return route
+
+    def test_two_opt(self):
+        route = self.check_improvement(ls.two_opt, None)
+        # No reversal improves a 2-opt route
+        forward, backward = ls.prefix_costs(route, self.costs)
+        for first in range(1, 11):
+            for last in range(first+1, 12):
+                self.assertTrue(ls.reversal_delta(
+                    route, self.costs, forward, backward, first, last) >
+                    -ls.EPSILON)
+        self.check_improvement(ls.two_opt, self.neighbours)
+
+    def test_or_opt(self):
+        self.check_improvement(ls.or_opt, None)
+        self.check_improvement(ls.or_opt, self.neighbours)
+
+    def test_or_opt_last_slot(self):
+        ''' Segments can move to just before the return to the origin '''
+        costs = np.full((4, 4), 10.)
+        for start, end in [(0, 2), (2, 3), (3, 1), (1, 0)]:
+            costs[start, end] = 1.
+        # The origin is nobody's neighbour
+        neighbours = np.array([[2], [2], [3], [1]])
+        route, delta = ls.or_opt(np.array([0, 1, 2, 3, 0]), costs,
+                                 neighbours, max_length=1)
+        self.assertEqual(list(route), [0, 2, 3, 1, 0])
+        self.assertEqual(delta, -27.)
+
+    def test_improve(self):
+        self.check_improvement(ls.improve, None)
+        self.check_improvement(ls.improve, self.neighbours)
+
+def improving_reversal(route, costs):
+    forward, backward = ls.prefix_costs(route, costs)
+    for first in range(1, len(route)-2):
+        for last in range(first+1, len(route)-1):
+            if ls.reversal_delta(route, costs, forward, backward, first,
+                                 last) < -ls.EPSILON:
+                return (first, last)
+
+def improving_move(route, costs, max_length=3):
+    for first in range(1, len(route)-1):
+        for length in range(1, min(max_length, len(route)-1-first) + 1):
+            for position in range(len(route)-1):
+                if first-1 <= position <= first+length-1:
+                    continue
+                if ls.move_delta(route, costs, first, length,
+                                 position) < -ls.EPSILON:
+                    return (first, length, position)
+
+class TestLocalOptimum(unittest.TestCase):
+    ''' The results can't be improved by another move, whatever the route '''
+    def instances(self):
+        random = np.random.RandomState(17)
+        for instance in range(100):
+            size = random.randint(4, 31)
+            costs = random.uniform(1, 10, (size, size))
+            np.fill_diagonal(costs, 0)
+            yield costs, np.concatenate(
+                ([0], random.permutation(size-1) + 1, [0]))
+
+    def test_two_opt(self):
+        for costs, route in self.instances():
+            route = ls.two_opt(route, costs)[0]
+            self.assertEqual(improving_reversal(route, costs), None)
+
+    def test_or_opt(self):
+        for costs, route in self.instances():
+            route = ls.or_opt(route, costs)[0]
+            self.assertEqual(improving_move(route, costs), None)
+
+    def test_improve(self):
+        for costs, route in self.instances():
+            improved, delta = ls.improve(route, costs)
+            self.assertEqual(improving_reversal(improved, costs), None)
+            self.assertEqual(improving_move(improved, costs), None)
+            self.assertAlmostEqual(route_cost(improved, costs),
+                                   route_cost(route, costs) + delta)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,10 @@ from ants.engine.destination import Destination
 
 import numpy as np
 
+from ants.tests.std_routes import grid_destinations
+from ants.tests.std_time_inputs import today_at
+import ants.timing as timing
+
 class TestOperations(unittest.TestCase):
     def setUp(self):
       # Approximate difference between two points is 20 mintues
@@ -67,3 +71,82 @@ class TestOperations(unittest.TestCase):
         for choice_count, actual in zip(choices, test):
             self.assertAlmostEqual(choice_count*normalization, actual, 0)
 
+class TestEdgeSelection(unittest.TestCase):
+    def test_select_edges_weighted(self):
+        test = np.array([[1., 2., 3., 4., 5.], [0., 2., 0., 2., 0.]])
+        iterations = 5000
+        choices = np.zeros((2, 5))
+        for i in range(iterations):
+            choices[[0, 1], select_edges_weighted(test)] += 1
+        for row_choices, row in zip(choices, test):
+            normalization = sum(row)*1.0/iterations
+            for choice_count, actual in zip(row_choices, row):
+                self.assertAlmostEqual(choice_count*normalization, actual, 0)
+
+class TestCompatabilityArray(unittest.TestCase):
+    def setUp(self):
+        time_prefs = [
+            timing.TimePreferences([(1, today_at(8, 00), today_at(8, 01))]),
+            timing.TimePreferences([(1, today_at(8, 00), today_at(9, 00)),
+                                    (1, today_at(12, 00), today_at(13, 00))]),
+            None,
+            timing.TimePreferences([(1, today_at(8, 5), today_at(8, 6))]),
+        ]
+        self.destinations = grid_destinations(4, time_prefs)
+
+    def test_windows(self):
+        owners, starts, ends, prefs = time_window_arrays(self.destinations)
+        self.assertEqual(list(owners), [0, 1, 1, 3])
+        self.assertEqual(list(prefs), [1., 0.5, 0.5, 1.])
+        self.assertTrue((ends > starts).all())
+
+    def test_matches_pairwise(self):
+        compatabilities = compatability_array(self.destinations,
+                                              iterations=2000)
+        for start_index, start in enumerate(self.destinations):
+            for end_index, end in enumerate(self.destinations):
+                if start_index == end_index:
+                    continue
+                self.assertAlmostEqual(
+                    compatabilities[start_index, end_index],
+                    start.compatability_to(end, iterations=2000), 1)
+        # Without time preferences, always compatible
+        self.assertTrue((compatabilities[2, :] == 1.).all())
+        self.assertTrue((compatabilities[:, 2] == 1.).all())
+
+    def test_variance_reduction(self):
+        plain = compatability_array(self.destinations, iterations=2000)
+        for method in ['antithetic', 'lhs', 'sobol']:
+            compatabilities = compatability_array(
+                self.destinations, iterations=512, mc_sampling=method)
+            self.assertTrue(np.allclose(compatabilities, plain, atol=0.1))
+            self.assertAlmostEqual(
+                self.destinations[1].compatability_to(
+                    self.destinations[3], iterations=512, mc_sampling=method),
+                plain[1, 3], 1)
+
+    def test_adaptive(self):
+        plain = compatability_array(self.destinations, iterations=2000)
+        compatabilities, samples = compatability_estimates(
+            self.destinations, iterations=2000, mc_tolerance=0.01,
+            mc_batch=50)
+        self.assertTrue(np.allclose(compatabilities, plain, atol=0.1))
+        self.assertEqual(samples[2], 0)
+        self.assertTrue((samples <= 2000).all())
+        estimate = self.destinations[0].compatability_estimate(
+            self.destinations[2], mc_tolerance=0.01)
+        self.assertEqual(estimate, (1., 0., 0))
+        row, column = compatability_row_column(
+            self.destinations, 1, times_array(self.destinations),
+            iterations=2000,
+            mc_tolerance=0.01, mc_batch=50)
+        self.assertTrue(np.allclose(row[[0, 3]], plain[1, [0, 3]],
+                                    atol=0.1))
+        self.assertTrue(np.allclose(column[[0, 3]], plain[[0, 3], 1],
+                                    atol=0.1))
+
+    def test_costs(self):
+        costs = compatability_cost_array(self.destinations,
+                                         cost_per_sad_customer=2.)
+        self.assertTrue((costs.diagonal() == 0).all())
+        self.assertAlmostEqual(costs[0, 1], 1., 1)
@@ -34,6 +34,39 @@ class TestParams(unittest.TestCase):
         self.assertEqual(result_with_spec['non_param'], 7)
         self.assertEqual(result_with_spec['dollar_per_km'], 20)
 
+    def test_snapshot(self):
+        old_iters = params.get_parameter('iterations')
+        snapshot = params.snapshot()
+        self.assertTrue(params.snapshot() is snapshot)
+        self.assertEqual(snapshot['iterations'], old_iters)
+        params.set_parameter('iterations', old_iters + 1)
+        self.assertEqual(snapshot['iterations'], old_iters + 1)
+        params.set_parameter('iterations', old_iters)
+
+    def test_bind(self):
+        class Costs(object):
+            @params.use_parameters
+            def cost(self, km, dollar_per_km=None):
+                return km*dollar_per_km
+        costs = Costs()
+        old_cost = params.get_parameter('dollar_per_km')
+        snapshot = params.snapshot()
+        cost = snapshot.bind(costs.cost)
+        self.assertEqual(cost.__name__, 'cost')
+        self.assertEqual(cost(3), 3*old_cost)
+        self.assertEqual(cost(3, dollar_per_km=5.), 15.)
+        # None still selects the default
+        self.assertEqual(cost(3, dollar_per_km=None), 3*old_cost)
+        # Changes through set_parameter are picked up
+        params.set_parameter('dollar_per_km', old_cost + 1)
+        self.assertEqual(cost(3), 3*(old_cost + 1))
+        # Direct changes only after invalidating
+        params._ALGO['dollar_per_km'] = old_cost
+        self.assertEqual(cost(3), 3*(old_cost + 1))
+        params.invalidate()
+        self.assertEqual(cost(3), 3*old_cost)
+
+
 
 if __name__ == "__main__":
     unittest.main()
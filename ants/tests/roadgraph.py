@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import ants.metric
+import ants.geocoders.roadgraph as roadgraph
+from ants.engine.destination import Destination
+from ants.engine.routemap import routemap_key
+
+# Nodes a-b-c along a street, and d north of b.  The street can only be
+# driven east (a to c), and b-d both ways.  The way back west goes through
+# the slow road c-e-a.
+_NODES = {'a': (38.000, -121.000), 'b': (38.000, -120.990),
+          'c': (38.000, -120.980), 'd': (38.010, -120.990),
+          'e': (37.990, -120.990)}
+_EDGES = [('a', 'b', 60, 900, 1), ('b', 'c', 60, 900, 1),
+          ('b', 'd', 120, 1100, 0), ('c', 'e', 300, 1500, 1),
+          ('e', 'a', 300, 1500, 1), ('d', 'c', '', 1300, 1)]
+
+class TestRoadGraph(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory, 'roads.csv')
+      output = open(self.filename, 'w')
+      output.write('source,target,source_lat,source_lng,target_lat,'
+                   'target_lng,meters,seconds,oneway\n')
+      for source, target, seconds, meters, oneway in _EDGES:
+         output.write('%s,%s,%f,%f,%f,%f,%s,%s,%s\n'
+                      % ((source, target) + _NODES[source] + _NODES[target]
+                         + (meters, seconds, oneway)))
+      output.close()
+      roadgraph.load(self.filename)
+      # Addresses a little off the nodes
+      self.addresses = dict((name, '%f,%f' % (lat + 0.0004, lng - 0.0003))
+                            for name, (lat, lng) in _NODES.iteritems())
+
+   def tearDown(self):
+      roadgraph.use_graph(None)
+      shutil.rmtree(self.directory)
+
+   def test_snap(self):
+      names = sorted(_NODES)
+      nodes = roadgraph.nodes([self.addresses[name] for name in names])
+      self.assertEqual(len(set(nodes)), 5)
+      for name, node in zip(names, nodes):
+         self.assertTrue(np.allclose(roadgraph._graph().lat_lngs[node],
+                                     _NODES[name]))
+
+   def test_directed(self):
+      a_addr, c_addr = (self.addresses['a'], self.addresses['c'])
+      self.assertEqual(roadgraph.time_between(a_addr, c_addr), 2.)
+      self.assertEqual(roadgraph.distance_between(a_addr, c_addr), 1800.)
+      # Back west the long way round
+      self.assertEqual(roadgraph.time_between(c_addr, a_addr), 10.)
+      self.assertEqual(roadgraph.distance_between(c_addr, a_addr), 3000.)
+
+   def test_matrices(self):
+      names = ['a', 'b', 'c', 'd']
+      addresses = [self.addresses[name] for name in names]
+      times = roadgraph.time_matrix(addresses)
+      distances = roadgraph.distance_matrix(addresses)
+      self.assertTrue(np.all(np.diag(times) == 0))
+      # b to d both ways
+      self.assertEqual(times[1, 3], 2.)
+      self.assertEqual(times[3, 1], 2.)
+      # d to a: d-c-e-a, whose d-c edge is driven at the average speed in
+      # 156 s, beats d-b-c-e-a
+      self.assertAlmostEqual(times[3, 0], (156 + 600)/60.)
+      self.assertEqual(distances[3, 0], 1300 + 3000)
+      self.assertEqual(times[1, 0], roadgraph.time_between(addresses[1],
+                                                           addresses[0]))
+      seconds, meters = roadgraph.travel_matrix(addresses[3:], addresses)
+      self.assertEqual(seconds.shape, (1, 4))
+      self.assertTrue(np.all(seconds/60. == times[3:]))
+      self.assertTrue(np.all(meters == distances[3:]))
+
+   def test_unreachable(self):
+      graph = roadgraph.RoadGraph([(38., -121.), (38., -120.99)],
+                                  [0], [1], [60.], [900.])
+      roadgraph.use_graph(graph)
+      self.assertRaises(roadgraph.MetricError, roadgraph.time_between,
+                        '38.,-120.99', '38.,-121.')
+
+   def test_select(self):
+      previous = ants.metric.select('roadgraph')
+      try:
+         self.assertEqual(ants.metric.metric.time_between(
+            self.addresses['a'], self.addresses['b']), 1.)
+      finally:
+         ants.metric.select(previous)
+
+   def test_fingerprint(self):
+      previous = ants.metric.select('roadgraph')
+      try:
+         destinations = [Destination(self.addresses[name])
+                         for name in ['a', 'b', 'c']]
+         key = routemap_key(destinations)
+         self.assertEqual(key, routemap_key(destinations))
+         # The same network again
+         roadgraph.load(self.filename)
+         self.assertEqual(key, routemap_key(destinations))
+         graph = roadgraph._graph()
+         roadgraph.use_graph(roadgraph.RoadGraph(
+            graph.lat_lngs, [0, 1], [1, 2], [60., 60.], [900., 900.]))
+         self.assertNotEqual(key, routemap_key(destinations))
+      finally:
+         ants.metric.select(previous)
+
+if __name__ == "__main__":
+   unittest.main()
@@ -1,4 +1,6 @@
-from ants.engine.rootfinder import find_roots
+from ants.engine.rootfinder import find_roots, find_roots_array, \
+        spline_roots, xfrange, frange
+from scipy import interpolate
 import unittest
 import numpy as np
 
@@ -25,3 +27,41 @@ class TestRootFinder(unittest.TestCase):
 
         roots = list(find_roots(norootfunc, np.arange(-5, 5, 0.1)))
         self.assertEqual(roots, [])
+
+    def test_vectorized(self):
+        def my_rooty_func(x):
+            # (x-1)(x+2)(x-3.5)
+            return (x - 1)*(x + 2)*(x - 3.5)
+
+        points = np.arange(-5, 5, 0.1)
+        roots = find_roots_array(my_rooty_func, points)
+        self.assertEqual(len(roots), 3)
+        for root, expected in zip(roots, list(find_roots(my_rooty_func,
+                                                          points))):
+            self.assertAlmostEqual(root, expected, 10)
+        self.assertEqual(list(find_roots(my_rooty_func, points,
+                                         vectorized=True)), list(roots))
+
+    def test_vectorized_exact(self):
+        # Roots right on the grid points
+        roots = find_roots_array(lambda x: x*(x - 2), np.arange(-3., 3.))
+        self.assertTrue(0. in roots)
+        self.assertTrue(2. in roots)
+        self.assertEqual(len(find_roots_array(lambda x: x*x + 3,
+                                              np.arange(-5, 5, 0.1))), 0)
+
+    def test_spline_roots(self):
+        x_vals = np.linspace(0, 2*np.pi, 50)
+        tck = interpolate.splrep(x_vals, np.sin(x_vals), s=0)
+        roots = spline_roots(tck, der=1)
+        self.assertEqual(len(roots), 2)
+        self.assertAlmostEqual(roots[0], np.pi/2, 3)
+        self.assertAlmostEqual(roots[1], 3*np.pi/2, 3)
+        self.assertEqual(len(spline_roots(tck, der=1, between=(0, 3))), 1)
+
+    def test_frange(self):
+        for args in [(0, 1, 0.25), (0, 1, 0.3), (2, 5, 1), (1, 1, 0.5),
+                     (0, 10, 0.5)]:
+            self.assertTrue(np.allclose(frange(*args), list(xfrange(*args))))
+        self.assertRaises(ValueError, frange, 1, 0, 0.1)
+
@@ -1,11 +1,18 @@
 import ants.engine.routemap as rm
+from ants.engine.colony import Colony
 from ants.engine.destination import Destination
 
 import ants.tests.std_time_inputs as time_inputs
+from ants.tests.std_routes import grid_destinations
+import ants.timing as timing
 
 import ants.parameters as params
 
+import os
+import shutil
+import tempfile
 import unittest
+import numpy as np
 
 class TestRouteMap(unittest.TestCase):
     # TODO refactor all these tests to inherit from a 
@@ -49,5 +56,192 @@ class TestRouteMap(unittest.TestCase):
             0.33*params.get_parameter('dollar_per_hour') + 
             19.3*params.get_parameter('dollar_per_km'), 1)
         
+class TestRouteSimulation(unittest.TestCase):
+    def setUp(self):
+        today_at = time_inputs.today_at
+        time_prefs = [
+            timing.TimePreferences([(1, today_at(8, 00), today_at(8, 01))]),
+            # Always reached in time
+            timing.TimePreferences([(1, today_at(8, 00), today_at(12, 00))]),
+            None,
+            # Never reached in time
+            timing.TimePreferences([(1, today_at(6, 00), today_at(7, 00))]),
+        ]
+        self.routemap = rm.RouteMap(grid_destinations(4, time_prefs))
+        self.route = [0, 1, 2, 3, 0]
+
+    def test_cost_matrices(self):
+        destinations = self.routemap.destinations
+        for start_index, start in enumerate(destinations):
+            for end_index, end in enumerate(destinations):
+                self.assertEqual(self.routemap.times[start_index, end_index],
+                                 start.time_to(end))
+                self.assertAlmostEqual(
+                    self.routemap.tangible_costs[start_index, end_index],
+                    start.distance_to(end)*
+                    params.get_parameter('dollar_per_km')/1000. +
+                    start.time_to(end)*
+                    params.get_parameter('dollar_per_hour')/60.)
+
+    def test_total_tangible_batch(self):
+        routes = [self.route, [0, 3, 2, 1, 0], [0, 2, 0, 1, 3]]
+        costs = self.routemap.total_tangible_costs_for_routes(routes)
+        self.assertEqual(len(costs), 3)
+        for route, cost in zip(routes, costs):
+            self.assertAlmostEqual(
+                self.routemap.total_tangible_cost_for_route(route), cost)
+
+    def test_arrival_times(self):
+        arrivals = self.routemap.simulate_arrival_times(
+            self.route, 1000, start_times=10.)
+        self.assertEqual(arrivals.shape, (1000, 5))
+        self.assertTrue((arrivals[:, 0] == 10.).all())
+        # Travel time plus the average delivery time of two minutes
+        self.assertAlmostEqual(
+            arrivals[:, 2].mean() - arrivals[:, 1].mean(),
+            self.routemap.time_for_edge(1, 2) + 2, 0)
+        self.assertTrue((arrivals[:, 1] ==
+                         10. + self.routemap.time_for_edge(0, 1)).all())
+
+    def test_hist_arrival_times(self):
+        hist = self.routemap.hist_arrival_times(self.route, 50)
+        self.assertEqual(hist.shape, (50, 4))
+        # The origin column holds the return time
+        self.assertTrue((hist[:, 0] > hist[:, 3]).all())
+        self.assertEqual(len(self.routemap.sim_arrival_times(self.route)), 4)
+
+    def test_satisfaction_costs(self):
+        cost = self.routemap.total_satisfaction_costs(
+            self.route, iterations=2000, cost_per_sad_customer=1.)
+        # Customer 3, and the return to the origin, are always late
+        self.assertAlmostEqual(cost, 2., 5)
+
+    def test_variance_reduction(self):
+        for method in ['antithetic', 'lhs', 'sobol']:
+            cost = self.routemap.total_satisfaction_costs(
+                self.route, iterations=256, cost_per_sad_customer=1.,
+                mc_sampling=method)
+            self.assertAlmostEqual(cost, 2., 5)
+        start_times, delivery_times = self.routemap.route_samples(
+            self.route, 1000, 'lhs')
+        self.assertEqual(delivery_times.shape, (1000, 4))
+        self.assertAlmostEqual(delivery_times[:, 1].mean(), 2., 1)
+
+    def test_adaptive(self):
+        for common in [False, True]:
+            estimate = self.routemap.satisfaction_cost_estimate(
+                self.route, iterations=2000, cost_per_sad_customer=1.,
+                common_random_numbers=common, mc_tolerance=0.01,
+                mc_batch=50)
+            # Nothing uncertain, so it stops early
+            self.assertAlmostEqual(estimate.value, 2., 5)
+            self.assertTrue(estimate.samples < 2000)
+        cost = self.routemap.total_satisfaction_costs(
+            self.route, mc_tolerance=0.01)
+        self.assertAlmostEqual(cost, 2.*params.get_parameter(
+            'cost_per_sad_customer'), 5)
+
+    def test_common_random_numbers(self):
+        first = self.routemap.route_samples(
+            self.route, 100, common_random_numbers=True)
+        swapped = self.routemap.route_samples(
+            [0, 2, 1, 3, 0], 100, common_random_numbers=True)
+        # Same throws for each destination, whatever the route
+        self.assertTrue(np.all(first[0] == swapped[0]))
+        self.assertTrue(np.all(first[1][:, 1] == swapped[1][:, 2]))
+        self.assertTrue(np.all(first[1][:, 3] == swapped[1][:, 3]))
+        self.routemap.resample()
+        again = self.routemap.route_samples(
+            self.route, 100, common_random_numbers=True)
+        self.assertFalse(np.all(first[1] == again[1]))
+
+class TestRouteMapCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        today_at = time_inputs.today_at
+        self.time_prefs = [
+            timing.TimePreferences([(1, today_at(8, 00), today_at(12, 00))]),
+            None, None,
+            timing.TimePreferences([(1, today_at(9, 00), today_at(10, 00))])]
+        self.destinations = grid_destinations(4, self.time_prefs)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        built = rm.RouteMap(self.destinations, cache_dir=self.directory)
+        self.assertEqual(os.listdir(self.directory), [built.key])
+        loaded = rm.RouteMap(self.destinations, cache_dir=self.directory)
+        self.assertEqual(loaded.key, built.key)
+        self.assertTrue(isinstance(loaded.costs, np.memmap))
+        for name in rm.CACHED_ARRAYS:
+            self.assertTrue(np.all(getattr(loaded, name) ==
+                                   getattr(built, name)))
+        self.assertTrue(np.all(loaded.window_starts == built.window_starts))
+
+    def test_key(self):
+        key = rm.routemap_key(self.destinations)
+        self.assertEqual(key, rm.routemap_key(grid_destinations(
+            4, self.time_prefs)))
+        # Order, time preferences, delivery times and parameters all count
+        self.assertNotEqual(key, rm.routemap_key(self.destinations[::-1]))
+        self.assertNotEqual(key, rm.routemap_key(grid_destinations(4)))
+        self.destinations[2] = Destination(
+            self.destinations[2].address, delivery_time_avg=3)
+        changed = rm.routemap_key(self.destinations)
+        self.assertNotEqual(key, changed)
+        old_cost = params.get_parameter('dollar_per_km')
+        params.set_parameter('dollar_per_km', old_cost + 1.)
+        try:
+            self.assertNotEqual(changed, rm.routemap_key(self.destinations))
+        finally:
+            params.set_parameter('dollar_per_km', old_cost)
+        self.assertEqual(changed, rm.routemap_key(self.destinations))
+
+class TestRouteMapChanges(unittest.TestCase):
+    def setUp(self):
+        today_at = time_inputs.today_at
+        self.time_prefs = [
+            timing.TimePreferences([(1, today_at(8, 00), today_at(12, 00))]),
+            None, None, None,
+            timing.TimePreferences([(1, today_at(9, 00), today_at(10, 00))])]
+        self.destinations = grid_destinations(5, self.time_prefs)
+        self.routemap = rm.RouteMap(self.destinations[:4])
+        self.colony = Colony(self.routemap)
+
+    def assertSameMatrices(self, routemap, fresh):
+        # Compatabilities are simulated, so only check the ones without
+        # time preferences on both ends
+        for name in ['travel_distances', 'times', 'distances', 'time_costs',
+                     'tangible_costs', 'tangible_cheapness']:
+            self.assertTrue(np.allclose(getattr(routemap, name),
+                                        getattr(fresh, name)), name)
+        self.assertTrue(np.all(routemap.compatabilities[1:4, 1:4] ==
+                               fresh.compatabilities[1:4, 1:4]))
+
+    def test_add(self):
+        index = self.routemap.add_destination(self.destinations[4])
+        self.assertEqual(index, 4)
+        fresh = rm.RouteMap(self.destinations)
+        self.assertSameMatrices(self.routemap, fresh)
+        self.assertEqual(self.routemap.costs.shape, (5, 5))
+        self.assertEqual(list(self.routemap.has_time_pref),
+                         [True, False, False, False, True])
+        self.assertTrue(self.routemap.key is None)
+        self.assertEqual(self.colony.pheromones.shape, (5, 5))
+        self.assertEqual(self.colony.num_dest, 5)
+        self.colony.run_ants()
+
+    def test_remove(self):
+        self.routemap.add_destination(self.destinations[4])
+        self.routemap.remove_destination(2)
+        fresh = rm.RouteMap([self.destinations[index]
+                             for index in (0, 1, 3, 4)])
+        for name in ['travel_distances', 'times', 'tangible_costs']:
+            self.assertTrue(np.all(getattr(self.routemap, name) ==
+                                   getattr(fresh, name)), name)
+        self.assertEqual(self.colony.pheromones.shape, (4, 4))
+        self.assertRaises(ValueError, self.routemap.remove_destination, 0)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import numpy as np
+
+import ants.engine.sampling as sampling
+from ants.engine.destination import Destination
+from ants.tests.std_routes import grid_addresses, warm_cache
+
+class TestGammaPool(unittest.TestCase):
+   def test_moments(self):
+      pool = sampling.GammaPool(12.5, 0.4, block_size=1000)
+      samples = np.concatenate([pool.throw_many(700) for i in range(100)])
+      self.assertEqual(len(samples), 70000)
+      self.assertAlmostEqual(samples.mean(), 5, 1)
+      self.assertAlmostEqual(samples.var(), 2, 1)
+      self.assertTrue(isinstance(pool.throw(), float))
+
+   def test_blocks(self):
+      np.random.seed(5)
+      expected = np.random.gamma(2., 3., 10)
+      np.random.seed(5)
+      pool = sampling.GammaPool(2., 3., block_size=10)
+      first = pool.throw_many(4)
+      self.assertTrue(np.all(first == expected[:4]))
+      self.assertEqual([pool.throw() for i in range(3)], list(expected[4:7]))
+      # Runs over into the next block
+      self.assertEqual(len(pool.throw_many(25)), 25)
+      self.assertEqual(len(pool.block), 22)
+      self.assertEqual(pool.position, 22)
+
+   def test_seed(self):
+      pool = sampling.gamma_pool(3., 0.5)
+      self.assertTrue(pool is sampling.gamma_pool(3, 0.5))
+      sampling.seed(11)
+      first = pool.throw_many(50).copy()
+      sampling.seed(11)
+      self.assertTrue(np.all(pool.throw_many(50) == first))
+
+class TestUniforms(unittest.TestCase):
+   def test_methods(self):
+      for method in sampling.SAMPLING_METHODS:
+         throws = sampling.uniforms(64, 20, method)
+         self.assertEqual(throws.shape, (64, 20))
+         self.assertTrue(np.all((throws >= 0) & (throws < 1)))
+      self.assertRaises(ValueError, sampling.uniforms, 10, 2, 'magic')
+
+   def test_antithetic(self):
+      throws = sampling.uniforms(11, 3, 'antithetic')
+      self.assertTrue(np.allclose(throws[:5] + throws[6:], 1.))
+
+   def test_stratified(self):
+      for method in ['lhs', 'sobol']:
+         throws = sampling.uniforms(64, 20, method)
+         for column in throws.T:
+            self.assertEqual(sorted((column*64).astype(int)), range(64))
+      # Sobol points also fill the squares of pairs of dimensions
+      throws = sampling.sobol(16, 2)
+      self.assertEqual(len(set(zip((throws[:, 0]*4).astype(int),
+                                   (throws[:, 1]*4).astype(int)))), 16)
+      self.assertRaises(ValueError, sampling.sobol, 4,
+                        sampling.SOBOL_DIMENSIONS + 1)
+
+   def test_reproducible(self):
+      first = sampling.uniforms(8, 3, 'sobol', np.random.RandomState(3))
+      second = sampling.uniforms(8, 3, 'sobol', np.random.RandomState(3))
+      self.assertTrue(np.all(first == second))
+
+   def test_gamma(self):
+      throws = sampling.uniforms(20000, 1, 'lhs')[:, 0]
+      times = sampling.gamma_from_uniform(12.5, 0.4, throws)
+      self.assertAlmostEqual(times.mean(), 5, 2)
+      self.assertAlmostEqual(times.var(), 2, 1)
+
+class TestAdaptiveMean(unittest.TestCase):
+   def test_fixed(self):
+      counts = []
+      def draw(count):
+         counts.append(count)
+         return np.random.rand(count)
+      estimate = sampling.adaptive_mean(draw, 1000)
+      self.assertEqual(counts, [1000])
+      self.assertEqual(estimate.samples, 1000)
+      self.assertAlmostEqual(estimate.value, 0.5, 1)
+      self.assertAlmostEqual(estimate.standard_error,
+                             np.sqrt(1/12./1000), 3)
+
+   def test_adaptive(self):
+      # Clear cut values stop once a rare other value would have turned up
+      estimate = sampling.adaptive_mean(np.ones, 1000, 0.01, 50)
+      self.assertEqual(estimate.value, 1.)
+      self.assertEqual(estimate.samples, 200)
+      self.assertTrue(0 < estimate.standard_error <= 0.01)
+      # Uncertain ones go on until the standard error is small enough
+      estimate = sampling.adaptive_mean(np.random.rand, 100000, 0.01, 50)
+      self.assertTrue(estimate.standard_error <= 0.01)
+      self.assertTrue(700 <= estimate.samples <= 1000)
+      # Or the budget is used up
+      estimate = sampling.adaptive_mean(np.random.rand, 120, 0.001, 50)
+      self.assertEqual(estimate.samples, 120)
+
+   def test_rare_events(self):
+      random = np.random.RandomState(3)
+      for probability, missed in [(0.02, 0.1), (0.05, 0.)]:
+         def draw(count):
+            return random.rand(count) < probability
+         values = [sampling.adaptive_mean(draw, 5000, 0.01, 50).value
+                   for run in range(200)]
+         # Runs which stopped before seeing any event
+         self.assertTrue(np.mean(np.array(values) == 0) <= missed)
+
+   def test_columns(self):
+      def draw(count):
+         return np.column_stack((np.zeros(count), np.random.rand(count)))
+      estimate = sampling.adaptive_mean(draw, 100000, 0.01, 50)
+      self.assertEqual(estimate.value.shape, (2,))
+      self.assertEqual(estimate.value[0], 0.)
+      self.assertTrue(estimate.samples > 50)
+
+class TestDeliveryTimes(unittest.TestCase):
+   def test_shared(self):
+      addresses = grid_addresses(4)
+      warm_cache(4)
+      home = Destination(addresses[0], delivery_time_avg=5,
+                         delivery_time_variance=2)
+      other = Destination(addresses[1], delivery_time_avg=5,
+                          delivery_time_variance=2)
+      self.assertTrue(home.delivery_times is other.delivery_times)
+      times = home.throw_delivery_times(20000)
+      self.assertEqual(times.shape, (20000,))
+      self.assertAlmostEqual(times.mean(), 5, 0)
+
+if __name__ == "__main__":
+   unittest.main()
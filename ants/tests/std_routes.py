@@ -0,0 +1,87 @@
+''' Synthetic destinations for the engine tests
+
+Lays a set of made up addresses out on a square grid and loads their
+coordinates and driving directions into the metric cache, through a fake
+metric backend, so that RouteMaps can be built without asking Google.
+
+'''
+import math
+
+from ants.metric import metric
+from ants.engine.destination import Destination
+
+# Grid spacing in meters, and driving speed in meters per minute
+SPACING = 1000.
+SPEED = 500.
+
+def grid_addresses(count):
+   ''' Made up addresses for count grid points '''
+   return ['%i Grid St, Testville, CA' % index for index in range(count)]
+
+def grid_position(index, count):
+   ''' Position (in meters) of grid point index '''
+   side = int(math.ceil(math.sqrt(count)))
+   return ((index % side)*SPACING, (index // side)*SPACING)
+
+def grid_travel(start, end, count):
+   ''' Fake (seconds, meters) between two grid points.
+
+   Driving north is a little slower than driving south, so the
+   costs are asymmetric.
+   '''
+   x_1, y_1 = grid_position(start, count)
+   x_2, y_2 = grid_position(end, count)
+   meters = abs(x_2 - x_1) + abs(y_2 - y_1)
+   seconds = 60.*meters/SPEED + 30.*(y_2 > y_1)
+   return (seconds, meters)
+
+class GridBackend(object):
+   ''' Metric backend for count grid addresses, counting its requests '''
+   max_addresses = 25
+   max_elements = 100
+
+   def __init__(self, count):
+      self.count = count
+      self.index = dict((address, index) for index, address
+                        in enumerate(grid_addresses(count)))
+      self.travel_requests = 0
+      self.matrix_requests = 0
+
+   def lat_lng(self, address):
+      x_pos, y_pos = grid_position(self.index[address], self.count)
+      return (38. + y_pos/111000., -121. + x_pos/87000.)
+
+   def travel(self, address_1, address_2):
+      self.travel_requests += 1
+      return grid_travel(self.index[address_1], self.index[address_2],
+                         self.count)
+
+   def travel_matrix(self, origins, destinations):
+      assert len(origins) <= self.max_addresses
+      assert len(destinations) <= self.max_addresses
+      assert len(origins)*len(destinations) <= self.max_elements
+      self.matrix_requests += 1
+      return dict(((origin, destination),
+                   grid_travel(self.index[origin], self.index[destination],
+                               self.count))
+                  for origin in origins for destination in destinations)
+
+def warm_cache(count):
+   ''' Fill the metric cache with count grid addresses '''
+   addresses = grid_addresses(count)
+   previous = metric.set_backend(GridBackend(count))
+   try:
+      for address in addresses:
+         metric.lat_lng(address)
+      metric.travel_matrices(addresses)
+   finally:
+      metric.set_backend(previous)
+   return addresses
+
+def grid_destinations(count, time_prefs=None):
+   ''' Return count Destinations on the grid '''
+   addresses = warm_cache(count)
+   if time_prefs is None:
+      time_prefs = [None]*count
+   return [Destination(address, time_pref=time_pref)
+           for address, time_pref in zip(addresses, time_prefs)]
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ants.engine.destination import Destination
+import ants.engine.operations as op
+import ants.engine.routemap as rm
+from ants.geocoders.store import TravelStore
+import ants.geocoders.gmaps as gmaps
+from ants.tests.std_routes import GridBackend, grid_addresses, grid_travel
+
+class TestTravelStore(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory, 'test.sqlite')
+      self.store = TravelStore(self.filename)
+      self.home = '120 Hays St, Woodland, CA 95696'
+      self.davis = '313 K St, Davis, CA 95616'
+
+   def tearDown(self):
+      self.store.close()
+      gmaps.close_store()
+      gmaps.clear()
+      shutil.rmtree(self.directory)
+
+   def test_lookup(self):
+      self.assertEqual(self.store.lat_lng(self.home), None)
+      self.assertEqual(self.store.travel(self.home, self.davis), None)
+      self.store.add_lat_lng(self.home, (38.67, -121.78))
+      self.store.add_travel(self.home, self.davis, 1200., 19300.)
+      self.assertEqual(self.store.lat_lng(self.home), (38.67, -121.78))
+      self.assertEqual(self.store.travel(self.home, self.davis),
+                       (1200., 19300.))
+      # Directions are not symmetric
+      self.assertEqual(self.store.travel(self.davis, self.home), None)
+
+   def test_concurrent_reader(self):
+      reader = TravelStore(self.filename)
+      self.store.add_travel(self.home, self.davis, 1200., 19300.)
+      self.assertEqual(reader.travel(self.home, self.davis), (1200., 19300.))
+      # Appending overwrites nothing else
+      self.store.add_travel(self.davis, self.home, 1100., 19200.)
+      self.assertEqual(reader.travel(self.home, self.davis), (1200., 19300.))
+      reader.close()
+
+   def test_travels_from(self):
+      self.store.add_travel(self.home, self.davis, 1200., 19300.)
+      self.store.add_travel(self.davis, self.home, 1100., 19200.)
+      self.assertEqual(self.store.travels_from(self.home),
+                       {self.davis: (1200., 19300.)})
+      self.assertEqual(self.store.travels_from(self.home, [self.home]), {})
+
+   def test_gmaps_store(self):
+      self.store.add_lat_lng(self.home, (38.67, -121.78))
+      self.store.add_travel(self.home, self.davis, 1200., 19300.)
+      gmaps.clear()
+      gmaps.open_store(self.filename)
+      self.assertEqual(gmaps.lat_lng(self.home), (38.67, -121.78))
+      self.assertEqual(gmaps.time_between(self.home, self.davis), 20.)
+      self.assertEqual(gmaps.distance_between(self.home, self.davis), 19300.)
+
+   def test_store_cache(self):
+      gmaps.clear()
+      self.assertRaises(gmaps.MetricError, gmaps.store_cache)
+      gmaps._DIRECTIONS_CACHE[(self.davis, self.home)] = (1100., 19200.)
+      gmaps.open_store(self.filename)
+      gmaps.store_cache()
+      self.assertEqual(self.store.travel(self.davis, self.home),
+                       (1100., 19200.))
+
+class TestTravelMatrices(unittest.TestCase):
+   def setUp(self):
+      gmaps.clear()
+      self.count = 30
+      self.addresses = grid_addresses(self.count)
+      self.backend = GridBackend(self.count)
+      self.previous = gmaps.set_backend(self.backend)
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory, 'test.sqlite')
+
+   def tearDown(self):
+      gmaps.set_backend(self.previous)
+      gmaps.close_store()
+      gmaps.clear()
+      shutil.rmtree(self.directory)
+
+   def test_matrices(self):
+      times = gmaps.time_matrix(self.addresses)
+      distances = gmaps.distance_matrix(self.addresses)
+      self.assertEqual(times.shape, (self.count, self.count))
+      for start, end in [(0, 0), (0, 7), (7, 0), (29, 12)]:
+         seconds, meters = grid_travel(start, end, self.count)
+         self.assertEqual(times[start, end], seconds/60.)
+         self.assertEqual(distances[start, end], meters)
+      self.assertEqual(gmaps.time_between(self.addresses[3],
+                                          self.addresses[4]), times[3, 4])
+
+   def test_request_count(self):
+      gmaps.travel_matrices(self.addresses)
+      # 30*29 pairs in blocks of 4 origins * 25 destinations
+      self.assertEqual(self.backend.matrix_requests, 16)
+      self.assertEqual(self.backend.travel_requests, 0)
+      # Everything is cached now
+      gmaps.travel_matrices(self.addresses)
+      self.assertEqual(self.backend.matrix_requests, 16)
+
+   def test_only_missing(self):
+      gmaps.travel_matrices(self.addresses[:20])
+      requests = self.backend.matrix_requests
+      gmaps.travel_matrices(self.addresses)
+      # 10 new origins * 29 in blocks of 4 * 25 (sharing the last with 2 old
+      # origins), plus the other 18 old origins * 10 new destinations
+      self.assertEqual(self.backend.matrix_requests - requests, 3*2 + 2)
+
+   def test_rectangular(self):
+      seconds, meters = gmaps.travel_matrix(self.addresses[:20],
+                                            self.addresses[18:])
+      self.assertEqual(seconds.shape, (20, 12))
+      self.assertEqual((seconds[19, 1], meters[19, 1]), (0., 0.))
+      expected = grid_travel(3, 25, self.count)
+      self.assertEqual((seconds[3, 7], meters[3, 7]), expected)
+      # Only the 20*12 pairs asked for, in blocks of 8 origins * 12
+      self.assertEqual(self.backend.matrix_requests, 3)
+      self.assertEqual(self.backend.travel_requests, 0)
+
+   def test_add_destination(self):
+      routemap = rm.RouteMap([Destination(address)
+                              for address in self.addresses[:20]])
+      requests = self.backend.matrix_requests
+      routemap.add_destination(Destination(self.addresses[20]))
+      # One request for the new row and one for the new column
+      self.assertEqual(self.backend.matrix_requests - requests, 2)
+      self.assertEqual(self.backend.travel_requests, 0)
+      self.assertEqual(routemap.travel_distances[20, 7],
+                       grid_travel(20, 7, self.count)[1])
+      self.assertEqual(routemap.times[7, 20],
+                       grid_travel(7, 20, self.count)[0]/60.)
+
+   def test_single_pass(self):
+      destinations = [Destination(address) for address in self.addresses]
+      passes = []
+      missing_pairs = gmaps._missing_pairs
+      def counted(origins, destinations=None):
+         passes.append(origins)
+         return missing_pairs(origins, destinations)
+      gmaps._missing_pairs = counted
+      try:
+         distances, times = op.travel_matrices(destinations)
+      finally:
+         gmaps._missing_pairs = missing_pairs
+      self.assertEqual(len(passes), 1)
+      seconds, meters = grid_travel(3, 11, self.count)
+      self.assertEqual(distances[3, 11], meters)
+      self.assertEqual(times[3, 11], seconds/60.)
+
+   def test_store_fill(self):
+      gmaps.open_store(self.filename)
+      gmaps.travel_matrices(self.addresses)
+      requests = self.backend.matrix_requests
+      gmaps.clear()
+      times = gmaps.time_matrix(self.addresses)
+      self.assertEqual(self.backend.matrix_requests, requests)
+      self.assertEqual(times[0, 7], grid_travel(0, 7, self.count)[0]/60.)
+
+if __name__ == "__main__":
+   unittest.main()
@@ -45,6 +45,28 @@ class TestTimePrefs(unittest.TestCase):
          # 0.98 factor allows for 2% downward fluctation for unoverlapping samples
          self.assertTrue(expect*0.98 < actual)
 
+   def test_satisfaction_prob_array(self):
+      arrivals = [today_at(9, 00), today_at(12, 15), today_at(23, 00)]
+      probs = standard_time_pref.satisfaction_probability(
+            np.array([timing.datetime_2_ref(time) for time in arrivals]))
+      self.assertEqual(probs.shape, (3,))
+      for prob, arrival in zip(probs, arrivals):
+         self.assertAlmostEqual(prob,
+               standard_time_pref.satisfaction_probability(arrival))
+
+   def test_random_array(self):
+      array = standard_time_pref.random(size=10000)
+      self.assertEqual(array.shape, (10000,))
+      self.assertTrue((standard_time_pref.satisfaction_probability(array)
+                       > 0).all())
+      self.check_sample(standard_time_pref, array)
+
+   def test_from_uniform(self):
+      throws = (np.arange(10000) + 0.5)/10000
+      array = standard_time_pref.from_uniform(throws)
+      self.assertTrue((np.diff(array[:5000]) > 0).all())
+      self.check_sample(standard_time_pref, array)
+
    def test_all_on_time(self):
       array = np.array( [standard_time_pref.random() for i in range(10000)] )
       self.assertEqual(np.sum(np.vectorize(standard_time_pref.on_time)(array)),
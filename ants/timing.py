@@ -107,15 +107,46 @@ class TimePreferences(object):
         self.prefs[:] = [pref/norm for pref in self.prefs]
         self.windows_and_prefs = zip(self.prefs, self.windows)
         self.cum_prefs = numpy.cumsum(self.prefs)
+
+        # Compact array form of the windows (in ref time) and preferences
+        self.window_starts = numpy.array(
+            [window.start_ref for window in self.windows])
+        self.window_ends = numpy.array(
+            [window.end_ref for window in self.windows])
+        self.window_prefs = numpy.array(self.prefs)
       
     # Make the stochastic function that can be used to determine the expected
     # 'ideal' arrival_time distribution from the window preferences and the
     # window distributions
-    def random(self):
-        ''' Generate a random arrival time consistent with preferences '''
-        time_window = numpy.searchsorted(self.cum_prefs, numpy.random.rand())
-        return self.windows[time_window].random()
-   
+    def random(self, size=None):
+        ''' Generate a random arrival time consistent with preferences
+
+        If size is given, returns an array of size random arrival times.
+        '''
+        throws = numpy.random.rand(size) if size is not None \
+                else numpy.random.rand()
+        time_windows = numpy.minimum(
+            numpy.searchsorted(self.cum_prefs, throws), len(self.windows)-1)
+        return numpy.random.uniform(self.window_starts[time_windows],
+                                    self.window_ends[time_windows])
+
+    def from_uniform(self, throws):
+        ''' Arrival times consistent with preferences, from uniform throws
+
+        The inverse of the arrival time cdf that random draws from, so
+        stratified or antithetic throws give stratified arrival times.
+        '''
+        throws = numpy.asarray(throws, dtype=float)
+        time_windows = numpy.minimum(
+            numpy.searchsorted(self.cum_prefs, throws), len(self.windows)-1)
+        prefs = self.window_prefs[time_windows]
+        # Position of the throw within the share of its window
+        fraction = numpy.clip(
+            (throws - self.cum_prefs[time_windows] + prefs)/
+            numpy.maximum(prefs, 1e-300), 0., 1.)
+        starts = self.window_starts[time_windows]
+        return starts + fraction*(self.window_ends[time_windows] - starts)
+
     def n_random(self, count):
         ''' Generator to yield a series of random numbers '''
         i = 0
@@ -131,7 +162,17 @@ class TimePreferences(object):
         return False
 
     def satisfaction_probability(self, arrival_time):
-        ''' Probability that this arrival time satisfies this time preference'''
-        return sum(pref for pref, window in self.windows_and_prefs 
-                if window.on_time(arrival_time) )
+        ''' Probability that this arrival time satisfies this time preference
+
+        Also takes an array of arrival times in ref time, returning an array
+        of probabilities.
+        '''
+        if isinstance(arrival_time, dt.datetime):
+            arrival_time = datetime_2_ref(arrival_time)
+        times = numpy.asarray(arrival_time, dtype=float)[..., numpy.newaxis]
+        on_time = (times >= self.window_starts) & (times <= self.window_ends)
+        probability = numpy.dot(on_time, self.window_prefs)
+        if numpy.ndim(arrival_time) == 0:
+            return float(probability)
+        return probability
 